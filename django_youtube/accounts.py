@@ -0,0 +1,304 @@
+"""
+Routing of the Youtube calls to several accounts
+
+Accounts are configured with weights and daily quotas in quota units
+
+    YOUTUBE_ACCOUNTS = {
+        "main": {"email": "main@example.com", "password": "...",
+                 "weight": 2, "quota": 1000000},
+        "spare": {"email": "spare@example.com", "password": "...",
+                  "weight": 1, "quota": 500000},
+    }
+
+Each account logs in once per process, every thread gets its own service
+with the token of the account, it logs in again when the token expires.
+Uploads are placed on the account with the lowest load per weight among the
+ones with enough quota left, the other calls go to the account owning the
+video. Videos uploaded before `YOUTUBE_ACCOUNTS` belong to the default
+account, `YOUTUBE_DEFAULT_ACCOUNT` or the one with `YOUTUBE_AUTH_EMAIL`.
+Without `YOUTUBE_ACCOUNTS`, `YOUTUBE_AUTH_EMAIL` and `YOUTUBE_AUTH_PASSWORD`
+are used as before and nothing is routed.
+"""
+import contextlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from django_youtube.budget import remote_call
+
+# quota units of the calls, every other call costs DEFAULT_COST
+COSTS = {
+    "InsertVideoEntry": 1600,
+    "GetFormUploadToken": 1600,
+    "UpdateVideoEntry": 50,
+    "DeleteVideoEntry": 50,
+}
+DEFAULT_COST = 1
+UPLOAD_COST = COSTS["InsertVideoEntry"]
+
+# calls of the uploads, charged when the upload is placed
+UPLOAD_METHODS = ("InsertVideoEntry", "GetFormUploadToken")
+
+# seconds to keep the daily quota usage
+QUOTA_TIMEOUT = 2 * 24 * 60 * 60
+
+
+class Account(object):
+    """
+    Youtube account with its credentials, services and quota usage
+
+    Params:
+        name: name of the account, recorded on the videos
+        weight: share of the uploads relative to the other accounts
+        quota: quota units per day, None if unlimited
+    """
+
+    def __init__(self, name, email, password, weight=1, quota=None,
+                 source=None):
+        self.name = name
+        self.email = email
+        self.password = password
+        self.weight = weight
+        self.quota = quota
+        self.source = source
+        self.token = None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _login(self):
+        """
+        Returns the client login token, logs in on the first call
+
+        Raises:
+            ApiError: on wrong credentials
+        """
+        from gdata.service import BadAuthentication
+        from django_youtube.api import Api, ApiError
+
+        with self.lock:
+            if self.token is None:
+                service = Api.new_service(self.source)
+                service.email = self.email
+                service.password = self.password
+                try:
+                    remote_call("ProgrammaticLogin",
+                                service.ProgrammaticLogin)
+                except BadAuthentication:
+                    raise ApiError(_("Incorrect username or password"))
+                self.token = service.GetClientLoginToken()
+            return self.token
+
+    def service(self):
+        """
+        Returns the authenticated service of the calling thread
+        gdata services are not thread safe
+        """
+        service = getattr(self.local, "service", None)
+        if service is None or service.GetClientLoginToken() != self.token:
+            from django_youtube.api import Api
+
+            service = Api.new_service(self.source)
+            service.SetClientLoginToken(self._login())
+            self.local.service = service
+        return service
+
+    def expire_token(self, token):
+        """
+        Drops the expired token, the next service logs in again
+        Threads using the same token log in only once
+        """
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+    def _quota_key(self):
+        # Youtube resets the quotas daily
+        return "django_youtube:quota:%s:%s" % (
+            self.name, timezone.now().strftime("%Y%m%d"))
+
+    def used(self):
+        """
+        Returns the quota units used today, by all processes
+        """
+        return cache.get(self._quota_key(), 0)
+
+    def remaining(self):
+        """
+        Returns the quota units left for today, None if unlimited
+        """
+        if self.quota is None:
+            return None
+        return max(self.quota - self.used(), 0)
+
+    def _incr(self, cost):
+        key = self._quota_key()
+        cache.add(key, 0, QUOTA_TIMEOUT)
+        try:
+            return cache.incr(key, cost)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, cost, QUOTA_TIMEOUT)
+            return cost
+
+    def charge(self, method):
+        """
+        Counts the quota cost of the call
+        """
+        self._incr(COSTS.get(method, DEFAULT_COST))
+
+    def reserve(self, cost):
+        """
+        Counts `cost` quota units if they are left, the check and the count
+        are atomic across processes
+
+        Returns:
+            True if reserved, False if the quota would be exceeded
+        """
+        used = self._incr(cost)
+        if self.quota is not None and used > self.quota:
+            # roll back, the units are not used
+            try:
+                cache.decr(self._quota_key(), cost)
+            except ValueError:
+                pass
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def busy(self):
+        """
+        Counts the running uploads of the account in this process
+        """
+        with self.lock:
+            self.in_flight += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def load(self):
+        return (self.in_flight + 1.0) / self.weight
+
+
+_accounts = None
+_accounts_lock = threading.Lock()
+
+
+def is_routed():
+    """
+    Returns True if `YOUTUBE_ACCOUNTS` setting is set
+    """
+    return bool(getattr(settings, "YOUTUBE_ACCOUNTS", None))
+
+
+def accounts():
+    """
+    Returns the configured accounts, keyed by name
+    """
+    global _accounts
+
+    with _accounts_lock:
+        if _accounts is None:
+            try:
+                source = settings.YOUTUBE_CLIENT_ID
+            except AttributeError:
+                source = None
+
+            _accounts = {}
+            for name, options in settings.YOUTUBE_ACCOUNTS.items():
+                _accounts[name] = Account(
+                    name, options["email"], options["password"],
+                    options.get("weight", 1), options.get("quota"),
+                    options.get("source", source))
+        return _accounts
+
+
+def get_account(name):
+    """
+    Raises:
+        OperationError: if the account is not configured
+    """
+    from django_youtube.api import OperationError
+
+    try:
+        return accounts()[name]
+    except KeyError:
+        raise OperationError(_("Youtube account %s is not configured") % name)
+
+
+def default_account():
+    """
+    Returns the account of the videos uploaded before `YOUTUBE_ACCOUNTS`,
+    `YOUTUBE_DEFAULT_ACCOUNT` setting, the account with `YOUTUBE_AUTH_EMAIL`
+    or the only account
+
+    Raises:
+        OperationError: if there is no default account
+    """
+    from django_youtube.api import OperationError
+
+    try:
+        return get_account(settings.YOUTUBE_DEFAULT_ACCOUNT)
+    except AttributeError:
+        pass
+
+    email = getattr(settings, "YOUTUBE_AUTH_EMAIL", None)
+    for account in accounts().values():
+        if email and account.email == email:
+            return account
+    if len(accounts()) == 1:
+        return list(accounts().values())[0]
+    raise OperationError(_("YOUTUBE_DEFAULT_ACCOUNT setting is missing"))
+
+
+def owner_account(name):
+    """
+    Returns the name of the account owning a video, the default account if
+    the `account` of the video is None
+
+    Params:
+        name: `account` field of the video
+
+    Returns:
+        None if the accounts are not configured
+    """
+    if name is not None or not is_routed():
+        return name
+    return default_account().name
+
+
+def choose_account(cost=DEFAULT_COST, reserve=False):
+    """
+    Returns the account with the lowest load per weight among the ones with
+    `cost` quota units left, the one with more quota left on ties
+
+    Params:
+        reserve: count the `cost` on the quota of the chosen account
+
+    Raises:
+        AccountQuotaExceeded: if no account has enough quota left
+    """
+    from django_youtube.api import AccountQuotaExceeded
+
+    candidates = []
+    for account in accounts().values():
+        remaining = account.remaining()
+        if remaining is None:
+            candidates.append((account.load(), -1.0, account.name, account))
+        elif remaining >= cost:
+            candidates.append((account.load(),
+                               -float(remaining) / account.quota,
+                               account.name, account))
+
+    for candidate in sorted(candidates):
+        account = candidate[-1]
+        # another process might have used the quota since the check
+        if not reserve or account.reserve(cost):
+            return account
+    raise AccountQuotaExceeded(
+        _("No Youtube account has enough quota left"))
@@ -1,5 +1,27 @@
 import models
+from django.conf import settings
+from django.conf.urls import url
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404, render_to_response
+from django.template import RequestContext
+from django.utils.html import format_html
+from django.utils.translation import ugettext as _
+
+from django_youtube import jobs
+
+
+def _async():
+    """
+    Returns True if the admin edits are synced with Youtube in the
+    background, `YOUTUBE_ADMIN_ASYNC` setting
+    """
+    try:
+        return settings.YOUTUBE_ADMIN_ASYNC
+    except AttributeError:
+        return False
 
 
 class ThumbnailInline(admin.StackedInline):
@@ -9,13 +31,102 @@ class ThumbnailInline(admin.StackedInline):
 
 
 class VideoAdmin(admin.ModelAdmin):
-    readonly_fields = ('video_id', 'youtube_url', 'swf_url',)
+    readonly_fields = ('video_id', 'youtube_url', 'swf_url', 'account',)
     inlines = [ThumbnailInline]
-    list_filter = ('title', 'user__username',)
+    list_filter = ('title', 'user__username', 'account',)
     search_fields = ['title', 'user__first_name', 'user__email',
                      'user__username', 'keywords', ]
 
-    list_display = ('title', 'video_id', 'swf',)
+    list_display = ('title', 'video_id', 'user', 'thumbnails',
+                    'sync_pending', 'swf',)
+    list_select_related = ('user',)
+    actions = ['refresh_from_youtube', 'set_unlisted', 'delete_remotely']
+
+    def get_queryset(self, request):
+        queryset = super(VideoAdmin, self).get_queryset(request)
+        return queryset.annotate(thumbnail_count=Count('thumbnail'))
+
+    def thumbnails(self, instance):
+        return instance.thumbnail_count
+    thumbnails.admin_order_field = 'thumbnail_count'
+
+    def save_model(self, request, obj, form, change):
+        """
+        Saves the row only and syncs it with Youtube in the background if
+        `YOUTUBE_ADMIN_ASYNC` is set
+        """
+        if _async():
+            obj.save(sync=False)
+        else:
+            obj.save()
+
+    def get_urls(self):
+        urls = [
+            url(r'^jobs/(?P<job_id>\d+)/$',
+                self.admin_site.admin_view(self.job_view),
+                name='django_youtube_videojob_progress'),
+        ]
+        return urls + super(VideoAdmin, self).get_urls()
+
+    def job_view(self, request, job_id):
+        """
+        Progress page of a background job, reloads itself until it's finished
+        or stale
+        """
+        job = get_object_or_404(models.VideoJob, id=job_id)
+        return render_to_response(
+            "django_youtube/admin/job.html",
+            {"job": job, "title": job, "opts": self.model._meta,
+             "errors": job.errors.splitlines(), "stale": job.is_stale()},
+            context_instance=RequestContext(request)
+        )
+
+    def _start_job(self, request, action, queryset):
+        job = jobs.start(action, queryset, request.user)
+        self.message_user(request, format_html(
+            _('{0} videos are queued, see the <a href="{1}">progress</a>.'),
+            job.total,
+            reverse('admin:django_youtube_videojob_progress',
+                    kwargs={'job_id': job.id})))
+
+    def refresh_from_youtube(self, request, queryset):
+        self._start_job(request, 'refresh', queryset)
+    refresh_from_youtube.short_description = _("Refresh from Youtube")
+
+    def set_unlisted(self, request, queryset):
+        self._start_job(request, 'unlisted', queryset)
+    set_unlisted.short_description = _("Set unlisted")
+
+    def delete_remotely(self, request, queryset):
+        self._start_job(request, 'delete', queryset)
+    delete_remotely.short_description = _(
+        "Delete from Youtube and the database")
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Uses the full-text index if available instead of `icontains` scans
+        """
+        from django_youtube.fulltext import search
+
+        if search_term:
+            results = search(queryset, search_term)
+            if results is not None:
+                # fields of the user are not in the index, prefix matches
+                # can use the indexes of the user table
+                user_lookup = Q()
+                for field in self.search_fields:
+                    if field.startswith("user__"):
+                        user_lookup |= Q(**{"%s__startswith" % field[6:]:
+                                            search_term})
+                if user_lookup:
+                    user_ids = list(get_user_model()._default_manager.filter(
+                        user_lookup).values_list("pk", flat=True))
+                    if user_ids:
+                        results = results | queryset.filter(
+                            user__in=user_ids)
+                return results, False
+        return super(VideoAdmin, self).get_search_results(
+            request, queryset, search_term)
 
     def swf(self, instance):
         return '<a href="%s">Swf link</a>' % (instance.get_absolute_url())
@@ -23,3 +134,26 @@ class VideoAdmin(admin.ModelAdmin):
 
 
 admin.site.register(models.Video, VideoAdmin)
+
+
+class VideoJobAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'state', 'total', 'done', 'failed',
+                    'user', 'progress_link',)
+    list_filter = ('action', 'state',)
+    list_select_related = ('user',)
+    readonly_fields = ('action', 'state', 'user', 'total', 'done', 'failed',
+                       'errors', 'updated_at', 'finished_at',)
+    exclude = ('video_ids',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress_link(self, instance):
+        return '<a href="%s">%d%%</a>' % (
+            reverse('admin:django_youtube_videojob_progress',
+                    kwargs={'job_id': instance.id}), instance.progress())
+    progress_link.allow_tags = True
+    progress_link.short_description = _("Progress")
+
+
+admin.site.register(models.VideoJob, VideoJobAdmin)
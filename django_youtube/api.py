@@ -1,9 +1,17 @@
+import logging
 import os
+import re
+import threading
+import time
 
 import gdata.youtube.service
 from django.conf import settings
+from django.core.cache import cache
+from django_youtube.budget import remote_call
 from django.utils.translation import ugettext as _
 
+logger = logging.getLogger(__name__)
+
 
 class OperationError(BaseException):
     """
@@ -20,6 +28,26 @@ class ApiError(BaseException):
     pass
 
 
+class ApiCallBudgetExceeded(OperationError):
+    """
+    Raise when more requests are sent to Youtube than allowed by the budget
+    See `django_youtube.budget`
+    """
+    pass
+
+
+class AccountQuotaExceeded(OperationError):
+    """
+    Raise when no Youtube account has enough quota left for an upload
+    See `django_youtube.accounts`
+    """
+    pass
+
+
+# errors of the api derive from BaseException, catch them with the others
+API_ERRORS = (Exception, OperationError, ApiError)
+
+
 class AccessControl:
     """
     Enum-like structure to determine the permission of a video
@@ -27,6 +55,212 @@ class AccessControl:
     Public, Unlisted, Private = range(3)
 
 
+class RateLimiter(object):
+    """
+    Caps the throughput of the readers sharing the limiter
+    """
+
+    def __init__(self, rate):
+        """
+        Params:
+            rate: bytes per second
+        """
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def consume(self, size):
+        """
+        Blocks until `size` bytes can be sent
+        """
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class ProgressFile(object):
+    """
+    Read-only file wrapper that reports the read bytes and optionally
+    limits the read rate
+    gdata reads the video through this object while sending it to Youtube
+    """
+
+    def __init__(self, path, callback=None, limiter=None):
+        self.file = open(path, "rb")
+        self.name = os.path.basename(path)
+        self.len = os.path.getsize(path)
+        self.callback = callback
+        self.limiter = limiter
+        self.sent = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        if self.limiter and data:
+            self.limiter.consume(len(data))
+        self.sent += len(data)
+        if self.callback:
+            self.callback(self.sent, self.len)
+        return data
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+        self.sent = self.file.tell()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class _Flight(object):
+    """
+    A call in progress, waiters block on the event
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key into one call
+    Callers in the same process wait for the running call and share its
+    result, other processes wait on a short django cache lock and read the
+    result from the cache
+    """
+
+    # seconds that the result is kept for the waiting processes
+    result_timeout = 2
+
+    # seconds between the cache reads of the waiting processes
+    wait_interval = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.counters = {"calls": 0, "coalesced_local": 0,
+                         "coalesced_remote": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict of the counters i.e.
+            {"calls": 10, "coalesced_local": 4, "coalesced_remote": 2}
+            `calls` are the remote calls actually made
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def do(self, key, function, encode=None, decode=None):
+        """
+        Calls the function unless a call with the same key is in progress,
+        in which case waits for it and returns its result
+
+        Params:
+            encode, decode: convert the result to a picklable value and back
+                            to share it between processes
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            self._count("coalesced_local")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call(key, function, encode, decode)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+    def _call(self, key, function, encode, decode):
+        try:
+            timeout = settings.YOUTUBE_COALESCE_TIMEOUT
+        except AttributeError:
+            timeout = 10
+
+        if not timeout:
+            self._count("calls")
+            return function()
+
+        lock_key = "django_youtube:flight-lock:%s" % key
+        result_key = "django_youtube:flight-result:%s" % key
+
+        # another process is calling, wait for its result
+        acquired = cache.add(lock_key, 1, timeout)
+        if not acquired:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                value = cache.get(result_key)
+                if value is not None:
+                    self._count("coalesced_remote")
+                    return decode(value) if decode else value
+                if cache.get(lock_key) is None:
+                    break
+                time.sleep(self.wait_interval)
+
+        try:
+            self._count("calls")
+            result = function()
+            cache.set(result_key, encode(result) if encode else result,
+                      self.result_timeout)
+            return result
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+
+def video_id_from_entry(entry):
+    """
+    Parses the video id from the id element of the entry
+    i.e. http://gdata.youtube.com/feeds/api/videos/ID or
+    tag:youtube.com,2008:video:ID
+
+    getting video_id is tricky, the only option is to parse the id element
+    https://groups.google.com/forum/?fromgroups=#!topic/youtube-api-gdata/RRl_h4zuKDQ
+    """
+    return re.split(r"[/:]", entry.id.text.strip())[-1]
+
+
+def _is_token_expired(error):
+    """
+    Returns True if the gdata request error is caused by an expired or
+    revoked token
+    """
+    status = error.args[0] if error.args else None
+    return isinstance(status, dict) and status.get("status") == 401
+
+
+def _entry_to_string(entry):
+    return entry.ToString()
+
+
+def _entry_from_string(xml):
+    return gdata.youtube.YouTubeVideoEntryFromString(xml)
+
+
 class Api:
     """
     Wrapper for Youtube API
@@ -36,7 +270,17 @@ class Api:
     # Service class is a shared resource
     yt_service = gdata.youtube.service.YouTubeService()
 
-    def __init__(self):
+    # Concurrent reads of the same video share one remote call
+    flights = SingleFlight()
+
+    def __init__(self, account=None):
+        """
+        Params:
+            account: name of the account in `YOUTUBE_ACCOUNTS` setting,
+                     the calls of the instance go to it. If not set, uploads
+                     are placed on an account by load and quota and the
+                     instance is bound to it, see `django_youtube.accounts`
+        """
         try:
             self.developer_key = settings.YOUTUBE_DEVELOPER_KEY
         except AttributeError:
@@ -58,8 +302,89 @@ class Api:
         if self.client_id:
             Api.yt_service.client_id = self.client_id
 
+        self.account = account
+        self._account = None
+        # upload cost counted on the quota when the upload is placed
+        self._prepaid = False
         self.authenticated = False
 
+    @classmethod
+    def new_service(cls, source=None):
+        """
+        Returns a new service configured like the shared one,
+        not authenticated
+        """
+        service = gdata.youtube.service.YouTubeService()
+        service.ssl = cls.yt_service.ssl
+        service.developer_key = cls.yt_service.developer_key
+        service.client_id = cls.yt_service.client_id
+        service.source = source or cls.yt_service.source
+        return service
+
+    def _bind(self, account):
+        """
+        Sends the calls of the instance to the account
+        """
+        self._account = account
+        self.yt_service = account.service()
+        self.authenticated = True
+
+    def _account_name(self):
+        return self._account.name if self._account is not None else ""
+
+    def _call(self, method, *args):
+        """
+        Calls the method of the service, counts it on the quota of the account
+        """
+        from django_youtube.accounts import UPLOAD_METHODS
+
+        if self._account is None:
+            return remote_call(method, getattr(self.yt_service, method), *args)
+
+        if method in UPLOAD_METHODS and self._prepaid:
+            self._prepaid = False
+        else:
+            self._account.charge(method)
+        try:
+            return remote_call(method, getattr(self.yt_service, method), *args)
+        except gdata.service.RequestError as e:
+            if not _is_token_expired(e):
+                raise
+            # log in again and retry once
+            self._account.expire_token(self.yt_service.GetClientLoginToken())
+            self.yt_service = self._account.service()
+            return remote_call(method, getattr(self.yt_service, method), *args)
+
+    def _place_upload(self):
+        """
+        Chooses the account of an upload unless the instance is bound to one
+        by the `account` parameter, the instance is bound to the chosen one
+        The cost of the upload is counted on the quota of the account
+
+        Returns:
+            the account, None if the accounts are not configured
+
+        Raises:
+            AccountQuotaExceeded: if the account has not enough quota left
+        """
+        from django_youtube.accounts import UPLOAD_COST, choose_account
+
+        if self._account is None:
+            return None
+
+        if self.account is not None:
+            if not self._account.reserve(UPLOAD_COST):
+                raise AccountQuotaExceeded(
+                    _("Youtube account %s has not enough quota left") %
+                    self.account)
+            account = self._account
+        else:
+            account = choose_account(UPLOAD_COST, reserve=True)
+            self._bind(account)
+            self.account = account.name
+        self._prepaid = True
+        return account
+
     def _access_control(self, access_control, my_media_group=None):
         """
         Prepares the extension element for access control
@@ -87,12 +412,22 @@ class Api:
             extension = ([ExtensionElement('accessControl', **kwargs)])
         return extension
 
-    def fetch_video(self, video_id):
+    def fetch_video(self, video_id, coalesce=True):
         """
         Retrieve a specific video entry and return it
+        Concurrent calls for the same video share the entry unless
+        `coalesce` is False, don't modify a shared entry
         @see http://gdata-python-client.googlecode.com/hg/pydocs/gdata.youtube.html#YouTubeVideoEntry
         """
-        return Api.yt_service.GetYouTubeVideoEntry('http://gdata.youtube.com/feeds/api/users/default/uploads/%s' % video_id)
+        def fetch():
+            return self._call("GetYouTubeVideoEntry", 'http://gdata.youtube.com/feeds/api/users/default/uploads/%s' % video_id)
+
+        if not coalesce:
+            return fetch()
+
+        # "default" is the authenticated account, it's a part of the key
+        return Api.flights.do("fetch_video:%s:%s" % (self._account_name(), video_id), fetch,
+                              _entry_to_string, _entry_from_string)
 
     def fetch_feed_by_username(self, username):
         """
@@ -103,34 +438,50 @@ class Api:
         # Don't use trailing slash
         youtube_url = 'http://gdata.youtube.com/feeds/api'
         uri = os.sep.join([youtube_url, "users", username, "uploads"])
-        return Api.yt_service.GetYouTubeVideoFeed(uri)
+        return self._call("GetYouTubeVideoFeed", uri)
 
     def authenticate(self, email=None, password=None, source=None):
         """
         Authenticates the user and sets the GData Auth token.
         All params are optional, if not set, we will use the ones on the settings, if no settings found, raises AttributeError
         params are email, password and source. Source is the app id
+        If `YOUTUBE_ACCOUNTS` setting is set and no credentials are given,
+        the account of the instance (or the least loaded one) is used, it
+        logs in once per process
 
         Raises:
             gdata.service.exceptions.BadAuthentication
         """
         from gdata.service import BadAuthentication
+        from django_youtube import accounts
+
+        if not email and not password and accounts.is_routed():
+            if self.account is not None:
+                self._bind(accounts.get_account(self.account))
+            else:
+                self._bind(accounts.choose_account())
+            return
 
         # Auth parameters
-        Api.yt_service.email = email if email else settings.YOUTUBE_AUTH_EMAIL
-        Api.yt_service.password = password if password else settings.YOUTUBE_AUTH_PASSWORD
-        Api.yt_service.source = source if source else settings.YOUTUBE_CLIENT_ID
+        self.yt_service.email = email if email else settings.YOUTUBE_AUTH_EMAIL
+        self.yt_service.password = password if password else settings.YOUTUBE_AUTH_PASSWORD
+        self.yt_service.source = source if source else settings.YOUTUBE_CLIENT_ID
         try:
-            Api.yt_service.ProgrammaticLogin()
+            remote_call("ProgrammaticLogin", self.yt_service.ProgrammaticLogin)
             self.authenticated = True
         except BadAuthentication:
             raise ApiError(_("Incorrect username or password"))
 
-    def upload_direct(self, video_path, title, description="", keywords="", developer_tags=None, access_control=AccessControl.Public):
+    def upload_direct(self, video_path, title, description="", keywords="", developer_tags=None, access_control=AccessControl.Public, progress_callback=None, limiter=None):
         """
         Direct upload method:
             Uploads the video directly from your server to Youtube and creates a video
 
+        Params:
+            progress_callback: optional, called with (sent_bytes, total_bytes)
+                               while the file is sent
+            limiter: optional `RateLimiter` to cap the bandwidth
+
         Returns:
             gdata.youtube.YouTubeVideoEntry
 
@@ -159,10 +510,155 @@ class Api:
         if developer_tags:
             video_entry.AddDeveloperTags(developer_tags)
 
+        account = self._place_upload()
+
         # upload the video and create a new entry
-        new_entry = Api.yt_service.InsertVideoEntry(video_entry, video_path)
+        if progress_callback is None and limiter is None:
+            video_file = video_path
+        else:
+            video_file = ProgressFile(video_path, progress_callback, limiter)
+        try:
+            if account is None:
+                return self._call("InsertVideoEntry", video_entry, video_file)
+            with account.busy():
+                return self._call("InsertVideoEntry", video_entry, video_file)
+        finally:
+            if video_file is not video_path:
+                video_file.close()
+
+    def _worker(self):
+        """
+        Returns a new Api instance with its own service, authenticated with
+        the token of this instance
+        gdata services are not thread safe, each upload thread needs one
+        With `YOUTUBE_ACCOUNTS`, the worker uses the service of its thread
+        and places its next upload again unless the instance has an account
+        """
+        if self._account is not None:
+            worker = Api(self.account)
+            worker.authenticate()
+            return worker
+
+        service = Api.new_service(self.yt_service.source)
+        service.SetClientLoginToken(self.yt_service.GetClientLoginToken())
+
+        worker = Api()
+        worker.yt_service = service
+        worker.authenticated = True
+        return worker
 
-        return new_entry
+    def upload_many(self, videos, workers=4, retries=3, max_rate=None, callback=None):
+        """
+        Uploads many videos directly from your server, several at once
+
+        Authentication is required
+
+        Params:
+            videos: list of dicts with the arguments of `upload_direct`
+                    i.e. [{"video_path": "/tmp/a.mp4", "title": "a"}, ...]
+            workers: number of concurrent uploads
+            retries: attempts per file
+            max_rate: optional, total bandwidth cap in bytes per second
+            callback: optional, called with each result as soon as the file
+                      is finished, from the upload threads
+
+        Returns:
+            list of dicts in the order of `videos`, i.e.
+            {"video_path": "/tmp/a.mp4", "video_id": "abc", "entry": entry,
+             "error": None, "attempts": 1, "bytes": 1024, "seconds": 2.0,
+             "throughput": 512.0, "account": "main"}
+            `account` is the account of the upload, None without
+            `YOUTUBE_ACCOUNTS` setting
+            `video_id` and `entry` are None and `error` is set on failure,
+            uploads are not retried after `AccountQuotaExceeded`
+
+        Raises:
+            ApiError: on no authentication
+        """
+        try:
+            from Queue import Queue, Empty
+        except ImportError:
+            from queue import Queue, Empty
+
+        # Raise ApiError if not authenticated
+        if not self.authenticated:
+            raise ApiError(_("Authentication is required"))
+
+        limiter = RateLimiter(max_rate) if max_rate else None
+        queue = Queue()
+        for index, video in enumerate(videos):
+            queue.put((index, video))
+        results = [None] * len(videos)
+
+        def new_result(video):
+            return {"video_path": video["video_path"], "video_id": None,
+                    "entry": None, "error": None, "attempts": 0,
+                    "account": None, "bytes": 0, "seconds": 0,
+                    "throughput": 0}
+
+        def upload(api, video):
+            result = new_result(video)
+            result["bytes"] = os.path.getsize(video["video_path"])
+            started = time.time()
+            for attempt in range(1, retries + 1):
+                result["attempts"] = attempt
+                try:
+                    entry = api.upload_direct(limiter=limiter, **video)
+                    result["entry"] = entry
+                    result["video_id"] = video_id_from_entry(entry)
+                    result["account"] = api.account
+                    result["error"] = None
+                    break
+                except AccountQuotaExceeded as e:
+                    # the quota is not back before the next attempt
+                    result["error"] = "%s: %s" % (e.__class__.__name__, e)
+                    break
+                except API_ERRORS as e:
+                    result["error"] = "%s: %s" % (e.__class__.__name__, e)
+                    if attempt < retries:
+                        # back off before the next attempt
+                        time.sleep(2 ** (attempt - 1))
+            result["seconds"] = time.time() - started
+            result["throughput"] = result["bytes"] / result["seconds"] \
+                if result["seconds"] and result["video_id"] else 0
+            return result
+
+        def work():
+            api = None
+            while True:
+                try:
+                    index, video = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    if api is None or (api.account is not None and
+                                       self.account is None):
+                        # the worker is bound by its last upload, place again
+                        api = self._worker()
+                    results[index] = upload(api, video)
+                except API_ERRORS as e:
+                    # i.e. no account to place the upload, every video gets
+                    # a result
+                    api = None
+                    results[index] = new_result(video)
+                    results[index]["error"] = "%s: %s" % (
+                        e.__class__.__name__, e)
+                if callback:
+                    try:
+                        callback(results[index])
+                    except Exception as e:
+                        logger.error("Callback of %s failed: %s - %s" % (
+                            video["video_path"], e.__class__.__name__, e))
+
+        threads = [threading.Thread(target=work)
+                   for i in range(min(workers, len(videos)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
 
     def upload(self, title, description="", keywords="", developer_tags=None, access_control=AccessControl.Public):
         """
@@ -211,8 +707,13 @@ class Api:
         if developer_tags:
             video_entry.AddDeveloperTags(developer_tags)
 
-        # upload meta data only
-        response = Api.yt_service.GetFormUploadToken(video_entry)
+        # upload meta data only, the browser uploads the file to the account
+        account = self._place_upload()
+        if account is None:
+            response = self._call("GetFormUploadToken", video_entry)
+        else:
+            with account.busy():
+                response = self._call("GetFormUploadToken", video_entry)
 
         # parse response tuple and use the variables to build a form
         post_url = response[0]
@@ -236,15 +737,18 @@ class Api:
         if not self.authenticated:
             raise ApiError(_("Authentication is required"))
 
-        entry = self.fetch_video(video_id)
-        upload_status = Api.yt_service.CheckUploadStatus(entry)
+        def check():
+            entry = self.fetch_video(video_id)
+            upload_status = self.yt_service.CheckUploadStatus(entry)
 
-        if upload_status is not None:
-            video_upload_state = upload_status[0]
-            detailed_message = upload_status[1]
-            return {"upload_state": video_upload_state, "detailed_message": detailed_message}
-        else:
-            return True
+            if upload_status is not None:
+                video_upload_state = upload_status[0]
+                detailed_message = upload_status[1]
+                return {"upload_state": video_upload_state, "detailed_message": detailed_message}
+            else:
+                return True
+
+        return Api.flights.do("check_upload_status:%s:%s" % (self._account_name(), video_id), check)
 
     def update_video(self, video_id, title="", description="", keywords="", access_control=AccessControl.Unlisted):
         """
@@ -267,7 +771,8 @@ class Api:
         if not self.authenticated:
             raise ApiError(_("Authentication is required"))
 
-        entry = self.fetch_video(video_id)
+        # the entry is modified, don't share it
+        entry = self.fetch_video(video_id, coalesce=False)
 
         # Set Access Control
         extension = self._access_control(access_control)
@@ -283,7 +788,7 @@ class Api:
         #if keywords:
         #    entry.media.keywords.text = keywords
 
-        success = Api.yt_service.UpdateVideoEntry(entry)
+        success = self._call("UpdateVideoEntry", entry)
         return success
         #if success is None:
         #    raise OperationError(_("Cannot update video on Youtube"))
@@ -307,8 +812,8 @@ class Api:
         if not self.authenticated:
             raise ApiError(_("Authentication is required"))
 
-        entry = self.fetch_video(video_id)
-        response = Api.yt_service.DeleteVideoEntry(entry)
+        entry = self.fetch_video(video_id, coalesce=False)
+        response = self._call("DeleteVideoEntry", entry)
 
         if not response:
             raise OperationError(_("Cannot be deleted from Youtube"))
@@ -0,0 +1,150 @@
+"""
+Counting and timing of the requests sent to Youtube
+
+`api_call_budget()` records the requests made by the current thread, i.e.
+during a request with `ApiCallBudgetMiddleware`, and optionally enforces a
+maximum number of them. The debug toolbar panel in `django_youtube.panels`
+shows the recorded calls.
+"""
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _recorders():
+    if not hasattr(_local, "recorders"):
+        _local.recorders = []
+    return _local.recorders
+
+
+class ApiCallRecorder(object):
+    """
+    Calls recorded in a budget scope
+
+    Params:
+        limit: max. number of calls, None for unlimited
+        action: `log` logs a warning, `raise` raises ApiCallBudgetExceeded
+                when the limit is exceeded
+        collect_stacks: keep the call stack of every call
+    """
+
+    def __init__(self, limit=None, action="log", collect_stacks=False,
+                 name=None):
+        self.limit = limit
+        self.action = action
+        self.collect_stacks = collect_stacks
+        self.name = name
+        self.calls = []
+        self.warned = False
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def total_time(self):
+        return sum(call["duration"] for call in self.calls)
+
+    @property
+    def exceeded(self):
+        return self.limit is not None and self.count > self.limit
+
+    def check(self, method):
+        """
+        Called before a call, enforces the limit
+        """
+        if self.limit is None or self.count < self.limit:
+            return
+
+        message = "Youtube API call budget of %d exceeded by %s%s" % (
+            self.limit, method, " in %s" % self.name if self.name else "")
+        if self.action == "raise":
+            from django_youtube.api import ApiCallBudgetExceeded
+            raise ApiCallBudgetExceeded(message)
+        if not self.warned:
+            self.warned = True
+            logger.warning(message)
+
+    def summary(self):
+        """
+        Returns:
+            dict i.e. {"count": 2, "total_time": 0.5, "limit": 3,
+                       "methods": {"GetYouTubeVideoEntry": 1, ...}}
+        """
+        methods = {}
+        for call in self.calls:
+            methods[call["method"]] = methods.get(call["method"], 0) + 1
+        return {"count": self.count, "total_time": self.total_time,
+                "limit": self.limit, "methods": methods}
+
+
+@contextmanager
+def api_call_budget(limit=None, action="log", collect_stacks=False,
+                    name=None):
+    """
+    Records the requests sent to Youtube by the current thread
+
+    Usage:
+        with api_call_budget(limit=2, action="raise") as calls:
+            video.entry()
+        print calls.count, calls.total_time
+    """
+    recorder = ApiCallRecorder(limit, action, collect_stacks, name)
+    start_recording(recorder)
+    try:
+        yield recorder
+    finally:
+        stop_recording(recorder)
+
+
+def start_recording(recorder):
+    _recorders().append(recorder)
+
+
+def stop_recording(recorder):
+    recorders = _recorders()
+    if recorder in recorders:
+        recorders.remove(recorder)
+
+
+def remote_call(method, function, *args, **kwargs):
+    """
+    Calls the function of the gdata service, recording it in the active
+    budgets of the thread
+    """
+    recorders = _recorders()
+    if not recorders:
+        return function(*args, **kwargs)
+
+    for recorder in recorders:
+        recorder.check(method)
+
+    stack = None
+    if any(recorder.collect_stacks for recorder in recorders):
+        # skip this frame
+        stack = traceback.format_stack()[:-1]
+
+    error = None
+    started = time.time()
+    try:
+        return function(*args, **kwargs)
+    except BaseException as e:
+        error = "%s: %s" % (e.__class__.__name__, e)
+        raise
+    finally:
+        call = {
+            "method": method,
+            "args": ", ".join(repr(arg)[:200] for arg in args
+                              if isinstance(arg, (str, type(u""), int))),
+            "duration": time.time() - started,
+            "error": error,
+            "stack": stack,
+        }
+        for recorder in recorders:
+            recorder.calls.append(call)
@@ -0,0 +1,351 @@
+"""
+Export and import of the video catalog as json lines or csv
+
+Videos are read in chunks by primary key with their thumbnails, and written
+in batches, so the memory use doesn't grow with the size of the catalog.
+`manage.py youtube_export` and `manage.py youtube_import` use these.
+No request is sent to Youtube and no signal is sent.
+"""
+import csv
+import gzip
+import io
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from django_youtube.models import Thumbnail, Video
+
+PY2 = sys.version_info[0] == 2
+
+# exported fields of the video, the owner is exported by username
+FIELDS = ("video_id", "username", "title", "description", "keywords",
+          "youtube_url", "swf_url", "access_control", "account",
+          "upload_state", "upload_state_message", "content_hash",
+          "synced_at", "entry_fetched_at")
+
+# the snapshot of the entry is large, exported on demand
+ENTRY_FIELDS = ("entry_data",)
+
+DATETIME_FIELDS = ("synced_at", "entry_fetched_at")
+
+FORMATS = ("jsonl", "csv")
+
+
+def detect_format(path):
+    """
+    Returns the format by the extension of the path, None if unknown
+    """
+    if path.endswith(".gz"):
+        path = path[:-3]
+    for format in FORMATS:
+        if path.endswith("." + format):
+            return format
+    return None
+
+
+def open_file(path, mode, compress=None):
+    """
+    Opens the file as a text stream, "-" is stdin or stdout
+    Gzipped if `compress` is True or the path ends with .gz
+
+    Params:
+        mode: "r" or "w"
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        stream = getattr(stream, "buffer", stream)
+    else:
+        stream = open(path, mode + "b")
+    if compress:
+        stream = gzip.GzipFile(fileobj=stream, mode=mode + "b")
+
+    if PY2:
+        # csv and json of python 2 work with utf-8 byte strings
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+#
+# Export
+#
+
+def iter_rows(queryset=None, chunk_size=2000, entries=False):
+    """
+    Yields a dict per video with the urls of its thumbnails in `thumbnails`
+    Keyset pagination, two queries per chunk
+
+    Params:
+        queryset: videos to export, default is all
+        entries: include the snapshot of the entry
+    """
+    if queryset is None:
+        queryset = Video.objects.all()
+    fields = FIELDS + ENTRY_FIELDS if entries else FIELDS
+    columns = ["id", "user__username"] + [field for field in fields
+                                          if field != "username"]
+
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by("id")
+                     .values(*columns)[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1]["id"]
+
+        thumbnails = {}
+        for video_id, url in Thumbnail.objects.filter(
+                video__in=[row["id"] for row in chunk]).order_by(
+                "id").values_list("video", "url"):
+            thumbnails.setdefault(video_id, []).append(url)
+
+        for row in chunk:
+            row["username"] = row.pop("user__username")
+            row["thumbnails"] = thumbnails.get(row.pop("id"), [])
+            for field in DATETIME_FIELDS:
+                if row[field] is not None:
+                    row[field] = row[field].isoformat()
+            yield row
+
+
+class JsonLinesWriter(object):
+
+    def __init__(self, stream, fields):
+        self.stream = stream
+
+    def write(self, row):
+        self.stream.write(json.dumps(row) + "\n")
+
+
+class CsvWriter(object):
+    """
+    Thumbnail urls are separated by spaces
+    """
+
+    def __init__(self, stream, fields):
+        self.writer = csv.DictWriter(stream, list(fields) + ["thumbnails"])
+        self.writer.writeheader()
+
+    def write(self, row):
+        row = dict(row, thumbnails=" ".join(row["thumbnails"]))
+        if PY2:
+            row = dict((key, value.encode("utf-8")
+                        if isinstance(value, unicode) else value)
+                       for key, value in row.items())
+        self.writer.writerow(row)
+
+
+WRITERS = {"jsonl": JsonLinesWriter, "csv": CsvWriter}
+
+
+def export(stream, format="jsonl", queryset=None, chunk_size=2000,
+           entries=False, callback=None):
+    """
+    Writes the videos to the stream
+
+    Params:
+        callback: optional, called with the number of written rows after
+                  each chunk
+
+    Returns:
+        number of the exported videos
+    """
+    fields = FIELDS + ENTRY_FIELDS if entries else FIELDS
+    writer = WRITERS[format](stream, fields)
+    count = 0
+    for row in iter_rows(queryset, chunk_size, entries):
+        writer.write(row)
+        count += 1
+        if callback and count % chunk_size == 0:
+            callback(count)
+    return count
+
+
+#
+# Import
+#
+
+def read_json_lines(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        if PY2:
+            row = dict((key, value.decode("utf-8"))
+                       for key, value in row.items())
+        # csv has no null, empty strings are imported as null
+        row = dict((key, value if value != "" else None)
+                   for key, value in row.items())
+        row["thumbnails"] = (row.get("thumbnails") or "").split()
+        if row.get("access_control") is not None:
+            row["access_control"] = int(row["access_control"])
+        yield row
+
+
+READERS = {"jsonl": read_json_lines, "csv": read_csv}
+
+
+def _atomic():
+    try:
+        return transaction.atomic()
+    except AttributeError:
+        # django < 1.6
+        return transaction.commit_on_success()
+
+
+def _video_fields(row):
+    fields = {}
+    for field in FIELDS + ENTRY_FIELDS:
+        if field == "username" or field not in row:
+            continue
+        value = row[field]
+        if field in DATETIME_FIELDS and value:
+            value = parse_datetime(value)
+        fields[field] = value
+    return fields
+
+
+class Importer(object):
+    """
+    Upserts the videos on `video_id` in batches, the thumbnails of the
+    imported videos are replaced by the imported ones
+
+    Params:
+        user: optional, owner of all videos instead of the exported ones
+        update: update the existing videos, otherwise they're skipped
+    """
+
+    def __init__(self, batch_size=1000, user=None, update=True):
+        self.batch_size = batch_size
+        self.user = user
+        self.update = update
+        self.user_ids = {}
+        self.counts = {"created": 0, "updated": 0, "skipped": 0}
+
+    def _user_ids(self, rows):
+        """
+        Returns the user ids of the rows' usernames, cached across batches
+        """
+        if self.user is not None:
+            return dict((row["username"], self.user.pk) for row in rows)
+
+        missing = set(row["username"] for row in rows) - set(self.user_ids)
+        if missing:
+            self.user_ids.update(get_user_model().objects.filter(
+                username__in=missing).values_list("username", "pk"))
+        return self.user_ids
+
+    def _import_batch(self, rows):
+        # the last row of a video wins
+        rows = list(dict((row["video_id"], row) for row in rows
+                         if row.get("video_id")).values())
+        if not rows:
+            return
+        user_ids = self._user_ids(rows)
+        existing = dict((video_id, (id, user_id)) for video_id, id, user_id
+                        in Video.objects.filter(video_id__in=[
+                            row["video_id"] for row in rows]).values_list(
+                            "video_id", "id", "user"))
+        # the lists of the previous owners change too
+        previous_user_ids = set()
+
+        created, updated = [], []
+        for row in rows:
+            if row["username"] not in user_ids:
+                self.counts["skipped"] += 1
+                continue
+            video = Video(user_id=user_ids[row["username"]],
+                          **_video_fields(row))
+            if row["video_id"] in existing:
+                if not self.update:
+                    self.counts["skipped"] += 1
+                    continue
+                video.id, user_id = existing[row["video_id"]]
+                previous_user_ids.add(user_id)
+                updated.append(video)
+            else:
+                created.append(video)
+
+        with _atomic():
+            Video.objects.bulk_create(created)
+            fields = ["user"] + list(_video_fields(rows[0]))
+            if hasattr(Video.objects, "bulk_update"):
+                Video.objects.bulk_update(updated, fields)
+            else:
+                for video in updated:
+                    values = dict((field, getattr(video, field))
+                                  for field in fields[1:])
+                    Video.objects.filter(id=video.id).update(
+                        user=video.user_id, **values)
+
+            # bulk_create doesn't set the ids on every database
+            videos = list(Video.objects.filter(video_id__in=[
+                video.video_id for video in created + updated]))
+            self._replace_thumbnails(videos, dict(
+                (row["video_id"], row.get("thumbnails") or [])
+                for row in rows))
+
+        from django_youtube import embed, videolists
+        from django_youtube.search import index_videos
+        index_videos(videos)
+
+        # bulk queries send no signals
+        for video in videos:
+            embed.invalidate(video.video_id)
+        for user_id in previous_user_ids | set(video.user_id
+                                               for video in videos):
+            videolists.invalidate(user_id)
+
+        self.counts["created"] += len(created)
+        self.counts["updated"] += len(updated)
+
+    def _replace_thumbnails(self, videos, urls):
+        """
+        Keeps the mirrored copies of the thumbnails that are still there
+        """
+        ids = dict((video.id, video.video_id) for video in videos)
+        existing = set()
+        removed = []
+        for id, video, url in Thumbnail.objects.filter(
+                video__in=list(ids)).values_list("id", "video", "url"):
+            if url in urls[ids[video]]:
+                existing.add((video, url))
+            else:
+                removed.append(id)
+        Thumbnail.objects.filter(id__in=removed).delete()
+        Thumbnail.objects.bulk_create([
+            Thumbnail(video_id=id, url=url)
+            for id, video_id in ids.items() for url in urls[video_id]
+            if (id, url) not in existing])
+
+    def run(self, rows, callback=None):
+        """
+        Params:
+            rows: iterable of dicts, i.e. `read_json_lines(stream)`
+            callback: optional, called with the counts after each batch
+
+        Returns:
+            dict of the counts of created, updated and skipped videos
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+                if callback:
+                    callback(self.counts)
+        if batch:
+            self._import_batch(batch)
+            if callback:
+                callback(self.counts)
+        return self.counts
@@ -0,0 +1,311 @@
+"""
+Signals with receivers that run off the request path
+
+Receivers connected with `deferred=True` are not called by `send()`, a
+`DeferredCall` row is stored for each of them and a background pool delivers
+the rows after the transaction is committed. A row is deleted only after its
+receiver returns, so the delivery is at least once, receivers should be
+idempotent. Calls of a receiver are delivered in the order they are sent,
+failed calls are retried with a backoff before the next ones.
+
+Deferred receivers must be module level functions, so that the
+`youtube_dispatch` command can deliver the rows left by a stopped process.
+"""
+import datetime
+import json
+import logging
+import sys
+import threading
+from importlib import import_module
+
+import django.dispatch
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from django_youtube.api import API_ERRORS
+from django_youtube.workers import WorkerPool, on_commit
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    try:
+        return getattr(settings, name)
+    except AttributeError:
+        return default
+
+
+def receiver_path(receiver):
+    """
+    Returns the dotted import path of the receiver function
+    """
+    return "%s.%s" % (receiver.__module__, receiver.__name__)
+
+
+class DeferredSignal(django.dispatch.Signal):
+    """
+    Signal accepting deferred receivers
+
+        @receiver(video_created, deferred=True)
+        def notify_followers(sender, video, **kwargs):
+            ...
+
+    Params:
+        name: unique name of the signal, stored on the rows
+    """
+
+    # signals by name and deferred receivers by path, of all signals
+    signals = {}
+    receivers = {}
+
+    def __init__(self, name, providing_args=None):
+        super(DeferredSignal, self).__init__(providing_args=providing_args)
+        self.name = name
+        self.deferred = []
+        DeferredSignal.signals[name] = self
+
+    def connect(self, receiver, sender=None, weak=True, dispatch_uid=None,
+                deferred=False):
+        if not deferred:
+            return super(DeferredSignal, self).connect(
+                receiver, sender=sender, weak=weak, dispatch_uid=dispatch_uid)
+
+        if sender is not None:
+            raise ValueError("Deferred receivers can't filter the sender")
+        path = receiver_path(receiver)
+        if path not in self.deferred:
+            self.deferred.append(path)
+        DeferredSignal.receivers[path] = receiver
+
+    def disconnect(self, receiver=None, *args, **kwargs):
+        if receiver is not None:
+            path = receiver_path(receiver)
+            if path in self.deferred:
+                self.deferred.remove(path)
+                DeferredSignal.receivers.pop(path, None)
+                return True
+        return super(DeferredSignal, self).disconnect(receiver, *args,
+                                                      **kwargs)
+
+    def send(self, sender, **named):
+        """
+        Calls the receivers connected without `deferred` and queues the calls
+        of the deferred ones
+
+        Returns:
+            list of tuples (receiver, response) of the called receivers
+        """
+        responses = super(DeferredSignal, self).send(sender, **named)
+        if self.deferred:
+            queue(self, list(self.deferred), sender, named)
+        return responses
+
+
+#
+# Serialization of the arguments
+#
+
+def _encode(value):
+    from django.db.models import Model
+
+    if isinstance(value, Model):
+        return {"__model__": "%s.%s" % (value._meta.app_label,
+                                         value._meta.object_name),
+                "pk": value.pk}
+    if isinstance(value, dict):
+        return dict((key, _encode(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _get_model(label):
+    try:
+        from django.apps import apps
+        return apps.get_model(label)
+    except ImportError:
+        from django.db.models import get_model
+        return get_model(*label.split("."))
+
+
+def _decode(value):
+    """
+    Raises:
+        ObjectDoesNotExist if a model instance is deleted
+    """
+    if isinstance(value, dict):
+        if "__model__" in value:
+            return _get_model(value["__model__"]).objects.get(pk=value["pk"])
+        return dict((key, _decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _resolve(path):
+    receiver = DeferredSignal.receivers.get(path)
+    if receiver is None:
+        module, name = path.rsplit(".", 1)
+        receiver = getattr(import_module(module), name)
+    return receiver
+
+
+#
+# Delivery
+#
+
+def queue(signal, paths, sender, named):
+    """
+    Stores a `DeferredCall` for each receiver and delivers them after
+    the running transaction is committed
+    """
+    from django_youtube.models import DeferredCall
+
+    arguments = json.dumps({"sender": _encode(sender),
+                            "named": _encode(named)})
+    DeferredCall.objects.bulk_create([
+        DeferredCall(signal=signal.name, receiver=path, arguments=arguments)
+        for path in paths])
+    on_commit(lambda: [pool.submit(deliver, path) for path in paths])
+
+
+def _lock_key(path):
+    return "django_youtube:dispatch:%s" % path
+
+
+def _retry_delay(attempts):
+    return _setting("YOUTUBE_DISPATCH_RETRY_DELAY", 30) * 2 ** (attempts - 1)
+
+
+def _call(row):
+    """
+    Calls the receiver of the row
+
+    Returns:
+        False if the arguments are deleted, there is nothing to deliver
+    """
+    from django.core.exceptions import ObjectDoesNotExist
+
+    arguments = json.loads(row.arguments)
+    try:
+        sender = _decode(arguments["sender"])
+        named = _decode(arguments["named"])
+    except ObjectDoesNotExist:
+        return False
+
+    named = dict((str(key), value) for key, value in named.items())
+    _resolve(row.receiver)(signal=DeferredSignal.signals.get(row.signal),
+                           sender=sender, **named)
+    return True
+
+
+def _deliver_locked(path):
+    """
+    Delivers the pending calls of the receiver in order, stops at the first
+    call waiting for a retry
+
+    Returns:
+        seconds until the next retry, None if nothing is waiting
+    """
+    from django_youtube.models import DeferredCall
+
+    max_attempts = _setting("YOUTUBE_DISPATCH_RETRIES", 5) + 1
+    while True:
+        rows = list(DeferredCall.objects.filter(
+            receiver=path, failed=False).order_by("id")[:100])
+        if not rows:
+            return None
+
+        for row in rows:
+            now = timezone.now()
+            if row.next_attempt_at and row.next_attempt_at > now:
+                wait = row.next_attempt_at - now
+                return wait.days * 86400 + wait.seconds + 1
+
+            try:
+                if not _call(row):
+                    logger.info("%s call %d is skipped, its arguments are "
+                                "deleted" % (path, row.id))
+            except API_ERRORS:
+                row.attempts += 1
+                row.last_error = "%s - %s" % (sys.exc_info()[0],
+                                              sys.exc_info()[1])
+                if row.attempts >= max_attempts:
+                    # give up, the next calls shouldn't wait forever
+                    row.failed = True
+                    row.save()
+                    logger.error("%s call %d failed %d times: %s" % (
+                        path, row.id, row.attempts, row.last_error))
+                    continue
+
+                # the next calls wait for the retry to keep the order
+                row.next_attempt_at = now + datetime.timedelta(
+                    seconds=_retry_delay(row.attempts))
+                row.save()
+                return _retry_delay(row.attempts)
+            else:
+                row.delete()
+
+
+def deliver(path, schedule=True):
+    """
+    Delivers the pending calls of the receiver unless another thread or
+    process is delivering them, it picks up the new calls before it stops
+
+    Params:
+        schedule: deliver again in this process when a retry is due
+    """
+    from django_youtube.models import DeferredCall
+
+    lock_timeout = _setting("YOUTUBE_DISPATCH_LOCK_TIMEOUT", 5 * 60)
+    while cache.add(_lock_key(path), 1, lock_timeout):
+        try:
+            retry_in = _deliver_locked(path)
+        finally:
+            cache.delete(_lock_key(path))
+
+        if retry_in is not None:
+            if not schedule:
+                return
+            timer = threading.Timer(retry_in, pool.submit, (deliver, path))
+            timer.daemon = True
+            timer.start()
+            return
+
+        # a call stored while the lock was held is delivered here
+        due = Q(next_attempt_at=None) | Q(next_attempt_at__lte=timezone.now())
+        if not DeferredCall.objects.filter(due, receiver=path,
+                                           failed=False).exists():
+            return
+
+
+def deliver_all():
+    """
+    Delivers the pending calls of every receiver in this thread
+
+    Returns:
+        list of the receiver paths
+    """
+    from django_youtube.models import DeferredCall
+
+    paths = list(DeferredCall.objects.filter(failed=False).order_by()
+                 .values_list("receiver", flat=True).distinct())
+    for path in paths:
+        deliver(path, schedule=False)
+    return paths
+
+
+class DispatchPool(WorkerPool):
+    """
+    Pool of threads delivering the deferred calls
+    """
+
+    def __init__(self, workers=None, queue_size=1000):
+        if workers is None:
+            workers = _setting("YOUTUBE_DISPATCH_WORKERS", 2)
+        super(DispatchPool, self).__init__("youtube-dispatch", workers,
+                                           queue_size)
+
+pool = DispatchPool()
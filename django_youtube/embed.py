@@ -0,0 +1,144 @@
+"""
+Precomputed embed snippets of the videos
+
+The iframe markup and the oEmbed data of a video are rendered once per size
+preset and kept in the cache, the embed and oembed views serve them without
+authentication or template rendering. Only the public videos are embedded.
+Entries are dropped when the video or its thumbnails are saved or deleted.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from django_youtube.api import AccessControl
+from django_youtube.models import Video
+
+DEFAULT_PRESETS = {
+    "small": (320, 180),
+    "medium": (640, 360),
+    "large": (854, 480),
+}
+
+# patterns of the urls that the oembed view accepts
+URL_PATTERNS = (
+    re.compile(r"/video/(?P<video_id>[\w.@+-]+)/?$"),
+    re.compile(r"[?&]v=(?P<video_id>[\w-]+)"),
+    re.compile(r"youtu\.be/(?P<video_id>[\w-]+)"),
+    re.compile(r"/embed/(?P<video_id>[\w-]+)"),
+)
+
+
+def presets():
+    """
+    Returns the size presets, dict of name: (width, height)
+    """
+    try:
+        return settings.YOUTUBE_EMBED_PRESETS
+    except AttributeError:
+        return DEFAULT_PRESETS
+
+
+def _origin():
+    try:
+        return settings.YOUTUBE_EMBED_ORIGIN
+    except AttributeError:
+        pass
+
+    if "django.contrib.sites" in settings.INSTALLED_APPS:
+        from django.contrib.sites.models import Site
+        return Site.objects.get_current().domain
+    return ""
+
+
+def _timeout():
+    try:
+        return settings.YOUTUBE_EMBED_TIMEOUT
+    except AttributeError:
+        return 30 * 24 * 60 * 60
+
+
+def _key(video_id, preset):
+    return "django_youtube:embed:%s:%s" % (video_id, preset)
+
+
+def video_id_from_url(url):
+    """
+    Parses the video id from the url of a video page or a youtube url
+
+    Returns:
+        video_id, None if the url is not recognized
+    """
+    for pattern in URL_PATTERNS:
+        match = pattern.search(url or "")
+        if match:
+            return match.group("video_id")
+    return None
+
+
+def preset_for_size(maxwidth=None, maxheight=None):
+    """
+    Returns the name of the largest preset fitting the given size,
+    the smallest one if none fits
+    """
+    sizes = sorted(presets().items(), key=lambda item: item[1])
+    chosen = sizes[0][0]
+    for name, (width, height) in sizes:
+        if (maxwidth is None or width <= maxwidth) and \
+                (maxheight is None or height <= maxheight):
+            chosen = name
+    return chosen
+
+
+def get_embed(video_id, preset):
+    """
+    Returns the oEmbed data of the video in the preset size, the iframe
+    markup is in `html`, rendered once and kept in the cache
+
+    Returns:
+        dict, None if there is no such public video or preset
+    """
+    if preset not in presets():
+        return None
+
+    key = _key(video_id, preset)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    try:
+        video = Video.objects.get(video_id=video_id,
+                                  access_control=AccessControl.Public)
+    except Video.DoesNotExist:
+        return None
+
+    width, height = presets()[preset]
+    html = render_to_string("django_youtube/video.html", {
+        "video_id": video_id, "origin": _origin(),
+        "width": width, "height": height,
+    }).strip()
+
+    data = {
+        "version": "1.0",
+        "type": "video",
+        "provider_name": "YouTube",
+        "provider_url": "http://www.youtube.com/",
+        "title": video.title or "",
+        "html": html,
+        "width": width,
+        "height": height,
+    }
+    thumbnails = list(video.thumbnail_set.all()[:1])
+    if thumbnails:
+        data["thumbnail_url"] = thumbnails[0].get_absolute_url()
+
+    cache.set(key, data, _timeout())
+    return data
+
+
+def invalidate(video_id):
+    """
+    Drops the snippets of the video in all presets
+    """
+    cache.delete_many([_key(video_id, preset) for preset in presets()])
@@ -0,0 +1,364 @@
+"""
+Processing state and upload progress of the videos, shared between
+processes via django cache
+
+Push notifications and the shared pollers publish the state here, event
+streams and long-poll requests read it, so the number of requests to Youtube
+doesn't grow with the number of waiting browsers
+"""
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# states that will not change anymore
+FINAL_STATES = ("available", "failed", "rejected", "restricted", "deleted")
+
+# final states of an upload progress
+FINAL_PROGRESS_STATES = ("done", "failed")
+
+
+def _state_key(video_id):
+    return "django_youtube:state:%s" % video_id
+
+
+def _progress_key(progress_id):
+    return "django_youtube:progress:%s" % progress_id
+
+
+def _timeout():
+    try:
+        return settings.YOUTUBE_STATE_TIMEOUT
+    except AttributeError:
+        return 60 * 60
+
+
+def _pending_timeout():
+    # states before the final one change soon, don't trust them for long
+    try:
+        return settings.YOUTUBE_PENDING_STATE_TIMEOUT
+    except AttributeError:
+        return 60
+
+
+def publish_state(video_id, upload_state, detailed_message=""):
+    """
+    Stores the latest processing state of the video, states that are not
+    final expire after `YOUTUBE_PENDING_STATE_TIMEOUT` seconds (default 60)
+    The version is kept if the state didn't change, so the long-poll
+    requests don't return the same state again
+
+    Returns:
+        dict i.e. {"upload_state": "processing", "detailed_message": "",
+                   "version": 1357900000.0}
+    """
+    state = {
+        "upload_state": upload_state,
+        "detailed_message": detailed_message or "",
+        "version": time.time(),
+    }
+    previous = get_state(video_id)
+    if previous is not None and \
+            previous["upload_state"] == state["upload_state"] and \
+            previous["detailed_message"] == state["detailed_message"]:
+        state["version"] = previous["version"]
+    timeout = _timeout() if upload_state in FINAL_STATES \
+        else _pending_timeout()
+    cache.set(_state_key(video_id), state, timeout)
+    return state
+
+
+def get_state(video_id):
+    """
+    Returns the latest published state of the video, None if unknown
+    """
+    return cache.get(_state_key(video_id))
+
+
+def publish_progress(progress_id, state, received=0, total=None, **extra):
+    """
+    Stores the progress of a direct upload
+
+    Params:
+        state: receiving (from the browser), sending (to Youtube),
+               done or failed
+        received: bytes processed in the current state
+        total: total bytes, None if unknown
+        extra: additional data, i.e. video_id when it's done
+
+    Returns:
+        dict of the progress
+    """
+    progress = {
+        "state": state,
+        "received": received,
+        "total": total,
+        "version": time.time(),
+    }
+    progress.update(extra)
+    cache.set(_progress_key(progress_id), progress, _timeout())
+    return progress
+
+
+def get_progress(progress_id):
+    """
+    Returns the latest progress of the upload, None if unknown
+    """
+    return cache.get(_progress_key(progress_id))
+
+
+class StatePoller(threading.Thread):
+    """
+    Checks the upload status of a video periodically while there are watchers
+    and publishes the state
+
+    Only one poller runs per video id in a process and a cache lock lets only
+    one process to check Youtube per interval, so many watchers share one
+    upstream request
+    """
+
+    # running pollers of the process, keyed by video id
+    pollers = {}
+    lock = threading.Lock()
+
+    def __init__(self, video_id, interval):
+        super(StatePoller, self).__init__(name="youtube-poller-%s" % video_id)
+        self.daemon = True
+        self.video_id = video_id
+        self.interval = interval
+        self.watchers = 0
+
+    @classmethod
+    def watch(cls, video_id):
+        """
+        Registers a watcher of the video, starts the poller if necessary
+        """
+        try:
+            interval = settings.YOUTUBE_POLL_INTERVAL
+        except AttributeError:
+            interval = 5
+
+        with cls.lock:
+            poller = cls.pollers.get(video_id)
+            if poller is None:
+                poller = cls(video_id, interval)
+                cls.pollers[video_id] = poller
+                poller.watchers += 1
+                poller.start()
+            else:
+                poller.watchers += 1
+
+    @classmethod
+    def unwatch(cls, video_id):
+        """
+        Unregisters a watcher, the poller stops when no watchers left
+        """
+        with cls.lock:
+            poller = cls.pollers.get(video_id)
+            if poller is not None:
+                poller.watchers -= 1
+
+    def _finished(self):
+        with StatePoller.lock:
+            if self.watchers <= 0:
+                self._unregister()
+                return True
+            return False
+
+    def _unregister(self):
+        """
+        Removes the poller from the running ones, a new watcher starts
+        a new poller. Call with the lock held
+        """
+        if StatePoller.pollers.get(self.video_id) is self:
+            del StatePoller.pollers[self.video_id]
+
+    def poll(self):
+        """
+        Checks the status on Youtube unless another process did it within
+        the interval
+
+        Returns:
+            the latest state
+        """
+        lock_key = "django_youtube:poll-lock:%s" % self.video_id
+        if not cache.add(lock_key, 1, self.interval):
+            return get_state(self.video_id)
+
+        from django_youtube.models import Video
+
+        api = Video.objects.api_for(self.video_id)
+        availability = api.check_upload_status(self.video_id)
+        if availability is True:
+            return publish_state(self.video_id, "available")
+        return publish_state(self.video_id, availability["upload_state"],
+                             availability["detailed_message"])
+
+    def run(self):
+        import logging
+        import sys
+        from django_youtube.api import API_ERRORS
+
+        try:
+            while not self._finished():
+                state = get_state(self.video_id)
+                if state is None or state["upload_state"] not in FINAL_STATES:
+                    try:
+                        state = self.poll()
+                    except API_ERRORS:
+                        logging.getLogger(__name__).error(
+                            "Upload status of %s could not be checked: "
+                            "%s - %s" % (self.video_id, sys.exc_info()[0],
+                                         sys.exc_info()[1]))
+                time.sleep(self.interval)
+        finally:
+            # a dead poller must not block the next watchers
+            with StatePoller.lock:
+                self._unregister()
+
+
+def format_event(data, event=None, event_id=None):
+    """
+    Formats the data as a server-sent event message
+    """
+    lines = []
+    if event_id is not None:
+        lines.append("id: %s" % event_id)
+    if event:
+        lines.append("event: %s" % event)
+    for line in json.dumps(data).splitlines():
+        lines.append("data: %s" % line)
+    return "\n".join(lines) + "\n\n"
+
+
+def _stream_settings(timeout, interval):
+    if timeout is None:
+        try:
+            timeout = settings.YOUTUBE_EVENTS_TIMEOUT
+        except AttributeError:
+            timeout = 30
+
+    if interval is None:
+        try:
+            interval = settings.YOUTUBE_EVENTS_INTERVAL
+        except AttributeError:
+            interval = 1
+    return timeout, interval
+
+
+def _poll_enabled():
+    try:
+        return settings.YOUTUBE_EVENTS_POLL
+    except AttributeError:
+        return True
+
+
+def _stream(read, event, final_states, initial=None, timeout=None,
+            interval=None):
+    """
+    Generator of server-sent events of the value returned by `read`
+    Emits an event whenever the version of the value changes, ends when the
+    value reaches a final state or after `timeout` seconds.
+    Browsers reconnect automatically.
+    """
+    timeout, interval = _stream_settings(timeout, interval)
+
+    # ask the browser to wait a little before reconnecting
+    yield "retry: %d\n\n" % (interval * 1000)
+
+    deadline = time.time() + timeout
+    last_version = None
+    value = read() or initial
+
+    while True:
+        if value and value.get("version") != last_version:
+            last_version = value.get("version")
+            yield format_event(value, event=event, event_id=last_version)
+            if value.get("upload_state", value.get("state")) in final_states:
+                return
+        else:
+            # keep the connection alive
+            yield ": ping\n\n"
+
+        if time.time() >= deadline:
+            return
+
+        time.sleep(interval)
+        value = read() or value
+
+
+def event_stream(video_id, initial_state=None, timeout=None, interval=None,
+                 poll=None):
+    """
+    Generator of server-sent events for the state changes of the video
+    Reads the shared state, a shared `StatePoller` feeds it while the stream
+    is open unless `poll` (default is `YOUTUBE_EVENTS_POLL` setting) is False
+
+    Params:
+        initial_state: state to use if nothing is published yet
+                       i.e. the state stored on the `Video` row
+        timeout: seconds, default is `YOUTUBE_EVENTS_TIMEOUT` setting
+        interval: seconds between reads, default is `YOUTUBE_EVENTS_INTERVAL`
+    """
+    if poll is None:
+        poll = _poll_enabled()
+
+    if poll:
+        StatePoller.watch(video_id)
+    try:
+        for message in _stream(lambda: get_state(video_id), "state",
+                               FINAL_STATES, initial_state, timeout,
+                               interval):
+            yield message
+    finally:
+        if poll:
+            StatePoller.unwatch(video_id)
+
+
+def progress_stream(progress_id, timeout=None, interval=None):
+    """
+    Generator of server-sent events for the progress of a direct upload
+    """
+    return _stream(lambda: get_progress(progress_id), "progress",
+                   FINAL_PROGRESS_STATES, None, timeout, interval)
+
+
+def wait_for_state(video_id, version=None, timeout=None, interval=None,
+                   poll=None):
+    """
+    Long-poll helper, blocks until a state newer than `version` is published
+    or `timeout` (default is `YOUTUBE_LONGPOLL_TIMEOUT` setting) passes
+
+    Returns:
+        the latest state, None if unknown
+    """
+    if timeout is None:
+        try:
+            timeout = settings.YOUTUBE_LONGPOLL_TIMEOUT
+        except AttributeError:
+            timeout = 25
+    timeout, interval = _stream_settings(timeout, interval)
+
+    if poll is None:
+        poll = _poll_enabled()
+
+    state = get_state(video_id)
+    if state is not None and (state["version"] != version or
+                              state["upload_state"] in FINAL_STATES):
+        return state
+
+    if poll:
+        StatePoller.watch(video_id)
+    try:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(interval)
+            state = get_state(video_id)
+            if state is not None and state["version"] != version:
+                return state
+        return state
+    finally:
+        if poll:
+            StatePoller.unwatch(video_id)
@@ -0,0 +1,150 @@
+"""
+Full-text index of the videos, used by the admin search
+
+PostgreSQL uses a GIN index on the tsvector of title, description and
+keywords, SQLite an external content FTS5 table kept in sync by triggers.
+Other databases fall back to `icontains` lookups.
+
+The index is created after syncdb/migrate, `install()` can be called
+manually for existing databases.
+"""
+import re
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+FTS_TABLE = "django_youtube_video_fts"
+GIN_INDEX = "django_youtube_video_fts_idx"
+
+# tsvector of the searchable fields, must match the indexed expression
+TSVECTOR = ("to_tsvector('simple', coalesce(%(table)s.title, '') || ' ' || "
+            "coalesce(%(table)s.description, '') || ' ' || "
+            "coalesce(%(table)s.keywords, ''))")
+
+
+def _video_table():
+    from django_youtube.models import Video
+    return Video._meta.db_table
+
+
+def _sqlite_has_fts5(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.django_youtube_fts_check "
+                       "USING fts5(x)")
+        cursor.execute("DROP TABLE temp.django_youtube_fts_check")
+        return True
+    except Exception:
+        return False
+
+
+def is_installed(using=DEFAULT_DB_ALIAS):
+    """
+    Returns True if the full-text index exists on the database
+    """
+    connection = connections[using]
+    cursor = connection.cursor()
+    if connection.vendor == "postgresql":
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s",
+                       [GIN_INDEX])
+        return cursor.fetchone() is not None
+    if connection.vendor == "sqlite":
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       [FTS_TABLE])
+        return cursor.fetchone() is not None
+    return False
+
+
+def install(using=DEFAULT_DB_ALIAS):
+    """
+    Creates the full-text index, does nothing if it exists or the database
+    is not supported
+
+    Returns:
+        True if the index is available
+    """
+    connection = connections[using]
+    table = _video_table()
+    cursor = connection.cursor()
+
+    if connection.vendor == "postgresql":
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s ON %s USING GIN (%s)" % (
+            GIN_INDEX, table, TSVECTOR % {"table": table}))
+        return True
+
+    if connection.vendor != "sqlite" or is_installed(using):
+        return is_installed(using)
+
+    if not _sqlite_has_fts5(cursor):
+        return False
+
+    params = {"fts": FTS_TABLE, "table": table}
+    cursor.execute(
+        "CREATE VIRTUAL TABLE %(fts)s USING fts5(title, description, "
+        "keywords, content='%(table)s', content_rowid='id')" % params)
+    cursor.execute(
+        "CREATE TRIGGER %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+        "INSERT INTO %(fts)s(rowid, title, description, keywords) "
+        "VALUES (new.id, new.title, new.description, new.keywords); END" %
+        params)
+    cursor.execute(
+        "CREATE TRIGGER %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+        "INSERT INTO %(fts)s(%(fts)s, rowid, title, description, keywords) "
+        "VALUES ('delete', old.id, old.title, old.description, "
+        "old.keywords); END" % params)
+    cursor.execute(
+        "CREATE TRIGGER %(fts)s_au AFTER UPDATE ON %(table)s BEGIN "
+        "INSERT INTO %(fts)s(%(fts)s, rowid, title, description, keywords) "
+        "VALUES ('delete', old.id, old.title, old.description, "
+        "old.keywords); "
+        "INSERT INTO %(fts)s(rowid, title, description, keywords) "
+        "VALUES (new.id, new.title, new.description, new.keywords); END" %
+        params)
+    # index the existing rows
+    cursor.execute("INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')" % params)
+    return True
+
+
+def _fts5_query(query):
+    """
+    Converts the search terms to a FTS5 query, every term must match as
+    a prefix, i.e. `foo bar` is `"foo"* "bar"*`
+    """
+    terms = re.findall(r"\w+", query, re.UNICODE)
+    return " ".join('"%s"*' % term for term in terms)
+
+
+def search(queryset, query):
+    """
+    Filters the video queryset by the search terms using the full-text index
+
+    Returns:
+        filtered queryset, None if the index is not available
+    """
+    connection = connections[queryset.db]
+    table = _video_table()
+
+    if connection.vendor == "postgresql":
+        return queryset.extra(
+            where=["%s @@ plainto_tsquery('simple', %%s)" %
+                   (TSVECTOR % {"table": table})],
+            params=[query])
+
+    if connection.vendor == "sqlite" and is_installed(queryset.db):
+        fts_query = _fts5_query(query)
+        if not fts_query:
+            return queryset
+        return queryset.extra(
+            where=["%s.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" %
+                   (table, FTS_TABLE, FTS_TABLE)],
+            params=[fts_query])
+
+    return None
+
+
+def install_after_sync(sender, **kwargs):
+    """
+    post_syncdb/post_migrate handler, installs the index for this app
+    """
+    name = getattr(sender, "name", getattr(sender, "__name__", ""))
+    if not name.startswith("django_youtube"):
+        return
+    install(kwargs.get("using", kwargs.get("db", DEFAULT_DB_ALIAS)))
@@ -0,0 +1,196 @@
+"""
+Background jobs running an action on many videos, i.e. the admin actions
+
+A `VideoJob` row keeps the ids of the videos and the progress, a background
+pool runs the action on each video. The admin shows the progress page of the
+job while it runs. Jobs of a stopped process make no progress, `manage.py
+youtube_jobs` resumes or expires them.
+"""
+import datetime
+import json
+import sys
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from django_youtube.api import API_ERRORS, AccessControl
+from django_youtube.models import Video, VideoJob
+from django_youtube.workers import WorkerPool, on_commit
+
+# max. number of error messages kept on a job
+MAX_ERRORS = 100
+
+
+def stale_timeout():
+    """
+    Seconds without progress after which a job is stale
+    """
+    try:
+        return settings.YOUTUBE_JOB_STALE_TIMEOUT
+    except AttributeError:
+        return 15 * 60
+
+
+def _refresh(video):
+    video.refresh_from_youtube()
+
+
+def _set_unlisted(video):
+    video.access_control = AccessControl.Unlisted
+    video.save()
+
+
+def _delete(video):
+    # deletes the video from Youtube, then the row
+    video.delete()
+
+
+def _sync(video):
+    video.push_to_youtube()
+    Video.objects.filter(id=video.id).update(sync_pending=False)
+
+ACTIONS = {
+    "refresh": _refresh,
+    "unlisted": _set_unlisted,
+    "delete": _delete,
+    "sync": _sync,
+}
+
+
+def start(action, videos, user=None):
+    """
+    Creates the job and runs it in the background after the running
+    transaction is committed
+
+    Params:
+        action: one of `VideoJob.ACTIONS`
+        videos: queryset or list of the video ids
+        user: optional, user started the job
+
+    Returns:
+        VideoJob
+    """
+    if hasattr(videos, "values_list"):
+        videos = videos.order_by("id").values_list("id", flat=True)
+    ids = list(videos)
+    job = VideoJob.objects.create(action=action, video_ids=json.dumps(ids),
+                                  total=len(ids), user=user)
+    on_commit(lambda: pool.submit(run, job.id))
+    return job
+
+
+def run(job_id, chunk_size=100):
+    """
+    Runs the action on the videos of the job, continues from the last
+    processed video if the job is interrupted before
+    """
+    job = VideoJob.objects.get(id=job_id)
+    if job.state not in VideoJob.ACTIVE_STATES:
+        return
+
+    action = ACTIONS[job.action]
+    ids = json.loads(job.video_ids)[job.done + job.failed:]
+    errors = job.errors.splitlines()
+    VideoJob.objects.filter(id=job.id).update(state="running",
+                                              updated_at=timezone.now())
+
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        videos = Video.objects.in_bulk(chunk)
+        for id in chunk:
+            video = videos.get(id)
+            try:
+                # deleted meanwhile, nothing to do
+                if video is not None:
+                    action(video)
+                job.done += 1
+            except API_ERRORS:
+                job.failed += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append("%s: %s - %s" % (
+                        video.video_id, sys.exc_info()[0],
+                        sys.exc_info()[1]))
+            VideoJob.objects.filter(id=job.id).update(
+                done=job.done, failed=job.failed, errors="\n".join(errors),
+                updated_at=timezone.now())
+
+    VideoJob.objects.filter(id=job.id).update(state="finished",
+                                              finished_at=timezone.now())
+
+
+def stale_jobs(timeout=None):
+    """
+    Returns the jobs without progress for `timeout` seconds,
+    default is `YOUTUBE_JOB_STALE_TIMEOUT` setting
+    """
+    if timeout is None:
+        timeout = stale_timeout()
+    limit = timezone.now() - datetime.timedelta(seconds=timeout)
+    return VideoJob.objects.filter(
+        Q(updated_at__lt=limit) | Q(updated_at=None, created_at__lt=limit),
+        state__in=VideoJob.ACTIVE_STATES)
+
+
+def _claim(job):
+    """
+    Marks the progress of the stale job, only one process can claim it
+
+    Returns:
+        True if claimed
+    """
+    return VideoJob.objects.filter(
+        id=job.id, state=job.state, updated_at=job.updated_at).update(
+        updated_at=timezone.now()) == 1
+
+
+def resume_stale(timeout=None):
+    """
+    Runs the stale jobs in this thread, from their last processed video
+
+    Returns:
+        list of the resumed job ids
+    """
+    resumed = []
+    for job in list(stale_jobs(timeout).order_by("id")):
+        if _claim(job):
+            run(job.id)
+            resumed.append(job.id)
+    return resumed
+
+
+def expire_stale(timeout=None):
+    """
+    Marks the stale jobs as expired, their remaining videos are not processed
+
+    Returns:
+        list of the expired job ids
+    """
+    expired = []
+    for job in list(stale_jobs(timeout).order_by("id")):
+        if not _claim(job):
+            continue
+        errors = job.errors.splitlines()
+        errors.append("Expired, %d videos are not processed" % (
+            job.total - job.done - job.failed))
+        VideoJob.objects.filter(id=job.id).update(
+            state="expired", errors="\n".join(errors),
+            finished_at=timezone.now())
+        expired.append(job.id)
+    return expired
+
+
+class JobPool(WorkerPool):
+    """
+    Pool of threads running the jobs
+    """
+
+    def __init__(self, workers=None, queue_size=1000):
+        if workers is None:
+            try:
+                workers = settings.YOUTUBE_JOB_WORKERS
+            except AttributeError:
+                workers = 1
+        super(JobPool, self).__init__("youtube-jobs", workers, queue_size)
+
+pool = JobPool()
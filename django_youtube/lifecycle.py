@@ -0,0 +1,160 @@
+"""
+Cleanup of the temporary files of the direct uploads
+
+Files are removed by `direct_upload` as soon as they're sent to Youtube,
+these functions remove the ones left behind, i.e. by a crashed process.
+`manage.py youtube_gc` runs them.
+"""
+import datetime
+import os
+
+from django.conf import settings
+from django.utils import timezone
+
+from django_youtube.models import UploadedVideo
+from django_youtube.storage import upload_storage
+
+# directory of the uploaded files in the storage, `upload_to` of the field
+UPLOAD_DIRECTORY = "videos"
+
+
+def _ttl(ttl):
+    if ttl is None:
+        try:
+            ttl = settings.YOUTUBE_UPLOAD_TTL
+        except AttributeError:
+            ttl = 24 * 60 * 60
+    return ttl
+
+
+def _modified_time(name):
+    try:
+        return upload_storage.get_modified_time(name)
+    except (AttributeError, NotImplementedError):
+        # django < 1.10
+        modified = upload_storage.modified_time(name)
+        if settings.USE_TZ:
+            modified = timezone.make_aware(modified,
+                                           timezone.get_default_timezone())
+        return modified
+
+
+def _size(name):
+    try:
+        return upload_storage.size(name)
+    except OSError:
+        # deleted meanwhile
+        return 0
+
+
+def iter_files(directory=UPLOAD_DIRECTORY):
+    """
+    Yields the names of the files under the directory of the storage
+    """
+    if not upload_storage.exists(directory):
+        return
+
+    directories, files = upload_storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for name in directories:
+        for path in iter_files(os.path.join(directory, name)):
+            yield path
+
+
+def usage():
+    """
+    Disk usage of the uploaded files
+
+    Returns:
+        dict i.e. {"files": 3, "bytes": 1048576, "rows": 2}
+    """
+    files = 0
+    size = 0
+    for name in iter_files():
+        files += 1
+        size += _size(name)
+    return {"files": files, "bytes": size,
+            "rows": UploadedVideo.objects.count()}
+
+
+def delete_expired(ttl=None, batch_size=500, dry_run=False):
+    """
+    Deletes the `UploadedVideo` rows older than `ttl` seconds
+    (default is `YOUTUBE_UPLOAD_TTL` setting) and their files, in batches
+
+    Returns:
+        tuple of deleted rows and bytes
+    """
+    rows = 0
+    freed = 0
+    last_id = 0
+    expired = UploadedVideo.objects.expired(_ttl(ttl)).order_by("id")
+
+    while True:
+        batch = list(expired.filter(id__gt=last_id).values_list(
+            "id", "file_on_server")[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        for pk, name in batch:
+            if name and upload_storage.exists(name):
+                freed += _size(name)
+                if not dry_run:
+                    upload_storage.delete(name)
+
+        if not dry_run:
+            UploadedVideo.objects.filter(
+                id__in=[pk for pk, name in batch]).delete()
+        rows += len(batch)
+
+    return rows, freed
+
+
+def delete_orphans(ttl=None, batch_size=500, dry_run=False):
+    """
+    Deletes the files that don't belong to any `UploadedVideo` and older
+    than `ttl` seconds, newer files might be still uploading
+
+    Returns:
+        tuple of deleted files and bytes
+    """
+    limit = timezone.now() - datetime.timedelta(seconds=_ttl(ttl))
+    files = 0
+    freed = 0
+
+    def collect(batch):
+        known = set(UploadedVideo.objects.filter(
+            file_on_server__in=batch).values_list("file_on_server", flat=True))
+        deleted = 0
+        size = 0
+        for name in batch:
+            if name in known:
+                continue
+            try:
+                if _modified_time(name) >= limit:
+                    continue
+            except OSError:
+                continue
+            size += _size(name)
+            deleted += 1
+            if not dry_run:
+                upload_storage.delete(name)
+        return deleted, size
+
+    batch = []
+    for name in iter_files():
+        batch.append(name)
+        if len(batch) >= batch_size:
+            deleted, size = collect(batch)
+            files += deleted
+            freed += size
+            batch = []
+
+    if batch:
+        deleted, size = collect(batch)
+        files += deleted
+        freed += size
+
+    return files, freed
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from django_youtube.api import AccessControl, Api
+from django_youtube.models import Video
+
+VIDEO_EXTENSIONS = ".mp4,.mov,.avi,.wmv,.flv,.mpg,.mpeg,.m4v,.webm,.3gp,.mkv"
+
+
+class Command(BaseCommand):
+    args = "<directory>"
+    help = ("Uploads the video files in the directory to Youtube, several at "
+            "once, creates the videos and writes a json lines report")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--user", dest="username",
+                    help="Username of the owner of the videos"),
+        make_option("--workers", type="int", dest="workers", default=4,
+                    help="Number of concurrent uploads, default is 4"),
+        make_option("--max-rate", type="int", dest="max_rate", default=None,
+                    help="Total bandwidth cap in KB/s"),
+        make_option("--retries", type="int", dest="retries", default=3,
+                    help="Attempts per file, default is 3"),
+        make_option("--report", dest="report",
+                    default="youtube_bulk_upload.jsonl",
+                    help="Report file, one json object per line"),
+        make_option("--resume", action="store_true", dest="resume",
+                    default=False,
+                    help="Skip the files uploaded according to the report"),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=50, help="Videos created per query"),
+        make_option("--unlisted", action="store_true", dest="unlisted",
+                    default=False, help="Upload as unlisted videos"),
+        make_option("--extensions", dest="extensions",
+                    default=VIDEO_EXTENSIONS,
+                    help="Comma separated file extensions to upload"),
+    )
+
+    def _uploaded_paths(self, report):
+        """
+        Returns tuples (video id, account) of the uploaded files in
+        the report, keyed by path
+        """
+        uploaded = {}
+        if not os.path.exists(report):
+            return uploaded
+
+        with open(report) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # interrupted while writing the line
+                    continue
+                if result.get("video_id"):
+                    uploaded[result["video_path"]] = (result["video_id"],
+                                                      result.get("account"))
+        return uploaded
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or not os.path.isdir(args[0]):
+            raise CommandError("Usage: manage.py youtube_bulk_upload %s" %
+                               self.args)
+        if not options["username"]:
+            raise CommandError("--user is required")
+
+        try:
+            user = get_user_model().objects.get(
+                username=options["username"])
+        except get_user_model().DoesNotExist:
+            raise CommandError("User %s does not exist" % options["username"])
+
+        directory = args[0]
+        extensions = tuple(e.strip().lower()
+                           for e in options["extensions"].split(","))
+        paths = sorted(os.path.join(directory, name)
+                       for name in os.listdir(directory)
+                       if name.lower().endswith(extensions))
+
+        report = options["report"]
+        if options["resume"]:
+            uploaded = self._uploaded_paths(report)
+            # videos of an interrupted run might not be created yet
+            existing = set(Video.objects.filter(
+                video_id__in=[video_id for video_id, account in
+                              uploaded.values()]).values_list("video_id",
+                                                              flat=True))
+            for video_id, account in set(uploaded.values()):
+                if video_id not in existing:
+                    # fetches the details from Youtube
+                    Video(user=user, video_id=video_id,
+                          account=account).save()
+            paths = [path for path in paths if path not in uploaded]
+        elif os.path.exists(report):
+            raise CommandError("Report %s exists, use --resume to continue "
+                               "or remove it" % report)
+
+        if not paths:
+            self.stdout.write("Nothing to upload\n")
+            return
+
+        access_control = AccessControl.Unlisted if options["unlisted"] \
+            else AccessControl.Public
+        videos = [{"video_path": path,
+                   "title": os.path.splitext(os.path.basename(path))[0],
+                   "access_control": access_control} for path in paths]
+
+        lock = threading.Lock()
+        report_file = open(report, "a")
+        counters = {"done": 0, "failed": 0, "created": 0}
+        batch_size = options["batch_size"]
+        main_thread = threading.current_thread()
+        # entries of the finished uploads waiting for their rows, per account
+        pending = {}
+
+        def create(account):
+            entries = pending.pop(account, [])
+            if entries:
+                Video.objects.create_from_entries(user, entries, account)
+                counters["created"] += len(entries)
+                if threading.current_thread() is not main_thread:
+                    # connections of the upload threads are not reused
+                    connection.close()
+
+        def finished(result):
+            line = dict((key, value) for key, value in result.items()
+                        if key != "entry")
+            with lock:
+                report_file.write(json.dumps(line) + "\n")
+                report_file.flush()
+                counters["done"] += 1
+                if result["error"]:
+                    counters["failed"] += 1
+                else:
+                    # the rows exist even if the run is interrupted later
+                    pending.setdefault(result["account"], []).append(
+                        result["entry"])
+                    if len(pending[result["account"]]) >= batch_size:
+                        create(result["account"])
+                self.stdout.write("[%d/%d] %s %s\n" % (
+                    counters["done"], len(videos), result["video_path"],
+                    result["video_id"] or result["error"]))
+
+        api = Api()
+        api.authenticate()
+        started = time.time()
+        max_rate = options["max_rate"] * 1024 if options["max_rate"] else None
+        try:
+            results = api.upload_many(videos, workers=options["workers"],
+                                      retries=options["retries"],
+                                      max_rate=max_rate, callback=finished)
+        finally:
+            report_file.close()
+            # the last incomplete batches
+            for account in list(pending):
+                create(account)
+        seconds = time.time() - started
+
+        total_bytes = sum(result["bytes"] for result in results
+                          if result["video_id"])
+        self.stdout.write(
+            "Uploaded %d of %d files, %.1f MB in %.1f seconds (%.1f KB/s), "
+            "%d failed\n" % (counters["created"], len(results),
+                             total_bytes / 1024.0 / 1024.0, seconds,
+                             total_bytes / 1024.0 / seconds if seconds else 0,
+                             counters["failed"]))
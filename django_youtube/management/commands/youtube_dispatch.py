@@ -0,0 +1,49 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_youtube.dispatch import deliver_all
+from django_youtube.models import DeferredCall
+
+
+class Command(BaseCommand):
+    help = ("Delivers the pending calls of the deferred signal receivers, "
+            "i.e. the ones left by a stopped process")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--loop", type="int", dest="loop", default=None,
+                    help="Keep delivering, every given seconds"),
+        make_option("--retry-failed", action="store_true",
+                    dest="retry_failed", default=False,
+                    help="Deliver the calls that exhausted their retries "
+                         "again"),
+        make_option("--stats", action="store_true", dest="stats",
+                    default=False, help="Print the pending calls only"),
+    )
+
+    def _stats(self):
+        pending = DeferredCall.objects.filter(failed=False).count()
+        failed = DeferredCall.objects.filter(failed=True).count()
+        self.stdout.write("Pending calls: %d, failed calls: %d\n" % (
+            pending, failed))
+
+    def handle(self, *args, **options):
+        self._stats()
+        if options["stats"]:
+            return
+
+        if options["retry_failed"]:
+            DeferredCall.objects.filter(failed=True).update(
+                failed=False, attempts=0, next_attempt_at=None)
+
+        while True:
+            paths = deliver_all()
+            if paths:
+                self.stdout.write("Delivered the calls of %s\n" %
+                                  ", ".join(paths))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
+
+        self._stats()
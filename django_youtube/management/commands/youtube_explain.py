@@ -0,0 +1,81 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from django_youtube import fulltext
+from django_youtube.models import Thumbnail, UploadedVideo, Video
+
+
+def hot_queries(username, video_id, term):
+    """
+    Returns the frequent queries of the app as (description, queryset) tuples
+    """
+    search = fulltext.search(Video.objects.all(), term)
+    if search is None:
+        search = Video.objects.filter(title__icontains=term)
+
+    return [
+        ("video, remove: video by video_id",
+         Video.objects.filter(video_id=video_id)),
+        ("video_list: video ids of a user",
+         Video.objects.filter(user__username=username).values_list(
+             "video_id", flat=True)),
+        ("direct_upload: duplicate of an upload",
+         Video.objects.filter(user__username=username,
+                              content_hash="0" * 64)),
+        ("admin: changelist title filter",
+         Video.objects.filter(title=term).order_by("-id")),
+        ("admin: search", search.order_by("-id")),
+        ("admin: thumbnails of a video",
+         Thumbnail.objects.filter(video__video_id=video_id)),
+        ("youtube_gc: expired uploads",
+         UploadedVideo.objects.expired().order_by("id")),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Prints the query plans of the frequent queries of the app"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--database", dest="database", default=DEFAULT_DB_ALIAS,
+                    help="Database alias, default is 'default'"),
+        make_option("--analyze", action="store_true", dest="analyze",
+                    default=False,
+                    help="Run the queries and print the actual timings "
+                         "(PostgreSQL only)"),
+        make_option("--username", dest="username", default="admin",
+                    help="Username used in the queries"),
+        make_option("--video-id", dest="video_id", default="video_id",
+                    help="Video id used in the queries"),
+        make_option("--term", dest="term", default="video",
+                    help="Search term used in the queries"),
+    )
+
+    def _explain_prefix(self, connection, analyze):
+        if connection.vendor == "sqlite":
+            return "EXPLAIN QUERY PLAN "
+        if connection.vendor == "postgresql" and analyze:
+            return "EXPLAIN ANALYZE "
+        return "EXPLAIN "
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        connection = connections[using]
+        prefix = self._explain_prefix(connection, options["analyze"])
+
+        self.stdout.write("Full-text index: %s\n\n" % (
+            "installed" if fulltext.is_installed(using) else "not available"))
+
+        for description, queryset in hot_queries(
+                options["username"], options["video_id"], options["term"]):
+            sql, params = queryset.using(using).query.sql_with_params()
+            cursor = connection.cursor()
+            cursor.execute(prefix + sql, params)
+
+            self.stdout.write("-- %s\n%s\n" % (description, sql % tuple(
+                repr(param) for param in params)))
+            for row in cursor.fetchall():
+                self.stdout.write("   %s\n" % " ".join(
+                    str(column) for column in row))
+            self.stdout.write("\n")
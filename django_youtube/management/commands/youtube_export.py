@@ -0,0 +1,57 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_youtube import catalog
+from django_youtube.models import Video
+
+
+class Command(BaseCommand):
+    args = "[<file>]"
+    help = ("Exports the videos and their thumbnails as json lines or csv, "
+            "to stdout if no file is given")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+                    choices=catalog.FORMATS,
+                    help="jsonl or csv, default is by the file extension "
+                         "or jsonl"),
+        make_option("--gzip", action="store_true", dest="gzip",
+                    default=None,
+                    help="Compress, default if the file ends with .gz"),
+        make_option("--user", dest="username",
+                    help="Export the videos of the user only"),
+        make_option("--chunk-size", type="int", dest="chunk_size",
+                    default=2000, help="Videos read per query"),
+        make_option("--with-entries", action="store_true", dest="entries",
+                    default=False,
+                    help="Include the snapshots of the Youtube entries"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError("Usage: manage.py youtube_export %s" %
+                               self.args)
+        path = args[0] if args else "-"
+        format = options["format"] or catalog.detect_format(path) or "jsonl"
+
+        queryset = Video.objects.all()
+        if options["username"]:
+            queryset = queryset.filter(user__username=options["username"])
+
+        def progress(count):
+            sys.stderr.write("Exported %d videos\n" % count)
+
+        stream = catalog.open_file(path, "w", options["gzip"])
+        try:
+            count = catalog.export(stream, format, queryset,
+                                   options["chunk_size"], options["entries"],
+                                   progress)
+        finally:
+            if path == "-" and not options["gzip"]:
+                # keep stdout open
+                stream.flush()
+            else:
+                stream.close()
+        sys.stderr.write("Exported %d videos\n" % count)
@@ -0,0 +1,52 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_youtube import lifecycle
+
+
+def _megabytes(size):
+    return "%.1f MB" % (size / 1024.0 / 1024.0)
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired direct upload files and their rows"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--ttl", type="int", dest="ttl", default=None,
+                    help="Seconds to keep the uploaded files, "
+                         "default is YOUTUBE_UPLOAD_TTL setting or one day"),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500, help="Rows and files handled per query"),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+                    default=False, help="Report only, delete nothing"),
+        make_option("--stats", action="store_true", dest="stats",
+                    default=False, help="Print the disk usage only"),
+    )
+
+    def _usage(self, title):
+        usage = lifecycle.usage()
+        self.stdout.write("%s: %d files, %s, %d rows\n" % (
+            title, usage["files"], _megabytes(usage["bytes"]),
+            usage["rows"]))
+
+    def handle(self, *args, **options):
+        self._usage("Disk usage")
+        if options["stats"]:
+            return
+
+        rows, freed = lifecycle.delete_expired(
+            options["ttl"], options["batch_size"], options["dry_run"])
+        self.stdout.write("Expired uploads: %d rows, %s\n" % (
+            rows, _megabytes(freed)))
+
+        files, orphan_freed = lifecycle.delete_orphans(
+            options["ttl"], options["batch_size"], options["dry_run"])
+        self.stdout.write("Orphan files: %d files, %s\n" % (
+            files, _megabytes(orphan_freed)))
+
+        if options["dry_run"]:
+            self.stdout.write("Dry run, %s would be freed\n" % _megabytes(
+                freed + orphan_freed))
+        else:
+            self._usage("Disk usage after cleanup")
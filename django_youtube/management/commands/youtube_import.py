@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from django_youtube import catalog
+
+
+class Command(BaseCommand):
+    args = "<file>"
+    help = ("Imports the videos and their thumbnails exported by "
+            "youtube_export, existing videos are updated by video id")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+                    choices=catalog.FORMATS,
+                    help="jsonl or csv, default is by the file extension "
+                         "or jsonl"),
+        make_option("--gzip", action="store_true", dest="gzip",
+                    default=None,
+                    help="Decompress, default if the file ends with .gz"),
+        make_option("--user", dest="username",
+                    help="Owner of all imported videos, default is the "
+                         "exported owner"),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000, help="Videos written per batch"),
+        make_option("--no-update", action="store_false", dest="update",
+                    default=True, help="Skip the existing videos"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: manage.py youtube_import %s" %
+                               self.args)
+        path = args[0]
+        format = options["format"] or catalog.detect_format(path) or "jsonl"
+
+        user = None
+        if options["username"]:
+            try:
+                user = get_user_model().objects.get(
+                    username=options["username"])
+            except get_user_model().DoesNotExist:
+                raise CommandError("User %s does not exist" %
+                                   options["username"])
+
+        def progress(counts):
+            self.stdout.write("Created %(created)d, updated %(updated)d, "
+                              "skipped %(skipped)d videos\n" % counts)
+
+        importer = catalog.Importer(options["batch_size"], user,
+                                    options["update"])
+        stream = catalog.open_file(path, "r", options["gzip"])
+        try:
+            counts = importer.run(catalog.READERS[format](stream), progress)
+        finally:
+            if path != "-":
+                stream.close()
+        if counts["skipped"]:
+            self.stdout.write("Skipped videos exist already or their users "
+                              "don't exist\n")
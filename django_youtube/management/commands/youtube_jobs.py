@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_youtube import jobs
+from django_youtube.models import VideoJob
+
+
+class Command(BaseCommand):
+    help = ("Resumes or expires the background jobs without progress, "
+            "i.e. the ones left by a stopped process")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--timeout", type="int", dest="timeout", default=None,
+                    help="Seconds without progress, default is "
+                         "YOUTUBE_JOB_STALE_TIMEOUT setting or 15 minutes"),
+        make_option("--resume", action="store_true", dest="resume",
+                    default=False,
+                    help="Run the stale jobs from their last processed video"),
+        make_option("--expire", action="store_true", dest="expire",
+                    default=False, help="Mark the stale jobs as expired"),
+    )
+
+    def _stats(self, timeout):
+        active = VideoJob.objects.filter(
+            state__in=VideoJob.ACTIVE_STATES).count()
+        stale = jobs.stale_jobs(timeout).count()
+        self.stdout.write("Active jobs: %d, stale jobs: %d\n" % (active,
+                                                                  stale))
+
+    def handle(self, *args, **options):
+        self._stats(options["timeout"])
+
+        if options["resume"]:
+            resumed = jobs.resume_stale(options["timeout"])
+            self.stdout.write("Resumed jobs: %s\n" % (
+                ", ".join(str(job_id) for job_id in resumed) or "none"))
+        elif options["expire"]:
+            expired = jobs.expire_stale(options["timeout"])
+            self.stdout.write("Expired jobs: %s\n" % (
+                ", ".join(str(job_id) for job_id in expired) or "none"))
@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_youtube.models import Thumbnail
+from django_youtube.thumbnails import ThumbnailMirror
+
+
+class Command(BaseCommand):
+    help = "Mirrors the thumbnails that don't have a local copy yet"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--workers", type="int", dest="workers", default=4,
+                    help="Number of concurrent downloads, default is 4"),
+    )
+
+    def handle(self, *args, **options):
+        urls = Thumbnail.objects.filter(local_file__isnull=True).values_list(
+            "url", flat=True).distinct().iterator()
+
+        pool = ThumbnailMirror(options["workers"], options["workers"] * 2)
+        count = 0
+        for url in urls:
+            pool.mirror([url], block=True)
+            count += 1
+        pool.join()
+
+        self.stdout.write("Processed %d thumbnails, %d are not mirrored\n" % (
+            count, Thumbnail.objects.filter(
+                local_file__isnull=True).values("url").distinct().count()))
@@ -0,0 +1,18 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_youtube.search import reindex
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search index of the videos"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500, help="Videos indexed per query"),
+    )
+
+    def handle(self, *args, **options):
+        count = reindex(options["batch_size"])
+        self.stdout.write("Indexed %d videos\n" % count)
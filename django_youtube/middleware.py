@@ -0,0 +1,53 @@
+from django.conf import settings
+
+from django_youtube.budget import ApiCallRecorder, start_recording, \
+    stop_recording
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+
+class ApiCallBudgetMiddleware(MiddlewareMixin):
+    """
+    Counts and times the requests sent to Youtube per request
+
+    Settings:
+        YOUTUBE_API_CALL_BUDGET: max. number of calls per request,
+            default is None (unlimited)
+        YOUTUBE_API_CALL_BUDGET_ACTION: `log` (default) or `raise`
+        YOUTUBE_API_CALL_HEADER: if True, adds the `X-Youtube-Api-Calls` and
+            `X-Youtube-Api-Time` headers to the responses
+    """
+
+    def process_request(self, request):
+        try:
+            limit = settings.YOUTUBE_API_CALL_BUDGET
+        except AttributeError:
+            limit = None
+        try:
+            action = settings.YOUTUBE_API_CALL_BUDGET_ACTION
+        except AttributeError:
+            action = "log"
+
+        request.youtube_api_calls = ApiCallRecorder(limit, action,
+                                                    name=request.path)
+        start_recording(request.youtube_api_calls)
+
+    def process_response(self, request, response):
+        recorder = getattr(request, "youtube_api_calls", None)
+        if recorder is None:
+            return response
+
+        stop_recording(recorder)
+
+        try:
+            add_header = settings.YOUTUBE_API_CALL_HEADER
+        except AttributeError:
+            add_header = False
+
+        if add_header:
+            response["X-Youtube-Api-Calls"] = str(recorder.count)
+            response["X-Youtube-Api-Time"] = "%.3f" % recorder.total_time
+        return response
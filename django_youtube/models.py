@@ -1,15 +1,80 @@
 from django.db import models
-from django_youtube.api import AccessControl, Api
+from django_youtube.accounts import owner_account
+from django_youtube.api import AccessControl, Api, video_id_from_entry
+from django_youtube.storage import upload_storage
+from django_youtube.dispatch import DeferredSignal
 import django.dispatch
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 from django.conf import settings
+import base64
+import datetime
+import os
+import zlib
+
+
+class VideoManager(models.Manager):
+
+    def api_for(self, video_id):
+        """
+        Returns an authenticated `Api` of the account owning the video,
+        the default account if the video is unknown
+        """
+        account = self.filter(video_id=video_id).values_list(
+            "account", flat=True)[:1]
+        api = Api(account=owner_account(account[0] if account else None))
+        api.authenticate()
+        return api
+
+    def create_from_entries(self, user, entries, account=None):
+        """
+        Creates the videos and their thumbnails of the given entries with
+        a few queries, no request is sent to Youtube
+        Sends `video_created` signal for each video
+
+        Params:
+            account: name of the account of the uploads, see `accounts.py`
+
+        Returns:
+            list of the created videos
+        """
+        videos = []
+        for entry in entries:
+            video = Video(user=user, video_id=video_id_from_entry(entry),
+                          account=account)
+            video.set_entry_details(entry)
+            video.entry_data = _encode_entry(entry)
+            video.entry_fetched_at = timezone.now()
+            videos.append(video)
+        self.bulk_create(videos)
+
+        # bulk_create doesn't set the ids on every database
+        videos = list(self.filter(video_id__in=[v.video_id for v in videos]))
+        thumbnails = []
+        by_video_id = dict((video.video_id, video) for video in videos)
+        for entry in entries:
+            video = by_video_id[video_id_from_entry(entry)]
+            for thumbnail in entry.media.thumbnail:
+                thumbnails.append(Thumbnail(video=video, url=thumbnail.url))
+        Thumbnail.objects.bulk_create(thumbnails)
+
+        from django_youtube.thumbnails import mirror_async
+        mirror_async(thumbnail.url for thumbnail in thumbnails)
+
+        from django_youtube.search import index_videos
+        index_videos(videos)
+
+        for video in videos:
+            video_created.send(sender=video, video=video)
+        return videos
 
 
 class Video(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL)
     video_id = models.CharField(max_length=255, unique=True, null=True,
                                 help_text=_("The Youtube id of the video"))
-    title = models.CharField(max_length=200, null=True, blank=True)
+    title = models.CharField(max_length=200, null=True, blank=True,
+                             db_index=True)
     description = models.TextField(null=True, blank=True)
     keywords = models.CharField(max_length=200, null=True, blank=True,
                                 help_text=_("Comma seperated keywords"))
@@ -25,6 +90,38 @@ class Video(models.Model):
                                                "Private"),
                                               ),
                                               default=AccessControl.Public)
+    entry_data = models.TextField(null=True, blank=True, editable=False,
+                                  help_text=_("Compressed snapshot of the last \
+                                              fetched Youtube entry"))
+    entry_fetched_at = models.DateTimeField(null=True, blank=True,
+                                            editable=False)
+    upload_state = models.CharField(max_length=50, null=True, blank=True,
+                                    editable=False,
+                                    help_text=_("Last known processing \
+                                                state, i.e. processing, \
+                                                available, failed"))
+    upload_state_message = models.TextField(null=True, blank=True,
+                                            editable=False)
+    account = models.CharField(max_length=100, null=True, blank=True,
+                               help_text=_("The Youtube account owning \
+                                           the video"))
+    sync_pending = models.BooleanField(default=False, editable=False,
+                                       help_text=_("Local changes are not \
+                                                   sent to Youtube yet"))
+    synced_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                     help_text=_("Last time the details are \
+                                                 fetched from Youtube"))
+    content_hash = models.CharField(max_length=64, null=True, blank=True,
+                                    editable=False, db_index=True,
+                                    help_text=_("SHA-256 of the uploaded \
+                                                file, used to detect \
+                                                duplicate direct uploads"))
+
+    objects = VideoManager()
+
+    class Meta:
+        # videos of a user are listed by their ids, see `video_list`
+        index_together = [["user", "id"]]
 
     def __unicode__(self):
         return self.title
@@ -35,22 +132,141 @@ class Video(models.Model):
         """
         return self.swf_url
 
-    def entry(self):
+    def entry(self, max_age=None, refresh=False):
         """
-        Connects to Youtube Api and retrieves the video entry object
+        Returns the video entry object
+        The local snapshot is used if it is younger than `max_age` seconds,
+        otherwise connects to Youtube Api, retrieves the entry and stores a
+        new snapshot
+
+        Params:
+            max_age: seconds, default is `YOUTUBE_ENTRY_MAX_AGE` setting
+            refresh: if True, always fetch from Youtube
 
         Return:
             gdata.youtube.YouTubeVideoEntry
         """
-        api = Api()
+        if max_age is None:
+            try:
+                max_age = settings.YOUTUBE_ENTRY_MAX_AGE
+            except AttributeError:
+                max_age = 3600
+
+        if not refresh and self.entry_data and self.entry_fetched_at:
+            age = timezone.now() - self.entry_fetched_at
+            if age.days * 86400 + age.seconds < max_age:
+                return _decode_entry(self.entry_data)
+
+        api = Api(account=owner_account(self.account))
         api.authenticate()
-        return api.fetch_video(self.video_id)
+        entry = api.fetch_video(self.video_id)
+        self.store_entry(entry)
+        return entry
+
+    def store_entry(self, entry):
+        """
+        Keeps the given entry as the local snapshot of the video
+        Saved instances are updated in place, without syncing to Youtube
+        """
+        self.entry_data = _encode_entry(entry)
+        self.entry_fetched_at = timezone.now()
+        if self.id:
+            Video.objects.filter(id=self.id).update(
+                entry_data=self.entry_data,
+                entry_fetched_at=self.entry_fetched_at)
+
+    def is_stale(self, max_age=None):
+        """
+        Returns True if the details are fetched from Youtube more than
+        `max_age` seconds ago, default is `YOUTUBE_METADATA_MAX_AGE` setting
+        """
+        from django_youtube.refresh import max_age as default_max_age
+
+        if max_age is None:
+            max_age = default_max_age()
+        if self.synced_at is None:
+            return True
+        age = timezone.now() - self.synced_at
+        return age.days * 86400 + age.seconds >= max_age
+
+    def revalidate(self, max_age=None):
+        """
+        Queues a background refresh from Youtube if the details are stale,
+        returns immediately with the local details
+
+        Returns:
+            self
+        """
+        if self.id and not self.sync_pending and self.is_stale(max_age):
+            from django_youtube.refresh import queue
+            queue.queue_video(self)
+        return self
+
+    def refresh_from_youtube(self):
+        """
+        Updates the details and the thumbnails from Youtube
+        Nothing is sent back to Youtube, videos with local edits waiting for
+        the sync job are skipped, the job stores the updated entry
+        """
+        if self.id and Video.objects.filter(id=self.id,
+                                            sync_pending=True).exists():
+            return
+
+        entry = self.entry(refresh=True)
+        self.set_entry_details(entry)
+        # skip `save()` of this class, it updates the video on Youtube
+        super(Video, self).save(update_fields=[
+            "title", "description", "keywords", "youtube_url", "swf_url",
+            "access_control", "synced_at"])
+
+        urls = [thumbnail.url for thumbnail in entry.media.thumbnail]
+        self.thumbnail_set.exclude(url__in=urls).delete()
+        existing = set(self.thumbnail_set.values_list("url", flat=True))
+        new_urls = [url for url in urls if url not in existing]
+        Thumbnail.objects.bulk_create([Thumbnail(video=self, url=url)
+                                       for url in new_urls])
+
+        from django_youtube.thumbnails import mirror_async
+        mirror_async(new_urls)
+
+    def set_entry_details(self, entry):
+        """
+        Sets the fields from the video entry, doesn't save the instance
+        """
+        self.synced_at = timezone.now()
+        self.title = entry.media.title.text
+        self.description = entry.media.description.text
+        self.keywords = entry.media.keywords.text
+        self.youtube_url = entry.media.player.url
+        self.swf_url = entry.GetSwfUrl()
+        if entry.media.private:
+            self.access_control = AccessControl.Private
+        else:
+            self.access_control = AccessControl.Public
 
     def save(self, *args, **kwargs):
         """
         Syncronize the video information on db with the video on Youtube
         The reason that I didn't use signals is to avoid saving the video instance twice.
+
+        Params:
+            sync: if False, only the row is saved and a background job
+                  syncs it with Youtube, see `jobs.py`
         """
+        sync = kwargs.pop("sync", True)
+
+        if not sync:
+            from django_youtube import jobs
+
+            if self.id:
+                self.sync_pending = True
+                super(Video, self).save(*args, **kwargs)
+                jobs.start("sync", [self.id])
+            else:
+                # the details and thumbnails are fetched by the job
+                super(Video, self).save(*args, **kwargs)
+                jobs.start("refresh", [self.id])
+            return
 
         # if this is a new instance add details from api
         if not self.id:
@@ -58,15 +274,7 @@ class Video(models.Model):
             entry = self.entry()
 
             # Set the details
-            self.title = entry.media.title.text
-            self.description = entry.media.description.text
-            self.keywords = entry.media.keywords.text
-            self.youtube_url = entry.media.player.url
-            self.swf_url = entry.GetSwfUrl()
-            if entry.media.private:
-                self.access_control = AccessControl.Private
-            else:
-                self.access_control = AccessControl.Public
+            self.set_entry_details(entry)
 
             # Save the instance
             super(Video, self).save(*args, **kwargs)
@@ -77,21 +285,40 @@ class Video(models.Model):
                 t.url = thumbnail.url
                 t.video = self
                 t.save()
+
+            from django_youtube.thumbnails import mirror_async
+            mirror_async(thumbnail.url for thumbnail in entry.media.thumbnail)
         else:
             # updating the video instance
-            # Connect to API and update video on youtube
-            api = Api()
-
-            # update method needs authentication
-            api.authenticate()
-
-            # Update the info on youtube, raise error on failure
-            api.update_video(self.video_id, self.title, self.description,
-                             self.keywords, self.access_control)
+            self.push_to_youtube()
 
         # Save the model
         return super(Video, self).save(*args, **kwargs)
 
+    def push_to_youtube(self):
+        """
+        Updates the video on Youtube with the details of the instance,
+        the instance is not saved
+        """
+        # Connect to API and update video on youtube
+        api = Api(account=owner_account(self.account))
+
+        # update method needs authentication
+        api.authenticate()
+
+        # Update the info on youtube, raise error on failure
+        entry = api.update_video(self.video_id, self.title, self.description,
+                                 self.keywords, self.access_control)
+        self.sync_pending = False
+
+        # the snapshot is older than the update
+        if entry is not None:
+            self.store_entry(entry)
+        else:
+            self.entry_fetched_at = None
+            if self.id:
+                Video.objects.filter(id=self.id).update(entry_fetched_at=None)
+
     def delete(self, *args, **kwargs):
         """
         Deletes the video from youtube
@@ -99,7 +326,7 @@ class Video(models.Model):
         Raises:
             OperationError
         """
-        api = Api()
+        api = Api(account=owner_account(self.account))
 
         # Authentication is required for deletion
         api.authenticate()
@@ -123,14 +350,72 @@ class Video(models.Model):
 
 class Thumbnail(models.Model):
     video = models.ForeignKey(Video, null=True)
-    url = models.URLField(max_length=255)
+    url = models.URLField(max_length=255, db_index=True)
+    local_file = models.CharField(max_length=255, null=True, blank=True,
+                                  help_text=_("Name of the mirrored copy in \
+                                              the storage"))
 
     def __unicode__(self):
         return self.url
 
     def get_absolute_url(self):
+        """
+        Returns the url of the mirrored copy if available,
+        otherwise the remote url
+        """
+        if self.local_file:
+            return self.variant_url()
         return self.url
 
+    def variant_url(self, width=None):
+        """
+        Returns the url of the mirrored original (width is None) or of the
+        WebP variant in the given width
+        """
+        from django.core.urlresolvers import reverse
+
+        filename = self.local_file.rsplit("/", 1)[-1]
+        content_hash, extension = os.path.splitext(filename)
+        kwargs = {"content_hash": content_hash}
+        if width:
+            kwargs["width"] = width
+        elif extension:
+            kwargs["extension"] = extension[1:]
+        return reverse("django_youtube.views.thumbnail", kwargs=kwargs)
+
+
+class VideoTerm(models.Model):
+    """
+    inverted index entry of the search, see `django_youtube.search`
+    """
+    term = models.CharField(max_length=100)
+    video = models.ForeignKey(Video)
+    weight = models.IntegerField(default=1)
+
+    class Meta:
+        index_together = [["term", "video"]]
+
+    def __unicode__(self):
+        return self.term
+
+
+class UploadedVideoManager(models.Manager):
+
+    def expired(self, ttl=None):
+        """
+        Returns the uploaded videos older than `ttl` seconds,
+        default is `YOUTUBE_UPLOAD_TTL` setting
+        """
+        if ttl is None:
+            try:
+                ttl = settings.YOUTUBE_UPLOAD_TTL
+            except AttributeError:
+                ttl = 24 * 60 * 60
+
+        limit = timezone.now() - datetime.timedelta(seconds=ttl)
+        return self.filter(models.Q(created_at__lt=limit) |
+                           models.Q(created_at__isnull=True))
+
 
 class UploadedVideo(models.Model):
     """
@@ -138,15 +423,205 @@ class UploadedVideo(models.Model):
     """
 
     file_on_server = models.FileField(upload_to='videos', null=True,
+                                      storage=upload_storage,
                                       help_text=_("Temporary file on server for \
                                               using in `direct upload` from \
                                               your server to youtube"))
+    created_at = models.DateTimeField(auto_now_add=True, null=True,
+                                      db_index=True)
+
+    objects = UploadedVideoManager()
 
     def __unicode__(self):
         """string representation"""
         return self.file_on_server.url
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the file on server with the instance
+        """
+        if self.file_on_server:
+            self.file_on_server.delete(save=False)
+        return super(UploadedVideo, self).delete(*args, **kwargs)
+
+
+class VideoJob(models.Model):
+    """
+    Background job running an action on many videos, see `jobs.py`
+    """
+    ACTIONS = (
+        ("refresh", _("Refresh from Youtube")),
+        ("unlisted", _("Set unlisted")),
+        ("delete", _("Delete remotely")),
+        ("sync", _("Send changes to Youtube")),
+    )
+    STATES = (
+        ("queued", _("Queued")),
+        ("running", _("Running")),
+        ("finished", _("Finished")),
+        ("expired", _("Expired")),
+    )
+    # states of the jobs that are not done
+    ACTIVE_STATES = ("queued", "running")
+
+    action = models.CharField(max_length=20, choices=ACTIONS)
+    state = models.CharField(max_length=20, choices=STATES, default="queued")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True)
+    video_ids = models.TextField(help_text=_("Json list of the video ids"))
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(null=True, blank=True,
+                                      help_text=_("Time of the last progress"))
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return "%s %s" % (self.get_action_display(), self.created_at)
+
+    def is_stale(self, timeout=None):
+        """
+        Returns True if the job is not done and made no progress for
+        `timeout` seconds (default is `YOUTUBE_JOB_STALE_TIMEOUT` setting),
+        i.e. its process died
+        """
+        from django_youtube.jobs import stale_timeout
+
+        if self.state not in self.ACTIVE_STATES:
+            return False
+        if timeout is None:
+            timeout = stale_timeout()
+        age = timezone.now() - (self.updated_at or self.created_at)
+        return age.days * 86400 + age.seconds >= timeout
+
+    def progress(self):
+        """
+        Returns the percentage of the processed videos
+        """
+        if not self.total:
+            return 100
+        return (self.done + self.failed) * 100 // self.total
+
+
+class DeferredCall(models.Model):
+    """
+    Pending call of a deferred signal receiver, deleted after the receiver
+    returns
+    """
+    signal = models.CharField(max_length=100)
+    receiver = models.CharField(max_length=255,
+                                help_text=_("Import path of the receiver"))
+    arguments = models.TextField(help_text=_("Json encoded arguments"))
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    failed = models.BooleanField(default=False,
+                                 help_text=_("Retries are exhausted"))
+
+    class Meta:
+        index_together = [["receiver", "failed", "id"]]
+
+    def __unicode__(self):
+        return "%s %s" % (self.receiver, self.created_at)
+
+
+def _encode_entry(entry):
+    """
+    Serializes the entry as zlib compressed, base64 encoded atom xml
+    """
+    xml = entry.ToString()
+    if not isinstance(xml, bytes):
+        xml = xml.encode("utf-8")
+    return base64.b64encode(zlib.compress(xml)).decode("ascii")
+
+
+def _decode_entry(data):
+    """
+    Builds the entry object back from a snapshot created by `_encode_entry`
+    """
+    import gdata.youtube
+    xml = zlib.decompress(base64.b64decode(data))
+    return gdata.youtube.YouTubeVideoEntryFromString(xml)
+
 #
 # Signal Definitions
 #
 
-video_created = django.dispatch.Signal(providing_args=["video"])
+# receivers can be connected with `deferred=True`, see `dispatch.py`
+video_created = DeferredSignal("video_created", providing_args=["video"])
+video_processed = django.dispatch.Signal(providing_args=["video",
+                                                         "upload_state"])
+
+#
+# Full-text index of the admin search
+#
+
+try:
+    from django.db.models.signals import post_migrate as post_sync
+except ImportError:
+    from django.db.models.signals import post_syncdb as post_sync
+
+from django_youtube.fulltext import install_after_sync
+post_sync.connect(install_after_sync,
+                  dispatch_uid="django_youtube.fulltext.install_after_sync")
+
+#
+# Search index
+#
+
+
+def _index_video(sender, instance, **kwargs):
+    from django_youtube.search import index_video
+    index_video(instance)
+
+models.signals.post_save.connect(_index_video, sender=Video,
+                                 dispatch_uid="django_youtube.search.index")
+
+#
+# Embed snippets
+#
+
+
+def _invalidate_embed(sender, instance, **kwargs):
+    from django_youtube.embed import invalidate
+    invalidate(instance.video_id)
+
+models.signals.post_save.connect(_invalidate_embed, sender=Video,
+                                 dispatch_uid="django_youtube.embed.save")
+models.signals.post_delete.connect(_invalidate_embed, sender=Video,
+                                   dispatch_uid="django_youtube.embed.delete")
+
+
+def _invalidate_thumbnail_embed(sender, instance, **kwargs):
+    from django_youtube.embed import invalidate
+    # the video might be deleted with its thumbnails
+    for video_id in Video.objects.filter(id=instance.video_id).values_list(
+            "video_id", flat=True):
+        invalidate(video_id)
+
+models.signals.post_save.connect(
+    _invalidate_thumbnail_embed, sender=Thumbnail,
+    dispatch_uid="django_youtube.embed.thumbnail_save")
+models.signals.post_delete.connect(
+    _invalidate_thumbnail_embed, sender=Thumbnail,
+    dispatch_uid="django_youtube.embed.thumbnail_delete")
+
+#
+# Video lists of the users
+#
+
+
+def _invalidate_video_list(sender, instance=None, video=None, **kwargs):
+    from django_youtube.videolists import invalidate
+    invalidate((instance or video).user_id)
+
+models.signals.post_save.connect(_invalidate_video_list, sender=Video,
+                                 dispatch_uid="django_youtube.videolists.save")
+models.signals.post_delete.connect(
+    _invalidate_video_list, sender=Video,
+    dispatch_uid="django_youtube.videolists.delete")
+# videos created in bulk don't send post_save
+video_created.connect(_invalidate_video_list,
+                      dispatch_uid="django_youtube.videolists.created")
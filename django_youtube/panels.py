@@ -0,0 +1,61 @@
+"""
+Django debug toolbar panel of the requests sent to Youtube
+
+Add `django_youtube.panels.ApiCallsPanel` to `DEBUG_TOOLBAR_PANELS`
+"""
+from debug_toolbar.panels import Panel
+from django.utils.translation import ugettext_lazy as _, ungettext
+
+from django_youtube.budget import ApiCallRecorder, start_recording, \
+    stop_recording
+
+
+class ApiCallsPanel(Panel):
+    """
+    Lists the Youtube API calls of the request with their timings and
+    call stacks
+    """
+    title = _("Youtube API")
+    template = "django_youtube/panels/api_calls.html"
+
+    def __init__(self, *args, **kwargs):
+        super(ApiCallsPanel, self).__init__(*args, **kwargs)
+        self.recorder = ApiCallRecorder(collect_stacks=True)
+
+    @property
+    def nav_subtitle(self):
+        return ungettext("%(count)d call in %(time).1f ms",
+                         "%(count)d calls in %(time).1f ms",
+                         self.recorder.count) % {
+            "count": self.recorder.count,
+            "time": self.recorder.total_time * 1000}
+
+    def enable_instrumentation(self):
+        start_recording(self.recorder)
+
+    def disable_instrumentation(self):
+        stop_recording(self.recorder)
+
+    def _record(self, request):
+        try:
+            from django.conf import settings
+            limit = settings.YOUTUBE_API_CALL_BUDGET
+        except AttributeError:
+            limit = None
+
+        self.record_stats({
+            "calls": [dict(call, duration_ms=call["duration"] * 1000,
+                           stack="".join(call["stack"] or []))
+                      for call in self.recorder.calls],
+            "count": self.recorder.count,
+            "total_time_ms": self.recorder.total_time * 1000,
+            "limit": limit,
+            "exceeded": limit is not None and self.recorder.count > limit,
+        })
+
+    def process_response(self, request, response):
+        # debug toolbar < 1.8
+        self._record(request)
+
+    def generate_stats(self, request, response):
+        self._record(request)
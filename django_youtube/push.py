@@ -0,0 +1,169 @@
+"""
+PubSubHubbub (push) notifications for the uploads feed
+Youtube notifies the callback view when an entry changes, so the processing
+state of the videos doesn't need to be polled
+
+See: https://pubsubhubbub.github.io/PubSubHubbub/pubsubhubbub-core-0.4.html
+"""
+import hashlib
+import hmac
+
+from django.conf import settings
+from django_youtube.api import Api, video_id_from_entry
+from django_youtube.events import publish_state
+from django_youtube.models import Video, video_processed
+
+
+def verify_signature(body, signature):
+    """
+    Checks the `X-Hub-Signature` header of the notification
+    Never valid if `YOUTUBE_PUSH_SECRET` is not set, unsigned notifications
+    could be sent by anyone
+
+    Returns:
+        True if the signature matches
+    """
+    try:
+        secret = settings.YOUTUBE_PUSH_SECRET
+    except AttributeError:
+        return False
+
+    if not secret:
+        return False
+
+    if not signature or "=" not in signature:
+        return False
+
+    method, digest = signature.split("=", 1)
+    if method != "sha1":
+        return False
+
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha1).hexdigest()
+    # constant time comparison
+    return len(expected) == len(digest) and \
+        sum(ord(a) ^ ord(b) for a, b in zip(expected, digest)) == 0
+
+
+def sign(body, secret):
+    """
+    Returns the `X-Hub-Signature` header value of the body
+    """
+    return "sha1=%s" % hmac.new(secret.encode("utf-8"), body,
+                                hashlib.sha1).hexdigest()
+
+
+def parse_notification(body):
+    """
+    Parses the atom feed (or a single entry) posted by the hub
+
+    Returns:
+        list of tuples (video_id, upload_state, detailed_message, entry)
+    """
+    import gdata.youtube
+
+    entries = gdata.youtube.YouTubeVideoFeedFromString(body).entry
+    if not entries:
+        entries = [gdata.youtube.YouTubeVideoEntryFromString(body)]
+
+    notifications = []
+    for entry in entries:
+        if entry is None or entry.id is None:
+            continue
+
+        # CheckUploadStatus only inspects the entry, no request is sent
+        upload_status = Api.yt_service.CheckUploadStatus(entry)
+        if upload_status is not None:
+            upload_state, detailed_message = upload_status[0], upload_status[1]
+        else:
+            upload_state, detailed_message = "available", ""
+
+        notifications.append((video_id_from_entry(entry), upload_state,
+                              detailed_message or "", entry))
+    return notifications
+
+
+def process_notification(body):
+    """
+    Updates the `Video` rows with the states in the notification,
+    publishes the states for the event streams and
+    sends `video_processed` signal when processing of a video is finished
+
+    Returns:
+        list of the updated video ids
+    """
+    updated = []
+    for video_id, upload_state, detailed_message, entry in \
+            parse_notification(body):
+        publish_state(video_id, upload_state, detailed_message)
+
+        try:
+            video = Video.objects.get(video_id=video_id)
+        except Video.DoesNotExist:
+            continue
+
+        changed = video.upload_state != upload_state
+
+        # update the row without syncing back to Youtube
+        video.upload_state = upload_state
+        video.upload_state_message = detailed_message
+        Video.objects.filter(id=video.id).update(
+            upload_state=upload_state, upload_state_message=detailed_message)
+        video.store_entry(entry)
+        updated.append(video_id)
+
+        if changed and upload_state != "processing":
+            video_processed.send(sender=video, video=video,
+                                 upload_state=upload_state)
+
+    return updated
+
+
+def subscribe(callback_url, topic_url=None, mode="subscribe"):
+    """
+    Sends a subscription request to the hub
+    The hub verifies it by calling the callback view
+
+    Params:
+        callback_url: absolute url of the `push_callback` view
+        topic_url: feed url, default is `YOUTUBE_PUSH_TOPIC_URL` setting
+        mode: subscribe or unsubscribe
+
+    Returns:
+        True if the hub accepted the request
+    """
+    try:
+        from urllib import urlencode
+        from urllib2 import urlopen, HTTPError
+    except ImportError:
+        from urllib.parse import urlencode
+        from urllib.request import urlopen
+        from urllib.error import HTTPError
+
+    try:
+        hub_url = settings.YOUTUBE_PUSH_HUB_URL
+    except AttributeError:
+        hub_url = "https://pubsubhubbub.appspot.com/subscribe"
+
+    if topic_url is None:
+        topic_url = settings.YOUTUBE_PUSH_TOPIC_URL
+
+    params = {
+        "hub.callback": callback_url,
+        "hub.topic": topic_url,
+        "hub.mode": mode,
+        "hub.verify": "async",
+    }
+    try:
+        params["hub.verify_token"] = settings.YOUTUBE_PUSH_VERIFY_TOKEN
+    except AttributeError:
+        pass
+    try:
+        params["hub.secret"] = settings.YOUTUBE_PUSH_SECRET
+    except AttributeError:
+        pass
+
+    try:
+        response = urlopen(hub_url, urlencode(params).encode("utf-8"))
+    except HTTPError:
+        return False
+    return response.getcode() in (202, 204)
@@ -0,0 +1,70 @@
+"""
+Stale-while-revalidate refresh of the video metadata
+
+Reads use the local `Video` rows. When a row is older than
+`YOUTUBE_METADATA_MAX_AGE` seconds, `Video.revalidate()` queues a refresh
+from Youtube in the background, one per video at a time across processes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from django_youtube.workers import WorkerPool
+
+
+def max_age():
+    try:
+        return settings.YOUTUBE_METADATA_MAX_AGE
+    except AttributeError:
+        return 60 * 60
+
+
+def _lock_key(video_id):
+    return "django_youtube:refresh:%s" % video_id
+
+
+def refresh(pk):
+    """
+    Refreshes the video from Youtube, called in the background
+    """
+    from django_youtube.models import Video
+
+    try:
+        video = Video.objects.get(pk=pk)
+        video.refresh_from_youtube()
+    except Video.DoesNotExist:
+        pass
+    finally:
+        cache.delete(_lock_key(pk))
+
+
+class RefreshQueue(WorkerPool):
+    """
+    Pool of threads refreshing the videos
+    """
+
+    def __init__(self, workers=None, queue_size=1000):
+        if workers is None:
+            try:
+                workers = settings.YOUTUBE_REFRESH_WORKERS
+            except AttributeError:
+                workers = 2
+        super(RefreshQueue, self).__init__("youtube-refresh", workers,
+                                           queue_size)
+
+    def queue_video(self, video):
+        """
+        Queues the refresh of the video unless one is already queued or
+        running in any process
+
+        Returns:
+            True if queued
+        """
+        # expires in case the refreshing process dies
+        if not cache.add(_lock_key(video.pk), 1, 5 * 60):
+            return False
+        if not self.submit(refresh, video.pk):
+            cache.delete(_lock_key(video.pk))
+            return False
+        return True
+
+queue = RefreshQueue()
@@ -0,0 +1,161 @@
+"""
+Search over the local video catalog
+
+An inverted index (`VideoTerm` rows) maps the terms of title, keywords and
+description to the videos with a weight per field. It's updated when a video
+is saved or deleted, `manage.py youtube_reindex` rebuilds it.
+"""
+import re
+
+from django.db.models import Count, Q, Sum
+
+from django_youtube.api import AccessControl
+from django_youtube.models import Video, VideoTerm
+
+# weight of a term occurrence per field
+FIELD_WEIGHTS = (("title", 3), ("keywords", 2), ("description", 1))
+
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+    "is", "it", "of", "on", "or", "the", "to", "with",
+])
+
+# max. length of a term, longer ones are truncated
+TERM_LENGTH = 100
+
+
+def tokenize(text):
+    """
+    Splits the text to lowercase terms, stop words are skipped
+
+    Returns:
+        list of terms
+    """
+    if not text:
+        return []
+    return [term[:TERM_LENGTH]
+            for term in re.findall(r"\w+", text.lower(), re.UNICODE)
+            if term not in STOP_WORDS]
+
+
+def split_keywords(keywords):
+    """
+    Returns the normalized list of comma separated keywords
+    """
+    if not keywords:
+        return []
+    return [keyword.strip().lower() for keyword in keywords.split(",")
+            if keyword.strip()]
+
+
+def _terms(video):
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(getattr(video, field)):
+            weights[term] = weights.get(term, 0) + weight
+    return weights
+
+
+def index_videos(videos):
+    """
+    Replaces the index entries of the videos
+    """
+    videos = [video for video in videos if video.id]
+    if not videos:
+        return
+
+    VideoTerm.objects.filter(video__in=[video.id for video in videos]).delete()
+    VideoTerm.objects.bulk_create([
+        VideoTerm(video_id=video.id, term=term, weight=weight)
+        for video in videos for term, weight in _terms(video).items()])
+
+
+def index_video(video):
+    index_videos([video])
+
+
+def reindex(batch_size=500):
+    """
+    Rebuilds the index of all videos in batches
+
+    Returns:
+        number of indexed videos
+    """
+    count = 0
+    last_id = 0
+    queryset = Video.objects.order_by("id").only(
+        "id", "title", "keywords", "description")
+    while True:
+        videos = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not videos:
+            return count
+        index_videos(videos)
+        count += len(videos)
+        last_id = videos[-1].id
+
+
+def _keyword_regex(keyword):
+    """
+    Returns the regex matching the keyword as a whole item of the comma
+    separated keywords
+    """
+    return r"(^|,)\s*%s\s*(,|$)" % re.escape(keyword.strip().lower())
+
+
+def visible_videos(user=None):
+    """
+    Returns the lookup of the videos the user can find, the public ones and
+    the own videos of an authenticated user
+    """
+    lookup = Q(access_control=AccessControl.Public)
+    if user is not None and user.is_authenticated():
+        lookup |= Q(user=user)
+    return lookup
+
+
+def search(query, keyword=None, offset=0, limit=20, facet_limit=10,
+           user=None):
+    """
+    Finds the videos that contain all terms of the query, ranked by the
+    total weight of the terms
+
+    Params:
+        keyword: optional, only the videos with this keyword
+        facet_limit: number of keyword facets
+        user: optional, the private and unlisted videos of this user are
+              found too, only the public videos otherwise
+
+    Returns:
+        dict i.e. {"total": 12, "results": [(video, score), ...],
+                   "facets": [("music", 5), ...]}
+    """
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return {"total": 0, "results": [], "facets": []}
+
+    videos = Video.objects.filter(visible_videos(user))
+    if keyword and keyword.strip():
+        videos = videos.filter(keywords__iregex=_keyword_regex(keyword))
+    matches = VideoTerm.objects.filter(term__in=terms,
+                                       video__in=videos.values("id"))
+    matches = matches.values("video").annotate(
+        matched=Count("term"), score=Sum("weight")
+    ).filter(matched=len(terms))
+
+    total = matches.count()
+    page = list(matches.order_by("-score", "-video")[offset:offset + limit])
+    videos = Video.objects.in_bulk([match["video"] for match in page])
+    results = [(videos[match["video"]], match["score"]) for match in page
+               if match["video"] in videos]
+
+    # keyword counts of the best matches
+    facets = {}
+    best = matches.order_by("-score").values_list("video", flat=True)[:1000]
+    for keywords in Video.objects.filter(id__in=list(best)).values_list(
+            "keywords", flat=True):
+        for name in set(split_keywords(keywords)):
+            facets[name] = facets.get(name, 0) + 1
+    facets = sorted(facets.items(), key=lambda item: (-item[1], item[0]))
+
+    return {"total": total, "results": results,
+            "facets": facets[:facet_limit]}
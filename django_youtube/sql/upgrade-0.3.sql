@@ -0,0 +1,29 @@
+-- Upgrades the tables of django-youtube 0.2 to 0.3
+--
+-- `syncdb` creates the new tables (videoterm, videojob, deferredcall) but
+-- doesn't alter the existing ones, run this once before starting 0.3:
+--
+--     psql <database> -f django_youtube/sql/upgrade-0.3.sql
+--
+-- Written for PostgreSQL. On SQLite use "datetime" instead of
+-- "timestamp with time zone", on MySQL "datetime" and "tinyint(1)"
+-- instead of "boolean".
+
+ALTER TABLE django_youtube_video ADD COLUMN entry_data text NULL;
+ALTER TABLE django_youtube_video ADD COLUMN entry_fetched_at timestamp with time zone NULL;
+ALTER TABLE django_youtube_video ADD COLUMN upload_state varchar(50) NULL;
+ALTER TABLE django_youtube_video ADD COLUMN upload_state_message text NULL;
+ALTER TABLE django_youtube_video ADD COLUMN account varchar(100) NULL;
+ALTER TABLE django_youtube_video ADD COLUMN sync_pending boolean NOT NULL DEFAULT false;
+ALTER TABLE django_youtube_video ADD COLUMN synced_at timestamp with time zone NULL;
+ALTER TABLE django_youtube_video ADD COLUMN content_hash varchar(64) NULL;
+CREATE INDEX django_youtube_video_title ON django_youtube_video (title);
+CREATE INDEX django_youtube_video_content_hash ON django_youtube_video (content_hash);
+CREATE INDEX django_youtube_video_user_id_id ON django_youtube_video (user_id, id);
+
+ALTER TABLE django_youtube_thumbnail ADD COLUMN local_file varchar(255) NULL;
+CREATE INDEX django_youtube_thumbnail_url ON django_youtube_thumbnail (url);
+
+-- existing rows have no creation time, `youtube_gc` treats them as expired
+ALTER TABLE django_youtube_uploadedvideo ADD COLUMN created_at timestamp with time zone NULL;
+CREATE INDEX django_youtube_uploadedvideo_created_at ON django_youtube_uploadedvideo (created_at);
@@ -0,0 +1,20 @@
+"""
+Storage of the temporary files of the direct uploads
+"""
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+
+
+def get_upload_storage():
+    """
+    Returns the storage of `UploadedVideo` files
+    If `YOUTUBE_UPLOAD_ROOT` is set, files are kept in that directory,
+    i.e. on a fast scratch volume, otherwise in the default media storage
+    """
+    try:
+        location = settings.YOUTUBE_UPLOAD_ROOT
+    except AttributeError:
+        return default_storage
+    return FileSystemStorage(location=location)
+
+upload_storage = get_upload_storage()
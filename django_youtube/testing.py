@@ -0,0 +1,270 @@
+"""
+Local stand-ins of the remote services, to be used in tests
+"""
+import threading
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+
+from django_youtube.push import sign
+
+ENTRY_TEMPLATE = """<entry xmlns='http://www.w3.org/2005/Atom'
+       xmlns:app='http://www.w3.org/2007/app'
+       xmlns:media='http://search.yahoo.com/mrss/'
+       xmlns:yt='http://gdata.youtube.com/schemas/2007'>
+  <id>http://gdata.youtube.com/feeds/api/videos/%(video_id)s</id>
+  <title type='text'>%(title)s</title>
+  %(control)s
+  <media:group>
+    <media:title type='plain'>%(title)s</media:title>
+    <media:description type='plain'>%(description)s</media:description>
+    <media:keywords>%(keywords)s</media:keywords>
+    <media:player url='http://www.youtube.com/watch?v=%(video_id)s'/>
+    <media:content url='http://www.youtube.com/v/%(video_id)s?version=3'
+                   type='application/x-shockwave-flash' medium='video'
+                   isDefault='true' expression='full' yt:format='5'/>
+    <media:thumbnail url='http://i.ytimg.com/vi/%(video_id)s/default.jpg'
+                     height='90' width='120'/>
+  </media:group>
+</entry>"""
+
+CONTROL_TEMPLATE = """<app:control>
+    <app:draft>yes</app:draft>
+    <yt:state name='%(upload_state)s'>%(detailed_message)s</yt:state>
+  </app:control>"""
+
+FEED_TEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns='http://www.w3.org/2005/Atom'>
+  <id>http://gdata.youtube.com/feeds/api/users/default/uploads</id>
+  %s
+</feed>"""
+
+
+def video_entry_xml(video_id, upload_state="available", detailed_message="",
+                    title="video", description="", keywords=""):
+    """
+    Returns the atom xml of a video entry in the given processing state
+    """
+    control = ""
+    if upload_state != "available":
+        control = CONTROL_TEMPLATE % {"upload_state": upload_state,
+                                      "detailed_message": detailed_message}
+
+    return ENTRY_TEMPLATE % {"video_id": video_id, "title": title,
+                             "description": description,
+                             "keywords": keywords, "control": control}
+
+
+
+def patch(test, target, name, value):
+    """
+    Replaces an attribute of `target` until the cleanups of `test` run
+    """
+    test.addCleanup(setattr, target, name, getattr(target, name))
+    setattr(target, name, value)
+
+
+class StubApi(object):
+    """
+    Stand-in of the calls of `Api` to Youtube, installed with `install`
+
+    Params:
+        statuses: results of `check_upload_status` in order, the last one is
+                  repeated and exceptions are raised
+        upload_failures: number of failed `upload_direct` of each file
+    """
+
+    def __init__(self, statuses=(True,), upload_failures=0):
+        self.statuses = list(statuses)
+        self.upload_failures = upload_failures
+        self.status_calls = 0
+        self.fetches = []
+        self.updates = []
+        self.attempts = {}
+        self.account = None
+        self.authenticated = True
+
+    def authenticate(self, *args, **kwargs):
+        self.authenticated = True
+
+    def fetch_video(self, video_id, coalesce=True):
+        import gdata.youtube
+
+        self.fetches.append(video_id)
+        return gdata.youtube.YouTubeVideoEntryFromString(video_entry_xml(
+            video_id, title="fetch %d" % len(self.fetches)))
+
+    def check_upload_status(self, video_id):
+        self.status_calls += 1
+        result = self.statuses.pop(0) if len(self.statuses) > 1 \
+            else self.statuses[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def upload_direct(self, video_path, title, limiter=None, **kwargs):
+        import gdata.youtube
+        from django_youtube.api import ApiError
+
+        attempt = self.attempts[video_path] = \
+            self.attempts.get(video_path, 0) + 1
+        if attempt <= self.upload_failures:
+            raise ApiError("Upload failed")
+        return gdata.youtube.YouTubeVideoEntryFromString(
+            video_entry_xml(title, title=title))
+
+    def update_video(self, video_id, title="", description="", keywords="",
+                     access_control=None):
+        import gdata.youtube
+
+        self.updates.append(video_id)
+        return gdata.youtube.YouTubeVideoEntryFromString(video_entry_xml(
+            video_id, title=title, description=description,
+            keywords=keywords))
+
+    def install(self, test):
+        """
+        Routes the calls of every `Api` to the stub until the cleanups of
+        `test` run
+
+        Returns:
+            the stub
+        """
+        from django_youtube.api import Api
+        from django_youtube.models import VideoManager
+
+        for name in ("authenticate", "fetch_video", "check_upload_status",
+                     "upload_direct", "update_video"):
+            patch(test, Api, name, self._delegate(name))
+        patch(test, Api, "_worker", lambda api: self)
+        patch(test, VideoManager, "api_for", lambda manager, video_id: self)
+        return self
+
+    def _delegate(self, name):
+        method = getattr(self, name)
+        return lambda api, *args, **kwargs: method(*args, **kwargs)
+
+
+class LocalHub(object):
+    """
+    Stand-in for the PubSubHubbub hub
+    Delivers notifications to the `push_callback` view via the test client
+
+    Usage:
+        hub = LocalHub()
+        hub.verify()
+        hub.publish([("video-id", "processing"), ("video-id", "available")])
+    """
+
+    def __init__(self, client=None, callback_url=None):
+        self.client = client or Client()
+        self.callback_url = callback_url or reverse(
+            "django_youtube.views.push_callback")
+
+    def verify(self, challenge="challenge", mode="subscribe",
+               topic="http://gdata.youtube.com/feeds/api/users/default/uploads"):
+        """
+        Sends the verification request of a subscription
+
+        Returns:
+            the response of the callback view
+        """
+        params = {"hub.mode": mode, "hub.topic": topic,
+                  "hub.challenge": challenge}
+        try:
+            params["hub.verify_token"] = settings.YOUTUBE_PUSH_VERIFY_TOKEN
+        except AttributeError:
+            pass
+        return self.client.get(self.callback_url, params)
+
+    def publish(self, states):
+        """
+        Posts a notification feed, one entry per (video_id, upload_state)
+        tuple, each state is published separately in the given order
+
+        Returns:
+            list of the responses of the callback view
+        """
+        responses = []
+        for video_id, upload_state in states:
+            body = FEED_TEMPLATE % video_entry_xml(video_id, upload_state)
+            body = body.encode("utf-8")
+            headers = {}
+            try:
+                headers["HTTP_X_HUB_SIGNATURE"] = sign(
+                    body, settings.YOUTUBE_PUSH_SECRET)
+            except AttributeError:
+                pass
+            responses.append(self.client.post(
+                self.callback_url, body, content_type="application/atom+xml",
+                **headers))
+        return responses
+
+
+class LocalImageServer(object):
+    """
+    Stand-in for the remote image host of the thumbnails
+    Serves the given bytes over http on a random local port
+
+    Usage:
+        with LocalImageServer({"/vi/abc/default.jpg": jpeg_bytes}) as server:
+            thumbnail.url = server.url("/vi/abc/default.jpg")
+    """
+
+    def __init__(self, files, content_type="image/jpeg"):
+        self.files = files
+        self.content_type = content_type
+        self.requests = []
+        self.server = None
+
+    def _handler(self):
+        try:
+            from BaseHTTPServer import BaseHTTPRequestHandler
+        except ImportError:
+            from http.server import BaseHTTPRequestHandler
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests.append(self.path)
+                data = stand_in.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", stand_in.content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        try:
+            from BaseHTTPServer import HTTPServer
+        except ImportError:
+            from http.server import HTTPServer
+
+        self.server = HTTPServer(("127.0.0.1", 0), self._handler())
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server.server_address[1], path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
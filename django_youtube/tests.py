@@ -6,6 +6,11 @@ Replace this with more appropriate tests for your application.
 """
 
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from django_youtube.api import SingleFlight
+from django_youtube.events import get_state
+from django_youtube.testing import LocalHub, patch
 
 
 class SimpleTest(TestCase):
@@ -14,3 +19,1664 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+@override_settings(YOUTUBE_PUSH_VERIFY_TOKEN="token",
+                   YOUTUBE_PUSH_SECRET="secret")
+class PushCallbackTest(TestCase):
+    def test_verification(self):
+        """
+        Subscription verification echoes the challenge
+        """
+        response = LocalHub().verify(challenge="abc")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"abc")
+
+    def test_wrong_verify_token(self):
+        hub = LocalHub()
+        response = hub.client.get(hub.callback_url, {
+            "hub.mode": "subscribe", "hub.challenge": "abc",
+            "hub.verify_token": "wrong"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_notification_publishes_state(self):
+        """
+        Pushed states are published in the given order
+        """
+        hub = LocalHub()
+        responses = hub.publish([("pushed1", "processing")])
+        self.assertEqual(responses[0].status_code, 204)
+        self.assertEqual(get_state("pushed1")["upload_state"], "processing")
+
+        hub.publish([("pushed1", "available")])
+        self.assertEqual(get_state("pushed1")["upload_state"], "available")
+
+    def test_invalid_signature(self):
+        hub = LocalHub()
+        response = hub.client.post(
+            hub.callback_url, b"<feed/>",
+            content_type="application/atom+xml",
+            HTTP_X_HUB_SIGNATURE="sha1=invalid")
+        self.assertEqual(response.status_code, 403)
+
+    def test_unsigned_notifications_without_secret(self):
+        from django.conf import settings
+
+        hub = LocalHub()
+        with self.settings():
+            del settings.YOUTUBE_PUSH_SECRET
+            responses = hub.publish([("pushed2", "processing")])
+
+        self.assertEqual(responses[0].status_code, 403)
+        self.assertEqual(get_state("pushed2"), None)
+
+
+class CheckVideoAvailabilityTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def _check(self, video_id):
+        import json
+        from django.core.urlresolvers import reverse
+
+        response = self.client.get(reverse(
+            "youtube_check_video_availability", args=[video_id]))
+        return json.loads(response.content.decode("utf-8"))["success"]
+
+    def test_final_state_is_used(self):
+        from django_youtube.events import publish_state
+        from django_youtube.testing import StubApi
+
+        api = StubApi([{"upload_state": "processing"}]).install(self)
+        publish_state("checked1", "available")
+
+        self.assertTrue(self._check("checked1"))
+        self.assertEqual(api.status_calls, 0)
+
+    def test_pending_state_is_checked_again(self):
+        from django_youtube.events import publish_state
+        from django_youtube.testing import StubApi
+
+        api = StubApi([True]).install(self)
+        publish_state("checked2", "processing")
+
+        self.assertTrue(self._check("checked2"))
+        self.assertEqual(api.status_calls, 1)
+
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        import threading
+        import time
+
+        flights = SingleFlight()
+        results = []
+
+        def slow():
+            time.sleep(0.2)
+            return "entry"
+
+        def call():
+            results.append(flights.do("fetch_video:abc", slow))
+
+        threads = [threading.Thread(target=call) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["entry"] * 5)
+        stats = flights.stats()
+        self.assertEqual(stats["calls"], 1)
+        self.assertEqual(stats["coalesced_local"], 4)
+
+    def test_errors_are_shared(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError("remote error")
+
+        self.assertRaises(ValueError, flights.do, "fetch_video:abc", fail)
+        self.assertEqual(flights.stats()["calls"], 1)
+
+    @override_settings(YOUTUBE_COALESCE_TIMEOUT=0)
+    def test_waiters_receive_the_error(self):
+        import threading
+        import time
+
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = {}
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("remote error")
+
+        def call(name):
+            try:
+                flights.do("fetch_video:abc", fail)
+            except ValueError as e:
+                errors[name] = e
+
+        leader = threading.Thread(target=call, args=("leader",))
+        leader.start()
+        started.wait(5)
+
+        # the key is in flight, the waiter blocks on it
+        waiter = threading.Thread(target=call, args=("waiter",))
+        waiter.start()
+        time.sleep(0.2)
+        release.set()
+        leader.join(5)
+        waiter.join(5)
+
+        self.assertTrue(errors["waiter"] is errors["leader"])
+        stats = flights.stats()
+        self.assertEqual(stats["calls"], 1)
+        self.assertEqual(stats["coalesced_local"], 1)
+
+
+class SearchTokenizeTest(TestCase):
+    def test_tokenize(self):
+        from django_youtube.search import tokenize
+        self.assertEqual(tokenize("The Cats, and DOGS!"), ["cats", "dogs"])
+        self.assertEqual(tokenize(None), [])
+
+    def test_split_keywords(self):
+        from django_youtube.search import split_keywords
+        self.assertEqual(split_keywords("Music, live ,, "), ["music", "live"])
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django_youtube.api import AccessControl
+        from django_youtube.models import Video
+        from django_youtube.search import index_videos
+
+        self.owner = get_user_model().objects.create(username="erin")
+        Video.objects.bulk_create([
+            Video(user=self.owner, video_id="title", title="Cats playing",
+                  keywords="pets"),
+            Video(user=self.owner, video_id="description",
+                  title="Playing", description="cats",
+                  keywords="funny pets"),
+            Video(user=self.owner, video_id="private", title="Cats playing",
+                  access_control=AccessControl.Private),
+            Video(user=self.owner, video_id="dogs", title="Dogs playing",
+                  keywords="pets")])
+        index_videos(Video.objects.all())
+
+    def _video_ids(self, query, **kwargs):
+        from django_youtube.search import search
+
+        return [video.video_id for video, score
+                in search(query, **kwargs)["results"]]
+
+    def test_ranked_by_the_field_weights(self):
+        from django_youtube.search import search
+
+        found = search("cats")
+        self.assertEqual(found["total"], 2)
+        self.assertEqual([(video.video_id, score)
+                          for video, score in found["results"]],
+                         [("title", 3), ("description", 1)])
+        self.assertEqual(found["facets"], [("funny pets", 1), ("pets", 1)])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self._video_ids("cats playing"),
+                         ["title", "description"])
+        self.assertEqual(self._video_ids("dogs playing"), ["dogs"])
+        self.assertEqual(self._video_ids("cats dogs"), [])
+
+    def test_private_videos_of_others_are_not_found(self):
+        import json
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import AnonymousUser
+        from django.core.urlresolvers import reverse
+
+        other = get_user_model().objects.create(username="frank")
+        for user in (None, AnonymousUser(), other):
+            self.assertFalse("private" in self._video_ids("cats", user=user))
+        self.assertTrue("private" in self._video_ids("cats",
+                                                      user=self.owner))
+
+        response = self.client.get(reverse("youtube_search"), {"q": "cats"})
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["total"],
+                         2)
+
+    def test_keyword_matches_whole_keywords(self):
+        self.assertEqual(sorted(self._video_ids("playing", keyword="Pets")),
+                         ["description", "dogs", "title"])
+        self.assertEqual(self._video_ids("playing", keyword="funny pets"),
+                         ["description"])
+        self.assertEqual(self._video_ids("playing", keyword="pet"), [])
+        self.assertEqual(self._video_ids("playing", keyword="funny"), [])
+
+
+class ThumbnailMirrorTest(TestCase):
+    def test_mirror(self):
+        """
+        Thumbnails are stored by their content hash, same image once
+        """
+        from django.core.files.storage import default_storage
+        from django_youtube.models import Thumbnail
+        from django_youtube.testing import LocalImageServer
+        from django_youtube.thumbnails import mirror
+
+        with LocalImageServer({"/a.jpg": b"image", "/b.jpg": b"image"}) as server:
+            Thumbnail.objects.create(url=server.url("/a.jpg"))
+            Thumbnail.objects.create(url=server.url("/b.jpg"))
+            first = mirror(server.url("/a.jpg"))
+            second = mirror(server.url("/b.jpg"))
+
+        try:
+            self.assertEqual(first, second)
+            thumbnail = Thumbnail.objects.get(url=server.url("/a.jpg"))
+            self.assertEqual(thumbnail.local_file, first)
+
+            response = self.client.get(thumbnail.get_absolute_url())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue("max-age" in response["Cache-Control"])
+        finally:
+            default_storage.delete(first)
+
+
+    def test_content_type_is_kept(self):
+        from django.core.files.storage import default_storage
+        from django_youtube.models import Thumbnail
+        from django_youtube.testing import LocalImageServer
+        from django_youtube.thumbnails import mirror
+
+        with LocalImageServer({"/a.png": b"png image"},
+                              content_type="image/png") as server:
+            Thumbnail.objects.create(url=server.url("/a.png"))
+            name = mirror(server.url("/a.png"))
+
+        try:
+            self.assertTrue(name.endswith(".png"))
+            thumbnail = Thumbnail.objects.get()
+            self.assertTrue(thumbnail.get_absolute_url().endswith(".png"))
+            response = self.client.get(thumbnail.get_absolute_url())
+            self.assertEqual(response["Content-Type"], "image/png")
+            self.assertEqual(response.content, b"png image")
+        finally:
+            default_storage.delete(name)
+
+    def test_embeds_are_invalidated(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django.core.files.storage import default_storage
+        from django_youtube import embed
+        from django_youtube.models import Thumbnail, Video
+        from django_youtube.testing import LocalImageServer
+        from django_youtube.thumbnails import mirror
+
+        user = get_user_model().objects.create(username="mirrored")
+        Video.objects.bulk_create([Video(user=user, video_id="mirrored")])
+        video = Video.objects.get(video_id="mirrored")
+        with LocalImageServer({"/c.jpg": b"embedded image"}) as server:
+            Thumbnail.objects.create(video=video, url=server.url("/c.jpg"))
+            key = embed._key("mirrored", list(embed.presets())[0])
+            cache.set(key, "old snippet")
+            name = mirror(server.url("/c.jpg"))
+
+        try:
+            self.assertEqual(cache.get(key), None)
+        finally:
+            default_storage.delete(name)
+
+    def test_extension_for(self):
+        from django_youtube.thumbnails import extension_for
+
+        self.assertEqual(extension_for("image/gif; charset=binary", b""),
+                         ".gif")
+        self.assertEqual(extension_for("application/octet-stream",
+                                       b"\x89PNG\r\n"), ".png")
+        self.assertEqual(extension_for(None, b"RIFF\0\0\0\0WEBPVP8"),
+                         ".webp")
+        self.assertEqual(extension_for(None, b"image"), ".jpg")
+
+
+class ApiCallBudgetTest(TestCase):
+    def test_calls_are_recorded(self):
+        from django_youtube.budget import api_call_budget, remote_call
+
+        with api_call_budget() as outer:
+            with api_call_budget() as inner:
+                remote_call("GetYouTubeVideoEntry", lambda uri: uri, "uri")
+            remote_call("DeleteVideoEntry", lambda: True)
+
+        self.assertEqual(inner.count, 1)
+        self.assertEqual(outer.count, 2)
+        self.assertEqual(outer.summary()["methods"]["DeleteVideoEntry"], 1)
+
+    def test_budget_is_enforced(self):
+        from django_youtube.api import ApiCallBudgetExceeded
+        from django_youtube.budget import api_call_budget, remote_call
+
+        with api_call_budget(limit=1, action="raise") as calls:
+            remote_call("ProgrammaticLogin", lambda: None)
+            self.assertRaises(ApiCallBudgetExceeded, remote_call,
+                              "GetYouTubeVideoEntry", lambda: None)
+        self.assertEqual(calls.count, 1)
+
+
+# receivers of DeferredSignalTest, deferred receivers are module level
+deferred_calls = []
+
+
+def record_call(sender, value, **kwargs):
+    deferred_calls.append((sender, value))
+
+
+def fail_once(sender, value, **kwargs):
+    if not deferred_calls:
+        deferred_calls.append("failed")
+        raise ValueError("receiver error")
+    deferred_calls.append((sender, value))
+
+
+def fail_api_once(sender, value, **kwargs):
+    from django_youtube.api import ApiError
+
+    if not deferred_calls:
+        deferred_calls.append("failed")
+        raise ApiError("Youtube is down")
+    deferred_calls.append((sender, value))
+
+
+class DeferredSignalTest(TestCase):
+    def setUp(self):
+        from django_youtube.dispatch import DeferredSignal
+
+        del deferred_calls[:]
+        self.signal = DeferredSignal("test_signal", providing_args=["value"])
+
+    def test_receivers_are_deferred(self):
+        from django_youtube.dispatch import deliver_all
+        from django_youtube.models import DeferredCall
+
+        self.signal.connect(record_call, deferred=True)
+        self.assertEqual(self.signal.send(sender="sender", value=1), [])
+        self.signal.send(sender="sender", value=2)
+        self.assertEqual(deferred_calls, [])
+        self.assertEqual(DeferredCall.objects.count(), 2)
+
+        deliver_all()
+        self.assertEqual(deferred_calls, [("sender", 1), ("sender", 2)])
+        self.assertEqual(DeferredCall.objects.count(), 0)
+
+    def test_failed_call_is_retried_in_order(self):
+        from django_youtube.dispatch import deliver_all
+        from django_youtube.models import DeferredCall
+
+        self.signal.connect(fail_once, deferred=True)
+        self.signal.send(sender="sender", value=1)
+        self.signal.send(sender="sender", value=2)
+
+        deliver_all()
+        # the second call waits for the retry of the first one
+        self.assertEqual(deferred_calls, ["failed"])
+        first = DeferredCall.objects.order_by("id")[0]
+        self.assertEqual(first.attempts, 1)
+
+        DeferredCall.objects.update(next_attempt_at=None)
+        deliver_all()
+        self.assertEqual(deferred_calls, ["failed", ("sender", 1),
+                                          ("sender", 2)])
+        self.assertEqual(DeferredCall.objects.count(), 0)
+
+    def test_api_errors_are_retried(self):
+        from django_youtube.dispatch import deliver_all
+        from django_youtube.models import DeferredCall
+
+        self.signal.connect(fail_api_once, deferred=True)
+        self.signal.send(sender="sender", value=1)
+
+        deliver_all()
+        call = DeferredCall.objects.get()
+        self.assertEqual((call.attempts, call.failed), (1, False))
+        self.assertTrue("Youtube is down" in call.last_error)
+
+        DeferredCall.objects.update(next_attempt_at=None)
+        deliver_all()
+        self.assertEqual(deferred_calls, ["failed", ("sender", 1)])
+
+
+@override_settings(YOUTUBE_ACCOUNTS={
+    "main": {"email": "main", "password": "secret", "weight": 2},
+    "spare": {"email": "spare", "password": "secret", "weight": 1,
+              "quota": 2000},
+})
+class AccountRoutingTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django_youtube import accounts
+
+        # quota usage is kept in the cache
+        cache.clear()
+        accounts._accounts = None
+        self.addCleanup(setattr, accounts, "_accounts", None)
+
+    def test_uploads_are_placed_by_load_per_weight(self):
+        from django_youtube.accounts import UPLOAD_COST, accounts, \
+            choose_account
+
+        main = accounts()["main"]
+        self.assertEqual(choose_account(UPLOAD_COST).name, "main")
+        with main.busy():
+            with main.busy():
+                self.assertEqual(choose_account(UPLOAD_COST).name, "spare")
+
+    def test_accounts_without_quota_are_skipped(self):
+        from django_youtube.accounts import UPLOAD_COST, accounts, \
+            choose_account
+        from django_youtube.api import AccountQuotaExceeded
+
+        main, spare = accounts()["main"], accounts()["spare"]
+        spare.charge("InsertVideoEntry")
+        self.assertEqual(spare.remaining(), 2000 - UPLOAD_COST)
+        with main.busy():
+            with main.busy():
+                self.assertEqual(choose_account(UPLOAD_COST).name, "main")
+
+        main.quota = 0
+        self.assertRaises(AccountQuotaExceeded, choose_account, UPLOAD_COST)
+
+    def test_quota_is_reserved_atomically(self):
+        from django_youtube.accounts import UPLOAD_COST, accounts, \
+            choose_account
+        from django_youtube.api import AccountQuotaExceeded
+
+        main, spare = accounts()["main"], accounts()["spare"]
+        self.assertTrue(spare.reserve(UPLOAD_COST))
+        # the second one would overshoot, it's rolled back
+        self.assertFalse(spare.reserve(UPLOAD_COST))
+        self.assertEqual(spare.used(), UPLOAD_COST)
+
+        main.quota = UPLOAD_COST
+        self.assertEqual(choose_account(UPLOAD_COST, reserve=True).name,
+                         "main")
+        self.assertEqual(main.used(), UPLOAD_COST)
+        self.assertRaises(AccountQuotaExceeded, choose_account, UPLOAD_COST,
+                          True)
+        self.assertEqual(main.used(), UPLOAD_COST)
+
+    def test_videos_without_account_belong_to_the_default_account(self):
+        from django_youtube.accounts import owner_account
+        from django_youtube.api import OperationError
+
+        self.assertEqual(owner_account("spare"), "spare")
+        with self.settings(YOUTUBE_DEFAULT_ACCOUNT="spare"):
+            self.assertEqual(owner_account(None), "spare")
+        with self.settings(YOUTUBE_AUTH_EMAIL="main"):
+            self.assertEqual(owner_account(None), "main")
+        with self.settings(YOUTUBE_AUTH_EMAIL="other"):
+            self.assertRaises(OperationError, owner_account, None)
+
+    def test_expired_token_logs_in_again(self):
+        import gdata.service
+        import gdata.youtube.service
+        from django_youtube.accounts import accounts
+        from django_youtube.api import Api
+
+        account = accounts()["main"]
+        logins = []
+
+        def login():
+            logins.append(len(logins) + 1)
+            account.token = "token%d" % logins[-1]
+            return account.token
+
+        def fetch(service, uri):
+            if service.GetClientLoginToken() == "token1":
+                raise gdata.service.RequestError({
+                    "status": 401, "reason": "Token expired", "body": ""})
+            return "entry"
+
+        account._login = login
+        service_class = gdata.youtube.service.YouTubeService
+        patch(self, service_class, "GetYouTubeVideoEntry", fetch)
+
+        with self.settings(YOUTUBE_DEVELOPER_KEY="key"):
+            api = Api("main")
+            api.authenticate()
+            self.assertEqual(api._call("GetYouTubeVideoEntry", "uri"),
+                             "entry")
+            # the other apis of the thread use the new token too
+            other = Api("main")
+            other.authenticate()
+            self.assertEqual(other._call("GetYouTubeVideoEntry", "uri"),
+                             "entry")
+        self.assertEqual(logins, [1, 2])
+
+    def test_upload_return_uses_the_signed_account(self):
+        import gdata.youtube
+        from django.contrib.auth import get_user_model
+        from django.core import signing
+        from django.core.urlresolvers import reverse
+        from django_youtube.models import Video
+        from django_youtube.testing import video_entry_xml
+        from django_youtube.views import UPLOAD_RETURN_SALT
+
+        users = get_user_model().objects
+        user = users.create_user("ivan", "ivan@example.com", "secret")
+        other = users.create_user("judy", "judy@example.com", "secret")
+        self.client.login(username="ivan", password="secret")
+
+        entry = gdata.youtube.YouTubeVideoEntryFromString(
+            video_entry_xml("returned"))
+        patch(self, Video, "entry", lambda self, *args, **kwargs: entry)
+
+        def upload_return(account, user, salt=UPLOAD_RETURN_SALT):
+            return self.client.get(reverse(
+                "youtube_upload_return_account", kwargs={
+                    "signed_account": signing.dumps(
+                        {"account": account, "user": user.pk}, salt=salt)}),
+                {"status": "200", "id": "returned"})
+
+        self.assertEqual(upload_return("spare", other).status_code, 403)
+        self.assertEqual(upload_return("spare", user, "other").status_code,
+                         403)
+        self.assertFalse(Video.objects.exists())
+
+        self.assertEqual(upload_return("spare", user).status_code, 302)
+        self.assertEqual(Video.objects.get(video_id="returned").account,
+                         "spare")
+
+
+class CatalogTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django_youtube.models import Thumbnail, Video
+
+        self.user = get_user_model().objects.create(username="alice")
+        # bulk_create doesn't send requests to Youtube like save does
+        Video.objects.bulk_create([
+            Video(user=self.user, video_id="v%d" % i, title="video %d" % i)
+            for i in range(5)])
+        Thumbnail.objects.bulk_create([
+            Thumbnail(video=video, url="http://example.com/%s.jpg" % i)
+            for video in Video.objects.all() for i in range(2)])
+
+    def _export(self, format):
+        import io
+        from django_youtube import catalog
+
+        stream = io.BytesIO() if catalog.PY2 else io.StringIO()
+        self.assertEqual(catalog.export(stream, format, chunk_size=2), 5)
+        stream.seek(0)
+        return stream
+
+    def test_roundtrip(self):
+        from django_youtube import catalog
+        from django_youtube.models import Thumbnail, Video
+
+        for format in catalog.FORMATS:
+            stream = self._export(format)
+            Video.objects.filter(video_id="v0").delete()
+            Video.objects.filter(video_id="v1").update(title="changed")
+            Thumbnail.objects.filter(video__video_id="v2").delete()
+
+            counts = catalog.Importer(batch_size=2).run(
+                catalog.READERS[format](stream))
+            self.assertEqual(counts, {"created": 1, "updated": 4,
+                                      "skipped": 0})
+            self.assertEqual(Video.objects.get(video_id="v1").title,
+                             "video 1")
+            self.assertEqual(Thumbnail.objects.filter(
+                video__video_id__in=["v0", "v2"]).count(), 4)
+            self.assertEqual(Thumbnail.objects.count(), 10)
+
+    def test_existing_videos_are_skipped(self):
+        from django_youtube import catalog
+
+        counts = catalog.Importer(update=False).run(
+            catalog.read_json_lines(self._export("jsonl")))
+        self.assertEqual(counts["skipped"], 5)
+
+    def test_caches_are_invalidated(self):
+        from django.core.cache import cache
+        from django_youtube import catalog, embed, videolists
+        from django_youtube.models import Video
+
+        cache.clear()
+        stream = self._export("jsonl")
+        Video.objects.filter(video_id="v0").delete()
+        self.assertEqual(len(videolists.user_videos("alice")), 4)
+        key = embed._key("v1", list(embed.presets())[0])
+        cache.set(key, "old snippet")
+
+        catalog.Importer().run(catalog.read_json_lines(stream))
+        self.assertEqual(len(videolists.user_videos("alice")), 5)
+        self.assertEqual(cache.get(key), None)
+
+
+class VideoJobTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django_youtube.models import Video
+
+        user = get_user_model().objects.create(username="bob")
+        Video.objects.bulk_create([Video(user=user, video_id="v1"),
+                                   Video(user=user, video_id="v2")])
+
+    def test_save_without_sync_queues_a_job(self):
+        from django_youtube.models import Video, VideoJob
+
+        video = Video.objects.get(video_id="v1")
+        video.title = "changed"
+        video.save(sync=False)
+
+        self.assertTrue(Video.objects.get(video_id="v1").sync_pending)
+        job = VideoJob.objects.get()
+        self.assertEqual((job.action, job.total), ("sync", 1))
+
+    def test_run_records_the_progress(self):
+        from django_youtube import jobs
+        from django_youtube.models import Video, VideoJob
+
+        calls = []
+
+        def fail_first(video):
+            calls.append(video.video_id)
+            if video.video_id == "v1":
+                raise ValueError("remote error")
+
+        job = jobs.start("refresh", Video.objects.all())
+        original = jobs.ACTIONS["refresh"]
+        jobs.ACTIONS["refresh"] = fail_first
+        try:
+            jobs.run(job.id)
+        finally:
+            jobs.ACTIONS["refresh"] = original
+
+        job = VideoJob.objects.get(id=job.id)
+        self.assertEqual(calls, ["v1", "v2"])
+        self.assertEqual((job.state, job.done, job.failed),
+                         ("finished", 1, 1))
+        self.assertEqual(job.progress(), 100)
+        self.assertTrue(job.errors.startswith("v1: "))
+
+
+    def _stale_job(self, state="running", done=0):
+        import datetime
+        from django.utils import timezone
+        from django_youtube import jobs
+        from django_youtube.models import Video, VideoJob
+
+        job = jobs.start("refresh", Video.objects.all())
+        VideoJob.objects.filter(id=job.id).update(
+            state=state, done=done, updated_at=timezone.now() -
+            datetime.timedelta(hours=1))
+        return job
+
+    def test_stale_jobs(self):
+        from django_youtube import jobs
+        from django_youtube.models import VideoJob
+
+        job = self._stale_job()
+        fresh = jobs.start("refresh", [])
+        self.assertEqual(list(jobs.stale_jobs().values_list("id", flat=True)),
+                         [job.id])
+        self.assertTrue(VideoJob.objects.get(id=job.id).is_stale())
+        self.assertFalse(VideoJob.objects.get(id=fresh.id).is_stale())
+        self.assertEqual(list(jobs.stale_jobs(2 * 60 * 60)), [])
+
+    def test_resume_stale_jobs(self):
+        from django_youtube import jobs
+        from django_youtube.models import VideoJob
+
+        calls = []
+        original = jobs.ACTIONS["refresh"]
+        jobs.ACTIONS["refresh"] = lambda video: calls.append(video.video_id)
+        self.addCleanup(jobs.ACTIONS.__setitem__, "refresh", original)
+
+        job = self._stale_job(done=1)
+        self.assertEqual(jobs.resume_stale(), [job.id])
+        # continues after the processed video
+        self.assertEqual(calls, ["v2"])
+        job = VideoJob.objects.get(id=job.id)
+        self.assertEqual((job.state, job.done), ("finished", 2))
+        self.assertEqual(jobs.resume_stale(), [])
+
+    def test_expire_stale_jobs_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        from django_youtube.models import VideoJob
+
+        job = self._stale_job(state="queued", done=1)
+        out = StringIO()
+        call_command("youtube_jobs", expire=True, stdout=out)
+
+        self.assertTrue("Expired jobs: %d" % job.id in out.getvalue())
+        job = VideoJob.objects.get(id=job.id)
+        self.assertEqual(job.state, "expired")
+        self.assertFalse(job.is_stale())
+        self.assertTrue("1 videos are not processed" in job.errors)
+
+
+class VideoListCacheTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django_youtube.models import Video
+
+        cache.clear()
+        user = get_user_model().objects.create(username="carol")
+        Video.objects.bulk_create([Video(user=user, video_id="v1"),
+                                   Video(user=user, video_id="v2")])
+
+    def test_list_is_cached_until_a_video_is_saved(self):
+        from django.db import models
+        from django_youtube.models import Video
+        from django_youtube.videolists import user_videos
+
+        with self.assertNumQueries(1):
+            self.assertEqual([row[1] for row in user_videos("carol")],
+                             ["v1", "v2"])
+        with self.assertNumQueries(0):
+            user_videos("carol")
+
+        # save the row without syncing with Youtube, post_save is sent
+        video = Video.objects.get(video_id="v2")
+        models.Model.save(video, update_fields=["title"])
+        with self.assertNumQueries(1):
+            user_videos("carol")
+
+    def test_unknown_user(self):
+        from django.contrib.auth import get_user_model
+        from django.http import Http404
+        from django.test.client import RequestFactory
+        from django_youtube.videolists import user_videos
+        from django_youtube.views import video_list
+
+        self.assertEqual(user_videos("nobody"), None)
+        self.assertRaises(Http404, video_list,
+                          RequestFactory().get("/youtube/videos/"), "nobody")
+
+        # unknown users are not cached
+        get_user_model().objects.create(username="nobody")
+        self.assertEqual(user_videos("nobody"), [])
+
+    def test_list_read_before_a_change_is_not_stored_over_it(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django_youtube import videolists
+
+        # a request reads the list, the video is changed before it's stored
+        key = videolists._key("carol", videolists._version("carol"))
+        videolists.invalidate(get_user_model().objects.get(
+            username="carol").id)
+        cache.set(key, [], 60)
+
+        self.assertEqual([row[1] for row in videolists.user_videos("carol")],
+                         ["v1", "v2"])
+
+
+def _wait_until(condition, timeout=5):
+    import time
+
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class StatePollerTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def _use_api(self, statuses):
+        from django_youtube.testing import StubApi
+
+        return StubApi(statuses).install(self)
+
+    def _watch(self, video_id):
+        from django_youtube.events import StatePoller
+
+        with self.settings(YOUTUBE_POLL_INTERVAL=0.05):
+            StatePoller.watch(video_id)
+        return StatePoller.pollers[video_id]
+
+    def test_states_are_published_until_final(self):
+        from django_youtube.events import StatePoller
+
+        api = self._use_api([
+            {"upload_state": "processing", "detailed_message": ""}, True])
+
+        poller = self._watch("polled1")
+        self.assertTrue(_wait_until(
+            lambda: (get_state("polled1") or {}).get("upload_state") ==
+            "available"))
+
+        StatePoller.unwatch("polled1")
+        poller.join(5)
+        self.assertFalse(poller.is_alive())
+        self.assertFalse("polled1" in StatePoller.pollers)
+        # nothing is checked after the final state
+        self.assertEqual(api.status_calls, 2)
+
+    def test_api_errors_keep_the_poller_running(self):
+        from django_youtube.api import ApiError
+        from django_youtube.events import StatePoller
+
+        api = self._use_api([ApiError("Authentication is required")])
+
+        poller = self._watch("polled2")
+        self.assertTrue(_wait_until(lambda: api.status_calls >= 2))
+        self.assertTrue(poller.is_alive())
+
+        StatePoller.unwatch("polled2")
+        poller.join(5)
+        self.assertFalse("polled2" in StatePoller.pollers)
+
+    def test_dead_poller_is_unregistered(self):
+        from django_youtube import events
+
+        def fail(video_id):
+            raise SystemExit()
+
+        original = events.get_state
+        events.get_state = fail
+        try:
+            poller = self._watch("polled3")
+            poller.join(5)
+        finally:
+            events.get_state = original
+
+        # the next watcher starts a new poller
+        self.assertFalse("polled3" in events.StatePoller.pollers)
+        self._use_api([True])
+        new_poller = self._watch("polled3")
+        self.assertFalse(new_poller is poller)
+        events.StatePoller.unwatch("polled3")
+        new_poller.join(5)
+
+
+class ProgressTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_progress_file_reports_sent_bytes(self):
+        import os
+        import tempfile
+        from django_youtube.api import ProgressFile
+
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b"0123456789")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        calls = []
+        video_file = ProgressFile(path, lambda sent, total:
+                                  calls.append((sent, total)))
+        try:
+            self.assertEqual(video_file.len, 10)
+            self.assertEqual(video_file.read(4), b"0123")
+            self.assertEqual(video_file.read(), b"456789")
+            video_file.seek(0)
+            self.assertEqual(video_file.sent, 0)
+        finally:
+            video_file.close()
+        self.assertEqual(calls, [(4, 10), (10, 10)])
+
+    def test_upload_handler_publishes_received_bytes(self):
+        from django.test.client import RequestFactory
+        from django_youtube.events import get_progress
+        from django_youtube.uploadhandlers import ProgressUploadHandler
+
+        request = RequestFactory().post("/?progress_id=upload1")
+        handler = ProgressUploadHandler(request)
+        handler.handle_raw_input(None, {}, 100, "boundary")
+        self.assertEqual(get_progress("upload1")["received"], 0)
+
+        handler.receive_data_chunk(b"x" * 60, 0)
+        handler.receive_data_chunk(b"x" * 40, 60)
+        handler.file_complete(100)
+        progress = get_progress("upload1")
+        self.assertEqual((progress["state"], progress["received"],
+                          progress["total"]), ("receiving", 100, 100))
+
+    def test_upload_without_progress_id(self):
+        from django.test.client import RequestFactory
+        from django_youtube.uploadhandlers import ProgressUploadHandler
+
+        handler = ProgressUploadHandler(RequestFactory().post("/"))
+        handler.handle_raw_input(None, {}, 100, "boundary")
+        self.assertEqual(handler.receive_data_chunk(b"data", 0), b"data")
+        self.assertEqual(handler.received, 0)
+
+    @override_settings(YOUTUBE_EVENTS_POLL=False, YOUTUBE_EVENTS_INTERVAL=0.01,
+                       YOUTUBE_LONGPOLL_TIMEOUT=0.05)
+    def test_video_state_view(self):
+        import json
+        from django.contrib.auth import get_user_model
+        from django.core.urlresolvers import reverse
+        from django_youtube.events import publish_state
+        from django_youtube.models import Video
+
+        url = reverse("youtube_video_state", kwargs={"video_id": "state1"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        user = get_user_model().objects.create(username="stella")
+        Video.objects.bulk_create([Video(user=user, video_id="state1")])
+        data = json.loads(self.client.get(url).content.decode("utf-8"))
+        self.assertEqual(data["upload_state"], None)
+
+        state = publish_state("state1", "available")
+        # final states are returned even if the version is the same
+        data = json.loads(self.client.get(
+            url, {"version": repr(state["version"])}).content.decode("utf-8"))
+        self.assertEqual(data["upload_state"], "available")
+
+    def test_unchanged_state_keeps_its_version(self):
+        from django_youtube.events import publish_state
+
+        first = publish_state("state2", "processing")
+        self.assertEqual(publish_state("state2", "processing")["version"],
+                         first["version"])
+        self.assertNotEqual(publish_state("state2", "processing",
+                                          "transcoding")["version"],
+                            first["version"])
+
+    def test_upload_progress_events_view(self):
+        from django.core.urlresolvers import reverse
+        from django_youtube.events import publish_progress
+
+        publish_progress("upload2", "done", 10, 10, video_id="abc")
+        response = self.client.get(reverse(
+            "youtube_upload_progress_events",
+            kwargs={"progress_id": "upload2"}))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertTrue("event: progress" in content)
+        self.assertTrue('"video_id": "abc"' in content)
+
+
+class DirectUploadDedupeTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django.test.client import RequestFactory
+        from django_youtube import views
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username="dave")
+        self.request = RequestFactory().post("/")
+        self.request.user = self.user
+
+        self.uploads = []
+
+        def upload(request, form, progress_id=None, content_hash=None):
+            self.uploads.append(content_hash)
+            return "uploaded"
+
+        patch(self, views, "_direct_upload", upload)
+
+    def _create_video(self, video_id, upload_state=None):
+        from django_youtube.models import Video
+
+        Video.objects.bulk_create([Video(
+            user=self.user, video_id=video_id, content_hash="hash",
+            upload_state=upload_state)])
+
+    def test_hashing_upload_handler(self):
+        import hashlib
+        from django.test.client import RequestFactory
+        from django_youtube.uploadhandlers import HashingUploadHandler
+
+        handler = HashingUploadHandler(RequestFactory().post("/"))
+        handler.new_file("file_on_server", "a.mp4", "video/mp4", 8)
+        self.assertEqual(handler.receive_data_chunk(b"vid", 0), b"vid")
+        handler.receive_data_chunk(b"eo data", 3)
+        handler.file_complete(10)
+        self.assertEqual(handler.digests["file_on_server"],
+                         hashlib.sha256(b"video data").hexdigest())
+
+    def test_earlier_upload_is_used(self):
+        from django_youtube.views import _deduplicated_upload
+
+        self._create_video("earlier")
+        self.assertEqual(
+            _deduplicated_upload(self.request, None, None, "hash"),
+            "earlier")
+        self.assertEqual(self.uploads, [])
+
+    def test_failed_uploads_are_not_used(self):
+        from django_youtube.events import publish_state
+        from django_youtube.views import _deduplicated_upload
+
+        self._create_video("rejected", "rejected")
+        self._create_video("failed")
+        publish_state("failed", "failed")
+        self.assertEqual(
+            _deduplicated_upload(self.request, None, None, "hash"),
+            "uploaded")
+        self.assertEqual(self.uploads, ["hash"])
+
+    def test_concurrent_upload_is_not_waited(self):
+        from django.core.cache import cache
+        from django_youtube.views import UploadInProgress, \
+            _deduplicated_upload
+
+        # another request is uploading the same file
+        lock_key = "django_youtube:direct-upload:%s:hash" % self.user.pk
+        cache.add(lock_key, "other")
+        try:
+            _deduplicated_upload(self.request, None, "mine", "hash")
+        except UploadInProgress as e:
+            self.assertEqual(e.progress_id, "other")
+        else:
+            self.fail("UploadInProgress not raised")
+        self.assertEqual(self.uploads, [])
+
+        # the next request uploads after the other one fails
+        cache.delete(lock_key)
+        self.assertEqual(
+            _deduplicated_upload(self.request, None, "mine", "hash"),
+            "uploaded")
+        self.assertEqual(self.uploads, ["hash"])
+        # the lock is released after the upload
+        self.assertTrue(cache.add(lock_key, 1))
+
+    def test_upload_in_progress_response(self):
+        import json
+        from django.core.urlresolvers import reverse
+        from django_youtube.views import UploadInProgress, \
+            _upload_in_progress_response
+
+        response = _upload_in_progress_response(UploadInProgress("other"),
+                                                True)
+        self.assertEqual(response.status_code, 409)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(data["progress_id"], "other")
+        self.assertEqual(data["progress_url"], reverse(
+            "youtube_upload_progress_events",
+            kwargs={"progress_id": "other"}))
+        self.assertEqual(_upload_in_progress_response(
+            UploadInProgress(), False).status_code, 409)
+
+
+class UploadLifecycleTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.core.files.storage import FileSystemStorage
+        from django_youtube import lifecycle
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage = FileSystemStorage(location=directory)
+        patch(self, lifecycle, "upload_storage", self.storage)
+
+    def _upload(self, name, age):
+        """
+        Stores a file and its row created `age` seconds ago
+        """
+        import datetime
+        import os
+        import time
+        from django.core.files.base import ContentFile
+        from django.utils import timezone
+        from django_youtube.models import UploadedVideo
+
+        name = self.storage.save(name, ContentFile(b"video"))
+        mtime = time.time() - age
+        os.utime(self.storage.path(name), (mtime, mtime))
+        video = UploadedVideo.objects.create(file_on_server=name)
+        UploadedVideo.objects.filter(id=video.id).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=age))
+        return video, name
+
+    def test_expired(self):
+        from django_youtube.models import UploadedVideo
+
+        old, name = self._upload("videos/old.mp4", 7200)
+        new, name = self._upload("videos/new.mp4", 60)
+        UploadedVideo.objects.filter(id=new.id).update(created_at=None)
+        fresh, name = self._upload("videos/fresh.mp4", 60)
+
+        # rows without a creation time are created before the field
+        self.assertEqual(
+            set(UploadedVideo.objects.expired(3600).values_list("id",
+                                                                flat=True)),
+            set([old.id, new.id]))
+        with self.settings(YOUTUBE_UPLOAD_TTL=30):
+            self.assertEqual(UploadedVideo.objects.expired().count(), 3)
+
+    def test_delete_expired(self):
+        from django_youtube.lifecycle import delete_expired
+        from django_youtube.models import UploadedVideo
+
+        old, old_name = self._upload("videos/old.mp4", 7200)
+        new, new_name = self._upload("videos/new.mp4", 60)
+
+        self.assertEqual(delete_expired(3600, dry_run=True), (1, 5))
+        self.assertTrue(self.storage.exists(old_name))
+
+        self.assertEqual(delete_expired(3600, batch_size=1), (1, 5))
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertTrue(self.storage.exists(new_name))
+        self.assertEqual(list(UploadedVideo.objects.values_list("id",
+                                                                flat=True)),
+                         [new.id])
+
+    def test_delete_orphans(self):
+        import os
+        import time
+        from django.core.files.base import ContentFile
+        from django_youtube.lifecycle import delete_orphans
+
+        known, known_name = self._upload("videos/known.mp4", 7200)
+        old = self.storage.save("videos/2014/old.mp4", ContentFile(b"video"))
+        mtime = time.time() - 7200
+        os.utime(self.storage.path(old), (mtime, mtime))
+        # might be still uploading
+        new = self.storage.save("videos/new.mp4", ContentFile(b"video"))
+
+        self.assertEqual(delete_orphans(3600, batch_size=1), (1, 5))
+        self.assertFalse(self.storage.exists(old))
+        self.assertTrue(self.storage.exists(new))
+        self.assertTrue(self.storage.exists(known_name))
+
+    def test_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        from django_youtube.models import UploadedVideo
+
+        old, name = self._upload("videos/old.mp4", 7200)
+        out = StringIO()
+        call_command("youtube_gc", ttl=3600, stdout=out)
+
+        self.assertTrue("Expired uploads: 1 rows" in out.getvalue())
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(UploadedVideo.objects.exists())
+
+
+@override_settings(YOUTUBE_DEVELOPER_KEY="key")
+class BulkUploadTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        import time
+        from django_youtube import api
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.paths = []
+        for name in ("a", "b"):
+            path = "%s/%s.mp4" % (directory, name)
+            with open(path, "wb") as f:
+                f.write(b"video")
+            self.paths.append(path)
+
+        self.sleeps = []
+
+        class FakeTime(object):
+            time = staticmethod(time.time)
+            sleep = staticmethod(self.sleeps.append)
+
+        patch(self, api, "time", FakeTime)
+
+    def _upload_many(self, failures, retries=3, error=None):
+        from django_youtube.api import Api
+        from django_youtube.testing import StubApi
+
+        stub = StubApi(upload_failures=failures).install(self)
+        if error is not None:
+            def fail(*args, **kwargs):
+                raise error
+            patch(self, stub, "upload_direct", fail)
+        api = Api()
+        api.authenticated = True
+        videos = [{"video_path": path, "title": path[-5:-4]}
+                  for path in self.paths]
+        return api.upload_many(videos, workers=1, retries=retries)
+
+    def test_api_errors_are_retried_with_backoff(self):
+        results = self._upload_many(failures=2)
+
+        self.assertEqual([result["video_id"] for result in results],
+                         ["a", "b"])
+        self.assertEqual([result["attempts"] for result in results], [3, 3])
+        self.assertEqual([result["error"] for result in results],
+                         [None, None])
+        self.assertEqual(self.sleeps, [1, 2, 1, 2])
+
+    def test_failure_after_the_last_attempt(self):
+        results = self._upload_many(failures=3)
+
+        self.assertEqual([result["video_id"] for result in results],
+                         [None, None])
+        self.assertEqual(results[0]["error"], "ApiError: Upload failed")
+        self.assertEqual(results[0]["throughput"], 0)
+        # no backoff after the last attempt
+        self.assertEqual(self.sleeps, [1, 2, 1, 2])
+
+    def test_quota_errors_are_not_retried(self):
+        from django_youtube.api import AccountQuotaExceeded
+
+        results = self._upload_many(
+            failures=0, error=AccountQuotaExceeded("No quota left"))
+
+        self.assertEqual([result["attempts"] for result in results], [1, 1])
+        self.assertEqual(results[0]["error"],
+                         "AccountQuotaExceeded: No quota left")
+        self.assertEqual(self.sleeps, [])
+
+    def test_every_video_gets_a_result(self):
+        from django_youtube.api import AccountQuotaExceeded, Api
+
+        def no_account(api):
+            raise AccountQuotaExceeded("No quota left")
+
+        patch(self, Api, "_worker", no_account)
+        finished = []
+        api = Api()
+        api.authenticated = True
+        results = api.upload_many(
+            [{"video_path": path, "title": "a"} for path in self.paths],
+            workers=1, callback=finished.append)
+
+        self.assertEqual([result["video_path"] for result in results],
+                         self.paths)
+        self.assertEqual([result["error"] for result in results],
+                         ["AccountQuotaExceeded: No quota left"] * 2)
+        self.assertEqual(finished, results)
+
+    def test_rate_limiter(self):
+        from django_youtube.api import RateLimiter
+
+        limiter = RateLimiter(100)
+        limiter.consume(50)
+        limiter.consume(100)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertTrue(0.4 < self.sleeps[0] <= 0.5)
+        # the time of the readers adds up
+        limiter.consume(100)
+        self.assertTrue(1.4 < self.sleeps[1] <= 1.5)
+
+
+class CreateFromEntriesTest(TestCase):
+    def test_create_from_entries(self):
+        import gdata.youtube
+        from django.contrib.auth import get_user_model
+        from django_youtube.models import Thumbnail, Video, video_created
+        from django_youtube.testing import video_entry_xml
+
+        user = get_user_model().objects.create(username="uploader")
+        entries = [gdata.youtube.YouTubeVideoEntryFromString(
+            video_entry_xml(video_id, title=video_id))
+            for video_id in ("a", "b")]
+
+        created = []
+
+        def receiver(sender, video, **kwargs):
+            created.append(video.video_id)
+
+        video_created.connect(receiver)
+        self.addCleanup(video_created.disconnect, receiver)
+        videos = Video.objects.create_from_entries(user, entries, "main")
+
+        self.assertEqual(sorted(video.video_id for video in videos),
+                         ["a", "b"])
+        self.assertEqual(sorted(created), ["a", "b"])
+        video = Video.objects.get(video_id="a")
+        self.assertEqual(video.title, "a")
+        self.assertEqual(video.account, "main")
+        self.assertTrue(video.entry_data)
+        self.assertEqual(Thumbnail.objects.get(video=video).url,
+                         "http://i.ytimg.com/vi/a/default.jpg")
+
+
+class FullTextSearchTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django_youtube import fulltext
+        from django_youtube.models import Video
+
+        if connection.vendor not in ("postgresql", "sqlite") or \
+                not fulltext.install():
+            self.skipTest("full-text index is not available")
+
+        user = get_user_model().objects.create(username="dave")
+        Video.objects.bulk_create([
+            Video(user=user, video_id="v1", title="Cooking pasta",
+                  keywords="food, italian"),
+            Video(user=user, video_id="v2", title="Cooking rice",
+                  description="asian food"),
+            Video(user=user, video_id="v3", title="Guitar lesson")])
+
+    def _search(self, query):
+        from django_youtube.fulltext import search
+        from django_youtube.models import Video
+
+        return sorted(search(Video.objects.all(), query).values_list(
+            "video_id", flat=True))
+
+    def test_every_term_matches(self):
+        self.assertEqual(self._search("cooking"), ["v1", "v2"])
+        self.assertEqual(self._search("cooking food italian"), ["v1"])
+        self.assertEqual(self._search("asian"), ["v2"])
+        self.assertEqual(self._search("piano"), [])
+
+    def test_index_follows_the_changes(self):
+        from django_youtube.models import Video
+
+        Video.objects.filter(video_id="v3").update(title="Cooking lesson")
+        Video.objects.filter(video_id="v1").delete()
+        self.assertEqual(self._search("cooking"), ["v2", "v3"])
+
+    def test_admin_search(self):
+        from django.contrib import admin
+        from django.test.client import RequestFactory
+        from django_youtube.models import Video
+
+        model_admin = admin.site._registry[Video]
+        request = RequestFactory().get("/admin/django_youtube/video/")
+
+        results, distinct = model_admin.get_search_results(
+            request, Video.objects.all(), "guitar")
+        self.assertEqual(list(results.values_list("video_id", flat=True)),
+                         ["v3"])
+        self.assertFalse(distinct)
+
+        # fields of the user are searched without the index
+        results, distinct = model_admin.get_search_results(
+            request, Video.objects.all(), "dave")
+        self.assertEqual(results.count(), 3)
+        # prefixes of the user fields
+        results, distinct = model_admin.get_search_results(
+            request, Video.objects.all(), "da")
+        self.assertEqual(results.count(), 3)
+
+
+class EmbedTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django_youtube.api import AccessControl
+        from django_youtube.models import Thumbnail, Video
+
+        cache.clear()
+        user = get_user_model().objects.create(username="grace")
+        Video.objects.bulk_create([
+            Video(user=user, video_id="public", title="Public"),
+            Video(user=user, video_id="private", title="Private",
+                  access_control=AccessControl.Private),
+            Video(user=user, video_id="unlisted", title="Unlisted",
+                  access_control=AccessControl.Unlisted)])
+        Thumbnail.objects.bulk_create([
+            Thumbnail(video=Video.objects.get(video_id="public"),
+                      url="http://i.ytimg.com/vi/public/default.jpg")])
+
+    def _oembed(self, url, **params):
+        from django.core.urlresolvers import reverse
+
+        params["url"] = url
+        return self.client.get(reverse("youtube_oembed"), params)
+
+    def test_embed(self):
+        from django.core.urlresolvers import reverse
+
+        response = self.client.get(reverse(
+            "youtube_embed", kwargs={"video_id": "public",
+                                     "preset": "small"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b'width="320"' in response.content)
+        self.assertTrue("public" in response["Cache-Control"])
+
+        response = self.client.get(reverse(
+            "youtube_embed", kwargs={"video_id": "public",
+                                     "preset": "huge"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_oembed(self):
+        import json
+
+        response = self._oembed("http://www.youtube.com/watch?v=public",
+                                maxwidth=700)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual((data["type"], data["title"], data["width"]),
+                         ("video", "Public", 640))
+
+        self.assertEqual(data["thumbnail_url"],
+                         "http://i.ytimg.com/vi/public/default.jpg")
+
+        self.assertEqual(self._oembed("http://example.com/").status_code,
+                         404)
+        self.assertEqual(self._oembed("http://youtu.be/public",
+                                      format="xml").status_code, 501)
+
+    def test_oembed_thumbnail_url_is_absolute(self):
+        import json
+        from django_youtube.models import Thumbnail
+
+        thumbnail = Thumbnail.objects.get()
+        thumbnail.local_file = "thumbnails/ab/%s.png" % ("ab" * 32)
+        thumbnail.save()
+
+        data = json.loads(self._oembed(
+            "http://youtu.be/public").content.decode("utf-8"))
+        self.assertEqual(data["thumbnail_url"],
+                         "http://testserver" + thumbnail.get_absolute_url())
+
+    def test_non_public_videos_are_not_embedded(self):
+        from django.core.urlresolvers import reverse
+
+        for video_id in ("private", "unlisted", "missing"):
+            response = self.client.get(reverse(
+                "youtube_embed", kwargs={"video_id": video_id,
+                                         "preset": "small"}))
+            self.assertEqual(response.status_code, 404)
+            response = self._oembed("http://youtu.be/%s" % video_id)
+            self.assertEqual(response.status_code, 404)
+
+    def test_thumbnail_changes_invalidate_the_snippets(self):
+        from django_youtube.embed import get_embed
+        from django_youtube.models import Thumbnail, Video
+
+        self.assertTrue("thumbnail_url" in get_embed("public", "small"))
+        Thumbnail.objects.get().delete()
+        self.assertFalse("thumbnail_url" in get_embed("public", "small"))
+
+        Thumbnail.objects.create(
+            video=Video.objects.get(video_id="public"),
+            url="http://i.ytimg.com/vi/public/hqdefault.jpg")
+        self.assertTrue("thumbnail_url" in get_embed("public", "small"))
+
+
+class RefreshTest(TestCase):
+    def setUp(self):
+        import datetime
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django.utils import timezone
+        from django_youtube import refresh
+        from django_youtube.models import Video
+
+        cache.clear()
+        user = get_user_model().objects.create(username="heidi")
+        now = timezone.now()
+        Video.objects.bulk_create([
+            Video(user=user, video_id="fresh", synced_at=now),
+            Video(user=user, video_id="stale",
+                  synced_at=now - datetime.timedelta(hours=2)),
+            Video(user=user, video_id="never")])
+
+        # record the tasks instead of running them in the background
+        self.submitted = []
+        refresh.queue.submit = lambda function, *args, **kwargs: \
+            self.submitted.append(args) or True
+        self.addCleanup(delattr, refresh.queue, "submit")
+
+    def test_is_stale(self):
+        from django_youtube.models import Video
+
+        videos = dict((video.video_id, video)
+                      for video in Video.objects.all())
+        self.assertFalse(videos["fresh"].is_stale())
+        self.assertTrue(videos["stale"].is_stale())
+        self.assertTrue(videos["never"].is_stale())
+        self.assertFalse(videos["stale"].is_stale(max_age=3 * 60 * 60))
+        with self.settings(YOUTUBE_METADATA_MAX_AGE=0):
+            self.assertTrue(videos["fresh"].is_stale())
+
+    def test_revalidate_queues_stale_videos_once(self):
+        from django_youtube.models import Video
+
+        for video in Video.objects.order_by("id"):
+            self.assertTrue(video.revalidate() is video)
+        stale = Video.objects.get(video_id="stale")
+        stale.revalidate()
+
+        self.assertEqual(self.submitted, [
+            (Video.objects.get(video_id="stale").pk,),
+            (Video.objects.get(video_id="never").pk,)])
+
+    def test_pending_edits_are_not_refreshed(self):
+        from django_youtube.models import Video
+        from django_youtube.testing import StubApi
+
+        api = StubApi().install(self)
+        Video.objects.filter(video_id="stale").update(
+            title="edited", sync_pending=True)
+        video = Video.objects.get(video_id="stale")
+
+        video.revalidate()
+        video.refresh_from_youtube()
+
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(api.fetches, [])
+        self.assertEqual(Video.objects.get(video_id="stale").title, "edited")
+
+    def test_lock_is_released_when_the_refresh_fails(self):
+        from django_youtube import refresh
+        from django_youtube.api import ApiError
+        from django_youtube.models import Video
+
+        video = Video.objects.get(video_id="stale")
+
+        def fail(self):
+            raise ApiError("Youtube is down")
+
+        self.assertTrue(refresh.queue.queue_video(video))
+        self.assertFalse(refresh.queue.queue_video(video))
+
+        original = Video.refresh_from_youtube
+        Video.refresh_from_youtube = fail
+        try:
+            self.assertRaises(ApiError, refresh.refresh, video.pk)
+        finally:
+            Video.refresh_from_youtube = original
+        self.assertTrue(refresh.queue.queue_video(video))
+
+    def test_lock_is_released_when_the_queue_is_full(self):
+        from django_youtube import refresh
+        from django_youtube.models import Video
+
+        video = Video.objects.get(video_id="stale")
+        refresh.queue.submit = lambda function, *args, **kwargs: False
+        self.assertFalse(refresh.queue.queue_video(video))
+
+        refresh.queue.submit = lambda function, *args, **kwargs: True
+        self.assertTrue(refresh.queue.queue_video(video))
+
+
+class WorkerPoolTest(TestCase):
+    def test_api_errors_do_not_stop_the_workers(self):
+        from django_youtube.api import ApiError
+        from django_youtube.workers import WorkerPool
+
+        done = []
+
+        def fail():
+            raise ApiError("Youtube is down")
+
+        pool = WorkerPool("test-workers", workers=1)
+        pool.submit(fail)
+        pool.submit(done.append, 1)
+        pool.join()
+        self.assertEqual(done, [1])
+
+
+@override_settings(YOUTUBE_DEVELOPER_KEY="key")
+class EntrySnapshotTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django_youtube.models import Video
+        from django_youtube.testing import StubApi
+
+        user = get_user_model().objects.create(username="kim")
+        Video.objects.bulk_create([Video(user=user, video_id="snap")])
+        self.video = Video.objects.get(video_id="snap")
+
+        # count the fetches instead of sending them to Youtube
+        self.api = StubApi().install(self)
+
+    def test_snapshot_round_trip(self):
+        import gdata.youtube.service
+        from django_youtube.models import _decode_entry, _encode_entry
+        from django_youtube.testing import video_entry_xml
+
+        entry = gdata.youtube.YouTubeVideoEntryFromString(video_entry_xml(
+            "snap", "processing", title="snapshot", keywords="a, b"))
+        decoded = _decode_entry(_encode_entry(entry))
+
+        self.assertEqual(decoded.id.text, entry.id.text)
+        self.assertEqual(decoded.media.title.text, entry.media.title.text)
+        self.assertEqual(decoded.media.keywords.text, "a, b")
+        self.assertEqual(gdata.youtube.service.YouTubeService()
+                         .CheckUploadStatus(decoded)[0], "processing")
+
+    def test_snapshot_is_used_until_max_age(self):
+        import datetime
+        from django.utils import timezone
+        from django_youtube.models import Video
+
+        self.assertEqual(self.video.entry().media.title.text, "fetch 1")
+        # stored on the row
+        video = Video.objects.get(id=self.video.id)
+        self.assertEqual(video.entry().media.title.text, "fetch 1")
+        self.assertEqual(self.api.fetches, ["snap"])
+
+        Video.objects.filter(id=video.id).update(
+            entry_fetched_at=timezone.now() - datetime.timedelta(minutes=2))
+        video = Video.objects.get(id=self.video.id)
+        self.assertEqual(video.entry().media.title.text, "fetch 1")
+        self.assertEqual(video.entry(max_age=60).media.title.text, "fetch 2")
+        with self.settings(YOUTUBE_ENTRY_MAX_AGE=0):
+            self.assertEqual(video.entry().media.title.text, "fetch 3")
+
+    def test_refresh(self):
+        from django_youtube.models import Video
+
+        self.video.entry()
+        self.assertEqual(self.video.entry(refresh=True).media.title.text,
+                         "fetch 2")
+        self.assertEqual(Video.objects.get(id=self.video.id).entry()
+                         .media.title.text, "fetch 2")
+
+    def test_push_refreshes_the_snapshot(self):
+        from django_youtube.models import Video
+
+        self.video.entry()
+        self.video.title = "pushed"
+        self.video.push_to_youtube()
+
+        self.assertEqual(self.api.updates, ["snap"])
+        self.assertEqual(Video.objects.get(id=self.video.id).entry()
+                         .media.title.text, "pushed")
+        self.assertEqual(self.api.fetches, ["snap"])
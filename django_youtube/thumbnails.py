@@ -0,0 +1,214 @@
+"""
+Mirroring of the video thumbnails
+
+Thumbnails are downloaded in background threads after the video is created,
+stored by their SHA-256 in the default storage (local or an object store)
+and resized to WebP variants. `Thumbnail.get_absolute_url()` points at the
+local copy when it's available.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from django_youtube.workers import WorkerPool, on_commit
+
+# directory of the mirrored thumbnails in the storage
+DIRECTORY = "thumbnails"
+
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+# leading bytes of the image formats, used if the server sends no known type
+SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG", ".png"),
+    (b"GIF8", ".gif"),
+)
+
+
+def widths():
+    """
+    Widths of the resized WebP variants
+    """
+    try:
+        return settings.YOUTUBE_THUMBNAIL_WIDTHS
+    except AttributeError:
+        return (120, 320)
+
+
+def storage_name(content_hash, width=None, extension=".jpg"):
+    """
+    Returns the name of the original (width is None) or a variant in the
+    storage, i.e. thumbnails/ab/abcdef...jpg, thumbnails/ab/abcdef..._320.webp
+
+    Params:
+        extension: of the original, one of `CONTENT_TYPES`
+    """
+    if width is None:
+        filename = "%s%s" % (content_hash, extension)
+    else:
+        filename = "%s_%d.webp" % (content_hash, width)
+    return os.path.join(DIRECTORY, content_hash[:2], filename)
+
+
+def extension_for(content_type, data):
+    """
+    Returns the file extension of the image by its content type,
+    by its leading bytes if the type is missing or unknown
+    """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    for extension, known_type in CONTENT_TYPES.items():
+        if known_type == content_type:
+            return extension
+
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    # Youtube serves jpeg thumbnails
+    return ".jpg"
+
+
+def _download(url):
+    """
+    Returns:
+        tuple of the bytes and the content type of the response
+    """
+    try:
+        from urllib2 import urlopen
+    except ImportError:
+        from urllib.request import urlopen
+
+    try:
+        timeout = settings.YOUTUBE_THUMBNAIL_TIMEOUT
+    except AttributeError:
+        timeout = 10
+
+    response = urlopen(url, timeout=timeout)
+    try:
+        return response.read(), response.info().get("Content-Type")
+    finally:
+        response.close()
+
+
+def _variants(data, sizes=None):
+    """
+    Yields (width, webp bytes) of the resized variants
+    Requires Pillow with WebP support, yields nothing otherwise
+
+    Params:
+        sizes: optional, the widths to resize to, `widths()` by default
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+
+    from io import BytesIO
+
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except IOError:
+        return
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    for width in (widths() if sizes is None else sizes):
+        height = max(1, int(round(image.size[1] * width / float(image.size[0]))))
+        resized = image.resize((width, height), Image.LANCZOS
+                               if hasattr(Image, "LANCZOS") else Image.ANTIALIAS)
+        output = BytesIO()
+        try:
+            resized.save(output, "WEBP", quality=80)
+        except (IOError, KeyError):
+            # Pillow without WebP support
+            return
+        yield width, output.getvalue()
+
+
+def mirror(url):
+    """
+    Downloads the thumbnail, stores it with its variants and points the
+    thumbnails with this url at the local copy
+    Missing variants of an image stored before are created too, i.e. after
+    `YOUTUBE_THUMBNAIL_WIDTHS` is changed
+
+    Returns:
+        storage name of the original
+    """
+    from django_youtube import embed
+    from django_youtube.models import Thumbnail, Video
+
+    data, content_type = _download(url)
+    content_hash = hashlib.sha256(data).hexdigest()
+    name = storage_name(content_hash,
+                        extension=extension_for(content_type, data))
+
+    # content addressed, same image is stored once
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    missing = [width for width in widths() if not default_storage.exists(
+        storage_name(content_hash, width))]
+    if missing:
+        for width, variant in _variants(data, missing):
+            default_storage.save(storage_name(content_hash, width),
+                                 ContentFile(variant))
+
+    # update() sends no signals, the embed snippets have the old urls
+    Thumbnail.objects.filter(url=url).update(local_file=name)
+    for video_id in Video.objects.filter(thumbnail__url=url).values_list(
+            "video_id", flat=True).distinct():
+        embed.invalidate(video_id)
+    return name
+
+
+class ThumbnailMirror(WorkerPool):
+    """
+    Pool of threads mirroring the thumbnails
+    The queue is bounded, thumbnails are skipped when it's full and can be
+    mirrored later by `manage.py youtube_mirror_thumbnails`
+    """
+
+    def __init__(self, workers=None, queue_size=1000):
+        if workers is None:
+            try:
+                workers = settings.YOUTUBE_THUMBNAIL_WORKERS
+            except AttributeError:
+                workers = 2
+        super(ThumbnailMirror, self).__init__("youtube-thumbnails", workers,
+                                              queue_size)
+
+    def mirror(self, urls, block=False):
+        """
+        Queues the thumbnail urls
+        """
+        for url in urls:
+            self.submit(mirror, url, block=block)
+
+pool = ThumbnailMirror()
+
+
+def mirror_async(urls):
+    """
+    Mirrors the thumbnails in the background if `YOUTUBE_MIRROR_THUMBNAILS`
+    is set, after the running transaction is committed
+    """
+    try:
+        enabled = settings.YOUTUBE_MIRROR_THUMBNAILS
+    except AttributeError:
+        enabled = False
+
+    urls = list(urls)
+    if not enabled or not urls:
+        return
+
+    on_commit(lambda: pool.mirror(urls))
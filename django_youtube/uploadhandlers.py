@@ -0,0 +1,75 @@
+"""
+File upload handlers used by the direct upload view
+"""
+import hashlib
+import time
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+from django_youtube.events import publish_progress
+
+
+class ProgressUploadHandler(FileUploadHandler):
+    """
+    Publishes the received bytes of the request while the browser uploads
+    the file, the `progress_id` query parameter identifies the upload
+    """
+
+    # seconds between two progress updates
+    min_interval = 0.5
+
+    def __init__(self, request=None):
+        super(ProgressUploadHandler, self).__init__(request)
+        self.progress_id = None
+        self.total = None
+        self.received = 0
+        self.published_at = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        self.progress_id = self.request.GET.get("progress_id")
+        self.total = content_length
+        if self.progress_id:
+            publish_progress(self.progress_id, "receiving", 0, self.total)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.progress_id:
+            self.received += len(raw_data)
+            now = time.time()
+            if now - self.published_at >= self.min_interval:
+                self.published_at = now
+                publish_progress(self.progress_id, "receiving",
+                                 self.received, self.total)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.progress_id:
+            publish_progress(self.progress_id, "receiving", self.received,
+                             self.total)
+        return None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Calculates the SHA-256 hash of the uploaded files while they're streamed
+    to the next handler, so the file is not read again
+
+    The hex digests are kept in `digests`, keyed by the field name
+    """
+
+    def __init__(self, request=None):
+        super(HashingUploadHandler, self).__init__(request)
+        self.digests = {}
+        self.hash = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super(HashingUploadHandler, self).new_file(field_name, *args, **kwargs)
+        self.hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self.hash.hexdigest()
+        return None
@@ -15,6 +15,7 @@ urlpatterns = patterns('django_youtube.views',
 
     # page that youtube redirects after upload
     url(r'^upload/return/?$', 'upload_return', name="youtube_upload_return"),
+    url(r'^upload/return/(?P<signed_account>[\w.:-]+)/$', 'upload_return', name="youtube_upload_return_account"),
 
     # upload page with a form
     url(r'^direct-upload/?$', 'direct_upload', name="youtube_direct_upload"),
@@ -25,4 +26,30 @@ urlpatterns = patterns('django_youtube.views',
     # check video availability, returns json response
     url(r'^check-video-availability/(?P<video_id>[\w.@+-]+)$/?$', 'check_video_availability', name="youtube_check_video_availability"),
     url(r'^video/(?P<video_id>[\w.@+-]+)/$', 'video', name="youtube_video"),
+
+    # server-sent events of the processing state of the video
+    url(r'^video/(?P<video_id>[\w.@+-]+)/events/$', 'video_events', name="youtube_video_events"),
+
+    # long-poll version of the events, returns json response
+    url(r'^video/(?P<video_id>[\w.@+-]+)/state/$', 'video_state', name="youtube_video_state"),
+
+    # server-sent events of the progress of a direct upload
+    url(r'^direct-upload/progress/(?P<progress_id>[\w-]+)/$', 'upload_progress_events', name="youtube_upload_progress_events"),
+
+    # precomputed embed player of a video in a size preset
+    url(r'^embed/(?P<video_id>[\w.@+-]+)/(?P<preset>\w+)/$', 'embed', name="youtube_embed"),
+
+    # oembed endpoint, returns json response
+    url(r'^oembed/?$', 'oembed', name="youtube_oembed"),
+
+    # mirrored thumbnails and their resized variants
+    url(r'^thumbnails/(?P<content_hash>[0-9a-f]{64})/$', 'thumbnail', name="youtube_thumbnail"),
+    url(r'^thumbnails/(?P<content_hash>[0-9a-f]{64})\.(?P<extension>jpg|png|gif|webp)$', 'thumbnail', name="youtube_thumbnail_original"),
+    url(r'^thumbnails/(?P<content_hash>[0-9a-f]{64})/(?P<width>\d+)/$', 'thumbnail', name="youtube_thumbnail_variant"),
+
+    # search in the local videos, returns json response
+    url(r'^search/?$', 'search', name="youtube_search"),
+
+    # pubsubhubbub callback, youtube pushes the changed video entries
+    url(r'^push/?$', 'push_callback', name="youtube_push_callback"),
 )
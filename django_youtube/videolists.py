@@ -0,0 +1,80 @@
+"""
+Cached video lists of the users, used by the `video_list` view
+
+The list is read with one query joining the users and kept in the cache per
+username. It's dropped when a video of the user is saved, deleted or
+`video_created` is sent: a per user version is a part of the key and it's
+increased, so a list read before the change can't be stored over it.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from django_youtube.models import Video
+
+
+def _key(username, version):
+    return "django_youtube:videos:%s:%s" % (username, version)
+
+
+def _version_key(username):
+    return "django_youtube:videos-version:%s" % username
+
+
+def _new_version():
+    # never reuses the versions of an evicted counter
+    return int(time.time() * 1000)
+
+
+def _version(username):
+    key = _version_key(username)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _timeout():
+    try:
+        return settings.YOUTUBE_VIDEO_LIST_TIMEOUT
+    except AttributeError:
+        return 10 * 60
+
+
+def user_videos(username):
+    """
+    Returns the videos of the user
+
+    Returns:
+        list of tuples (id, video_id, synced_at), None if the user doesn't
+        exist
+    """
+    key = _key(username, _version(username))
+    videos = cache.get(key)
+    if videos is None:
+        videos = list(Video.objects.filter(user__username=username)
+                      .order_by("id").values_list("id", "video_id",
+                                                  "synced_at"))
+        if not videos and not get_user_model().objects.filter(
+                username=username).exists():
+            # not cached, the user might sign up any time
+            return None
+        cache.set(key, videos, _timeout())
+    return videos
+
+
+def invalidate(user_id):
+    """
+    Drops the cached list of the user, by increasing its version
+    """
+    usernames = get_user_model().objects.filter(id=user_id).values_list(
+        "username", flat=True)
+    for username in usernames:
+        key = _version_key(username)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
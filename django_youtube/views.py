@@ -1,29 +1,79 @@
-from django.shortcuts import render_to_response
+from django.shortcuts import get_object_or_404, render_to_response
 from django.views.decorators.http import require_http_methods
 from django.template import RequestContext
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, \
+    HttpResponseForbidden, Http404, StreamingHttpResponse
 from django.utils.translation import ugettext as _
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django_youtube.api import Api, AccessControl, ApiError
+from django_youtube.api import Api, AccessControl, ApiError, \
+    video_id_from_entry
 from django_youtube.models import video_created, Video
+from django_youtube.events import FINAL_STATES, event_stream, get_state, \
+    progress_stream, publish_progress, wait_for_state
+from django_youtube.uploadhandlers import HashingUploadHandler, \
+    ProgressUploadHandler
 from django_youtube.forms import YoutubeUploadForm, YoutubeDirectUploadForm
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_cache_control
+from django.core.cache import cache
+from django.core import signing
 import logging
 import json
+import time
 
 logger = logging.getLogger(__name__)
 
+# states of the earlier uploads that can't be used instead of a new upload
+UNUSABLE_STATES = ("failed", "rejected", "deleted")
 
-def _video_params(request, video_id):
+# salt of the signed account in the url of `upload_return`
+UPLOAD_RETURN_SALT = "django_youtube.upload_return"
 
+# seconds the signed account of an upload is valid
+UPLOAD_RETURN_MAX_AGE = 24 * 60 * 60
+
+
+def _request_params(request):
+    """
+    Returns the player parameters of the request, same for all videos
+    """
     width = request.GET.get("width", "70%")
     height = request.GET.get("height", "350")
     origin = request.get_host()
 
-    return {"video_id": video_id, "origin": origin, "width": width, "height": height}
+    return {"origin": origin, "width": width, "height": height}
+
+
+def _video_params(request, video_id, request_params=None):
+    """
+    Params:
+        request_params: optional, result of `_request_params` to reuse
+    """
+    if request_params is None:
+        request_params = _request_params(request)
+    return dict(request_params, video_id=video_id)
+
+
+def _progress_callback(progress_id):
+    """
+    Returns a callback publishing the bytes sent to Youtube,
+    None if progress is not tracked
+    """
+    if not progress_id:
+        return None
+
+    published_at = [0]
+
+    def callback(sent, total):
+        now = time.time()
+        if sent == total or now - published_at[0] >= 0.5:
+            published_at[0] = now
+            publish_progress(progress_id, "sending", sent, total)
+
+    return callback
 
 
 def check_video_availability(request, video_id):
@@ -34,10 +84,15 @@ def check_video_availability(request, video_id):
     Returns:
         json response
     """
+    # Use the state pushed by Youtube if it will not change anymore
+    state = get_state(video_id)
+    if state is not None and state["upload_state"] in FINAL_STATES:
+        data = {'success': state["upload_state"] == "available"}
+        return HttpResponse(json.dumps(data), content_type="application/json")
+
     # Check video availability
     # Available states are: processing
-    api = Api()
-    api.authenticate()
+    api = Video.objects.api_for(video_id)
     availability = api.check_upload_status(video_id)
 
     if availability is not True:
@@ -48,6 +103,273 @@ def check_video_availability(request, video_id):
     return HttpResponse(json.dumps(data), content_type="application/json")
 
 
+def video_events(request, video_id):
+    """
+    Server-sent events stream of the processing state of the video
+    Browsers receive the state when it's pushed by Youtube instead of polling
+    `check_video_availability`
+
+    Returns:
+        text/event-stream response, each event is a json object
+        i.e. {"upload_state": "available", "detailed_message": "", "version": 1}
+    """
+    initial_state = None
+    try:
+        video = Video.objects.get(video_id=video_id)
+    except Video.DoesNotExist:
+        raise Http404
+
+    if video.upload_state:
+        initial_state = {"upload_state": video.upload_state,
+                         "detailed_message": video.upload_state_message or "",
+                         "version": 0}
+
+    response = StreamingHttpResponse(event_stream(video_id, initial_state),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # disable proxy buffering on nginx
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def video_state(request, video_id):
+    """
+    Long-poll alternative of `video_events`
+    Holds the request until a state newer than the `version` parameter is
+    available or the timeout passes
+
+    Returns:
+        json response i.e. {"upload_state": "processing",
+                            "detailed_message": "", "version": 1357900000.0}
+        or {"upload_state": null} if the state is still unknown
+    """
+    # unknown videos don't start a poller
+    get_object_or_404(Video, video_id=video_id)
+
+    try:
+        version = float(request.GET["version"])
+    except (KeyError, ValueError):
+        version = None
+
+    state = wait_for_state(video_id, version)
+    if state is None:
+        state = {"upload_state": None, "detailed_message": "",
+                 "version": None}
+
+    response = HttpResponse(json.dumps(state), content_type="application/json")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def upload_progress_events(request, progress_id):
+    """
+    Server-sent events stream of a direct upload, started with the same
+    `progress_id` parameter
+
+    Returns:
+        text/event-stream response, each event is a json object
+        i.e. {"state": "receiving", "received": 1024, "total": 4096, "version": 1}
+        the last event is either {"state": "done", "video_id": "..."}
+        or {"state": "failed"}
+    """
+    response = StreamingHttpResponse(progress_stream(progress_id),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _cache_forever(response):
+    """
+    Sets long-lived public cache headers, for the browsers and the CDNs
+    """
+    try:
+        max_age = settings.YOUTUBE_EMBED_MAX_AGE
+    except AttributeError:
+        max_age = 24 * 60 * 60
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def embed(request, video_id, preset):
+    """
+    Embed player of the video in a size preset, i.e. small, medium, large
+    The markup is precomputed, the response can be cached by CDNs
+    """
+    from django_youtube.embed import get_embed
+
+    data = get_embed(video_id, preset)
+    if data is None:
+        raise Http404
+
+    return _cache_forever(HttpResponse(data["html"]))
+
+
+def oembed(request):
+    """
+    oEmbed endpoint of the videos
+    See: http://oembed.com/
+
+    params:
+        `url`: url of a video page or a youtube url of a video
+        (optional) `maxwidth`, `maxheight`: the largest fitting preset is used
+        (optional) `format`: only json is supported
+
+    return:
+        json response
+    """
+    from django_youtube.embed import get_embed, preset_for_size, \
+        video_id_from_url
+
+    if request.GET.get("format", "json") != "json":
+        return HttpResponse(status=501)
+
+    video_id = video_id_from_url(request.GET.get("url"))
+    if video_id is None:
+        raise Http404
+
+    try:
+        maxwidth = int(request.GET["maxwidth"])
+    except (KeyError, ValueError):
+        maxwidth = None
+    try:
+        maxheight = int(request.GET["maxheight"])
+    except (KeyError, ValueError):
+        maxheight = None
+
+    data = get_embed(video_id, preset_for_size(maxwidth, maxheight))
+    if data is None:
+        raise Http404
+
+    if "thumbnail_url" in data:
+        # mirrored thumbnails have local urls, consumers need absolute ones
+        data = dict(data, thumbnail_url=request.build_absolute_uri(
+            data["thumbnail_url"]))
+
+    return _cache_forever(HttpResponse(json.dumps(data),
+                                       content_type="application/json"))
+
+
+def thumbnail(request, content_hash, width=None, extension="jpg"):
+    """
+    Serves a mirrored thumbnail or its WebP variant in the given width
+    Content addressed, so the response never changes and is cached for a year
+    The original is served with the content type of its extension, urls
+    without an extension are the jpeg originals
+    """
+    from django_youtube.thumbnails import CONTENT_TYPES, storage_name, widths
+    from django.core.files.storage import default_storage
+    import os
+
+    if width is not None:
+        width = int(width)
+        if width not in widths():
+            raise Http404
+
+    name = storage_name(content_hash, width, "." + extension)
+    if not default_storage.exists(name):
+        raise Http404
+
+    if request.META.get("HTTP_IF_NONE_MATCH") == '"%s"' % content_hash:
+        response = HttpResponse(status=304)
+    else:
+        image = default_storage.open(name)
+        try:
+            response = HttpResponse(image.read(), content_type=CONTENT_TYPES[
+                os.path.splitext(name)[1]])
+        finally:
+            image.close()
+
+    response["ETag"] = '"%s"' % content_hash
+    patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60)
+    return response
+
+
+def search(request):
+    """
+    Searches the public videos in the local catalog, and the own videos of
+    the logged in user
+
+    params:
+        `q`: search terms, videos containing all of them are returned
+        (optional) `keyword`: only the videos with exactly this keyword
+        (optional) `page`, `per_page`: default is 1 and 20
+
+    return:
+        json response i.e. {"query": "cats", "total": 1, "page": 1,
+            "results": [{"video_id": "abc", "title": "Cats", "score": 3, ...}],
+            "facets": [{"keyword": "animals", "count": 1}]}
+    """
+    from django_youtube.search import search as search_videos
+
+    query = request.GET.get("q", "")
+    keyword = request.GET.get("keyword") or None
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+        per_page = min(max(int(request.GET.get("per_page", 20)), 1), 100)
+    except ValueError:
+        page, per_page = 1, 20
+
+    found = search_videos(query, keyword, (page - 1) * per_page, per_page,
+                          user=request.user)
+
+    data = {
+        "query": query,
+        "total": found["total"],
+        "page": page,
+        "results": [{
+            "video_id": video.video_id,
+            "title": video.title,
+            "description": video.description,
+            "keywords": video.keywords,
+            "youtube_url": video.youtube_url,
+            "url": reverse("django_youtube.views.video",
+                           kwargs={"video_id": video.video_id}),
+            "score": score,
+        } for video, score in found["results"]],
+        "facets": [{"keyword": name, "count": count}
+                   for name, count in found["facets"]],
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def push_callback(request):
+    """
+    PubSubHubbub callback
+    GET requests are subscription verifications of the hub,
+    POST requests are the notifications of the changed video entries
+    """
+    from django_youtube.push import verify_signature, process_notification
+
+    if request.method == "GET":
+        try:
+            verify_token = settings.YOUTUBE_PUSH_VERIFY_TOKEN
+        except AttributeError:
+            verify_token = None
+
+        if verify_token and request.GET.get("hub.verify_token") != verify_token:
+            raise Http404
+
+        return HttpResponse(request.GET.get("hub.challenge", ""),
+                            content_type="text/plain")
+
+    body = request.body
+    if not verify_signature(body, request.META.get("HTTP_X_HUB_SIGNATURE")):
+        return HttpResponseForbidden()
+
+    try:
+        process_notification(body)
+    except Exception:
+        import sys
+        logger.error("Push notification could not be processed: %s - %s" % (
+            sys.exc_info()[0], sys.exc_info()[1]))
+
+    # the hub must not redeliver malformed notifications, always accept
+    return HttpResponse(status=204)
+
+
 def video(request, video_id):
     """
     Displays a video in an embed player
@@ -55,13 +377,12 @@ def video(request, video_id):
 
     # Check video availability
     # Available states are: processing
-    api = Api()
-    api.authenticate()
+    api = Video.objects.api_for(video_id)
     availability = api.check_upload_status(video_id)
 
     if availability is not True:
         # Video is not available
-        video = Video.objects.filter(video_id=video_id).get()
+        video = Video.objects.filter(video_id=video_id).get().revalidate()
 
         state = availability["upload_state"]
 
@@ -101,14 +422,20 @@ def video_list(request, username=None):
         from django.http import Http404
         raise Http404
 
-    from django.contrib.auth.models import User
-    user = User.objects.get(username=username) if username else request.user
+    from django_youtube.videolists import user_videos
+    if username is None:
+        username = request.user.username
+
+    videos = user_videos(username)
+    if videos is None:
+        raise Http404
 
     # loop through the videos of the user
-    videos = Video.objects.filter(user=user).all()
+    request_params = _request_params(request)
     video_params = []
-    for video in videos:
-        video_params.append(_video_params(request, video.video_id))
+    for pk, video_id, synced_at in videos:
+        Video(id=pk, video_id=video_id, synced_at=synced_at).revalidate()
+        video_params.append(_video_params(request, video_id, request_params))
 
     return render_to_response(
         "django_youtube/videos.html",
@@ -117,6 +444,132 @@ def video_list(request, username=None):
     )
 
 
+def _existing_video_id(user, content_hash):
+    """
+    Returns the id of an earlier upload of the same file by the user,
+    None if there is none or Youtube failed, rejected or deleted it
+    """
+    video_ids = Video.objects.filter(
+        user=user, content_hash=content_hash
+    ).exclude(upload_state__in=UNUSABLE_STATES).values_list("video_id",
+                                                            flat=True)
+    for video_id in video_ids:
+        # the pushed state is newer than the row
+        state = get_state(video_id)
+        if state is None or state["upload_state"] not in UNUSABLE_STATES:
+            return video_id
+    return None
+
+
+def _upload_lock_timeout():
+    try:
+        return settings.YOUTUBE_DIRECT_UPLOAD_LOCK_TIMEOUT
+    except AttributeError:
+        return 60 * 60
+
+
+class UploadInProgress(BaseException):
+    """
+    Raised when the same file is being uploaded by another request
+
+    Params:
+        progress_id: progress of the other upload, None if it has none
+    """
+
+    def __init__(self, progress_id=None):
+        BaseException.__init__(self, _("The same file is being uploaded"))
+        self.progress_id = progress_id
+
+
+def _deduplicated_upload(request, form, progress_id, content_hash):
+    """
+    Uploads the file unless the user uploaded the same file before
+    A cache lock, held for the whole upload, lets only one request in any
+    process upload the same file, i.e. on double submits. The others don't
+    wait for it
+
+    Returns:
+        video_id
+
+    Raises:
+        UploadInProgress: if another request is uploading the same file
+    """
+    video_id = _existing_video_id(request.user, content_hash)
+    if video_id is not None:
+        return video_id
+
+    lock_key = "django_youtube:direct-upload:%s:%s" % (request.user.pk,
+                                                       content_hash)
+    # the other requests can follow the progress of this one
+    if not cache.add(lock_key, progress_id or "", _upload_lock_timeout()):
+        raise UploadInProgress(cache.get(lock_key) or None)
+
+    try:
+        return _direct_upload(request, form, progress_id, content_hash)
+    finally:
+        cache.delete(lock_key)
+
+
+def _upload_in_progress_response(error, return_only_data):
+    """
+    409 response of a request uploading the same file as another one,
+    points to the progress of the other upload if it has one
+    """
+    data = {"error": 409, "progress_id": error.progress_id,
+            "progress_url": None}
+    if error.progress_id:
+        data["progress_url"] = reverse("youtube_upload_progress_events",
+                                       kwargs={"progress_id": error.progress_id})
+
+    if return_only_data:
+        return HttpResponse(json.dumps(data), content_type="application/json",
+                            status=409)
+    return HttpResponse(error.args[0], status=409)
+
+
+def _direct_upload(request, form, progress_id=None, content_hash=None):
+    """
+    Saves the file on our server, sends it to youtube and creates the video
+
+    Returns:
+        video_id
+    """
+    uploaded_video = form.save()
+
+    # send this file to youtube
+    try:
+        api = Api()
+        api.authenticate()
+        video_entry = api.upload_direct(
+            uploaded_video.file_on_server.path,
+            "Uploaded video from zuqqa",
+            progress_callback=_progress_callback(progress_id))
+    finally:
+        # the file is not needed anymore, even if the upload failed
+        uploaded_video.delete()
+
+    # get data from video entry
+    swf_url = video_entry.GetSwfUrl()
+    youtube_url = video_entry.id.text
+    video_id = video_id_from_entry(video_entry)
+
+    # save video_id to video instance
+    video = Video()
+    video.user = request.user
+    video.video_id = video_id
+    video.title = 'tmp video'
+    video.youtube_url = youtube_url
+    video.swf_url = swf_url
+    video.content_hash = content_hash
+    video.account = api.account
+    video.save()
+
+    # send a signal
+    video_created.send(sender=video, video=video)
+
+    return video_id
+
+
 @csrf_exempt
 @login_required
 def direct_upload(request):
@@ -127,52 +580,48 @@ def direct_upload(request):
 
     param:
         (optional) `only_data`: if set, a json response is returns i.e. {'video_id':'124weg'}
+        (optional) `progress_id`: if set, progress of the upload is published,
+            see `upload_progress_events`
 
     return:
         if `only_data` set, a json object.
         otherwise redirects to the video display page
     """
+    progress_id = request.GET.get("progress_id")
+    return_only_data = request.GET.get('only_data')
+
     if request.method == "POST":
+        # must be added before the files are accessed
+        hashing_handler = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hashing_handler)
+        if progress_id:
+            request.upload_handlers.insert(0, ProgressUploadHandler(request))
+
         try:
             form = YoutubeDirectUploadForm(request.POST, request.FILES)
             # upload the file to our server
             if form.is_valid():
-                uploaded_video = form.save()
-
-                # send this file to youtube
-                api = Api()
-                api.authenticate()
-                video_entry = api.upload_direct(uploaded_video.file_on_server.path, "Uploaded video from zuqqa")
-
-                # get data from video entry
-                swf_url = video_entry.GetSwfUrl()
-                youtube_url = video_entry.id.text
-
-                # getting video_id is tricky, I can only reach the url which
-                # contains the video_id.
-                # so the only option is to parse the id element
-                # https://groups.google.com/forum/?fromgroups=#!topic/youtube-api-gdata/RRl_h4zuKDQ
-                url_parts = youtube_url.split("/")
-                url_parts.reverse()
-                video_id = url_parts[0]
-
-                # save video_id to video instance
-                video = Video()
-                video.user = request.user
-                video.video_id = video_id
-                video.title = 'tmp video'
-                video.youtube_url = youtube_url
-                video.swf_url = swf_url
-                video.save()
-
-                # send a signal
-                video_created.send(sender=video, video=video)
-
-                # delete the uploaded video instance
-                uploaded_video.delete()
+                content_hash = hashing_handler.digests.get("file_on_server")
+
+                if content_hash:
+                    # same file might be uploading right now,
+                    # i.e. double submit
+                    try:
+                        video_id = _deduplicated_upload(
+                            request, form, progress_id, content_hash)
+                    except UploadInProgress as e:
+                        if progress_id:
+                            publish_progress(progress_id, "failed",
+                                             duplicate_of=e.progress_id)
+                        return _upload_in_progress_response(
+                            e, return_only_data)
+                else:
+                    video_id = _direct_upload(request, form, progress_id)
+
+                if progress_id:
+                    publish_progress(progress_id, "done", video_id=video_id)
 
                 # return the response
-                return_only_data = request.GET.get('only_data')
                 if return_only_data:
                     return HttpResponse(json.dumps({"video_id": video_id}), content_type="application/json")
                 else:
@@ -188,6 +637,8 @@ def direct_upload(request):
             import sys
             logger.error("Unexpected error: %s - %s" % (sys.exc_info()[
                 0], sys.exc_info()[1]))
+            if progress_id:
+                publish_progress(progress_id, "failed")
             # @todo: proper error management
             return HttpResponse("error happened")
 
@@ -240,7 +691,17 @@ def upload(request):
     form = YoutubeUploadForm(initial={"token": data["youtube_token"]})
 
     protocol = 'https' if request.is_secure() else 'http'
-    next_url = '%s://%s%s/' % (protocol, request.get_host(), reverse("django_youtube.views.upload_return"))
+    if api.account is None:
+        next_url = '%s://%s%s/' % (protocol, request.get_host(), reverse("django_youtube.views.upload_return"))
+    else:
+        # the video will be owned by the account of the token, the signed
+        # name comes back in the url, it works with many uploads at once
+        signed_account = signing.dumps(
+            {"account": api.account, "user": request.user.pk},
+            salt=UPLOAD_RETURN_SALT)
+        next_url = '%s://%s%s' % (protocol, request.get_host(), reverse(
+            "youtube_upload_return_account",
+            kwargs={"signed_account": signed_account}))
     return render_to_response(
         "django_youtube/upload.html",
         {"form": form, "post_url": data["post_url"], "next_url": next_url},
@@ -249,7 +710,7 @@ def upload(request):
 
 
 @login_required
-def upload_return(request):
+def upload_return(request, signed_account=None):
     """
     The upload result page
     Youtube will redirect to this page after upload is finished
@@ -258,10 +719,23 @@ def upload_return(request):
     Params:
         status: status of the upload (200 for success)
         id: id number of the video
+        signed_account: account of the upload signed by `upload` view,
+                        None without `YOUTUBE_ACCOUNTS` setting
     """
     status = request.GET.get("status")
     video_id = request.GET.get("id")
 
+    account = None
+    if signed_account is not None:
+        try:
+            data = signing.loads(signed_account, salt=UPLOAD_RETURN_SALT,
+                                 max_age=UPLOAD_RETURN_MAX_AGE)
+        except signing.BadSignature:
+            return HttpResponseForbidden()
+        if data["user"] != request.user.pk:
+            return HttpResponseForbidden()
+        account = data["account"]
+
     if status == "200" and video_id:
         # upload is successful
 
@@ -269,6 +743,7 @@ def upload_return(request):
         video = Video()
         video.user = request.user
         video.video_id = video_id
+        video.account = account
         video.save()
 
         # send a signal
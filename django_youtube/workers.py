@@ -0,0 +1,98 @@
+"""
+Pools of background threads used for the work off the request path
+"""
+import logging
+import sys
+import threading
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from django_youtube.api import API_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of daemon threads, started on the first task
+    Tasks are dropped with a warning when the queue is full, unless
+    submitted with `block`
+
+    Params:
+        name: prefix of the thread names
+        workers: number of threads
+        queue_size: max. number of waiting tasks
+    """
+
+    def __init__(self, name, workers=2, queue_size=1000):
+        self.name = name
+        self.workers = workers
+        self.queue = Queue(queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name="%s-%d" % (self.name, i))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        from django.db import connection
+
+        while True:
+            function, args = self.queue.get()
+            try:
+                function(*args)
+            except API_ERRORS:
+                logger.error("%s task %s%r failed: %s - %s" % (
+                    self.name, function.__name__, args, sys.exc_info()[0],
+                    sys.exc_info()[1]))
+            finally:
+                # threads don't close their connections like requests do
+                connection.close()
+                self.queue.task_done()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues the call of the function, returns immediately unless `block`
+        is set and the queue is full
+
+        Returns:
+            False if the task is dropped
+        """
+        self._start()
+        try:
+            self.queue.put((function, args), kwargs.get("block", False))
+            return True
+        except Full:
+            logger.warning("%s queue is full, %s%r is dropped" % (
+                self.name, function.__name__, args))
+            return False
+
+    def join(self):
+        """
+        Blocks until the queued tasks are processed
+        """
+        self.queue.join()
+
+
+def on_commit(function):
+    """
+    Calls the function after the running transaction is committed,
+    immediately on django < 1.9 or outside of a transaction
+    """
+    from django.db import transaction
+
+    if hasattr(transaction, "on_commit"):
+        transaction.on_commit(function)
+    else:
+        function()
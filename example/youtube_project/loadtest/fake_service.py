@@ -0,0 +1,133 @@
+"""
+In-process fake of the Youtube gdata service
+
+`install()` replaces the shared service of `django_youtube.api.Api`, so the
+app runs without network access. Every call sleeps for a configurable
+latency to approximate the remote service.
+"""
+import itertools
+import os
+import random
+import threading
+import time
+
+import gdata.youtube
+import gdata.youtube.service
+
+from django_youtube.testing import FEED_TEMPLATE, video_entry_xml
+
+
+class FakeYouTubeService(object):
+    """
+    Implements the methods of gdata.youtube.service.YouTubeService used by
+    `django_youtube.api.Api`
+
+    Params:
+        latency: seconds per call, a random jitter of +-50% is added
+        processing_time: seconds an uploaded video stays in processing state
+    """
+
+    def __init__(self, latency=0.05, processing_time=10):
+        self.latency = latency
+        self.processing_time = processing_time
+        self.ssl = False
+        self.developer_key = None
+        self.client_id = None
+        self.email = None
+        self.password = None
+        self.source = None
+        self.token = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        # upload times of the videos created by this service
+        self.uploaded = {}
+        self.calls = {}
+        # CheckUploadStatus only inspects the entry
+        self.real_service = gdata.youtube.service.YouTubeService()
+
+    def _call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def _entry(self, video_id):
+        upload_state = "available"
+        uploaded = self.uploaded.get(video_id)
+        if uploaded is not None and \
+                time.time() - uploaded < self.processing_time:
+            upload_state = "processing"
+        return gdata.youtube.YouTubeVideoEntryFromString(video_entry_xml(
+            video_id, upload_state, title="Video %s" % video_id,
+            description="Load test video", keywords="loadtest, fake"))
+
+    def _new_video_id(self):
+        with self.lock:
+            video_id = "fake%08d" % next(self.ids)
+            self.uploaded[video_id] = time.time()
+        return video_id
+
+    def ProgrammaticLogin(self):
+        self._call("ProgrammaticLogin")
+        self.token = "fake-token"
+
+    def GetClientLoginToken(self):
+        return self.token
+
+    def SetClientLoginToken(self, token):
+        self.token = token
+
+    def GetYouTubeVideoEntry(self, uri):
+        self._call("GetYouTubeVideoEntry")
+        return self._entry(uri.rstrip("/").rsplit("/", 1)[-1])
+
+    def GetYouTubeVideoFeed(self, uri):
+        self._call("GetYouTubeVideoFeed")
+        entries = "".join(video_entry_xml("feed%d" % i) for i in range(10))
+        return gdata.youtube.YouTubeVideoFeedFromString(
+            FEED_TEMPLATE % entries)
+
+    def InsertVideoEntry(self, video_entry, filename_or_handle):
+        self._call("InsertVideoEntry")
+        # read the file like the real service does
+        if hasattr(filename_or_handle, "read"):
+            while filename_or_handle.read(100000):
+                pass
+        else:
+            with open(filename_or_handle, "rb") as f:
+                while f.read(100000):
+                    pass
+        return self._entry(self._new_video_id())
+
+    def GetFormUploadToken(self, video_entry):
+        self._call("GetFormUploadToken")
+        return ("http://127.0.0.1/fake-upload", "fake-upload-token")
+
+    def CheckUploadStatus(self, video_entry):
+        return self.real_service.CheckUploadStatus(video_entry)
+
+    def UpdateVideoEntry(self, video_entry):
+        self._call("UpdateVideoEntry")
+        return video_entry
+
+    def DeleteVideoEntry(self, video_entry):
+        self._call("DeleteVideoEntry")
+        return True
+
+
+def install():
+    """
+    Replaces the service of the app with the fake, configured by the
+    LOADTEST_LATENCY_MS and LOADTEST_PROCESSING_SECONDS environment variables
+
+    Returns:
+        the fake service
+    """
+    from django_youtube.api import Api
+
+    if not isinstance(Api.yt_service, FakeYouTubeService):
+        Api.yt_service = FakeYouTubeService(
+            latency=float(os.environ.get("LOADTEST_LATENCY_MS", 50)) / 1000,
+            processing_time=float(
+                os.environ.get("LOADTEST_PROCESSING_SECONDS", 10)))
+    return Api.yt_service
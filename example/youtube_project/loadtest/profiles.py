@@ -0,0 +1,47 @@
+"""
+Traffic profiles of the load tests, relative weights of the endpoints
+"""
+
+PROFILES = {
+    # public pages, visitors watching videos
+    "browse": {
+        "video": 60,
+        "video_list": 30,
+        "check_video_availability": 10,
+    },
+    # browsers waiting for newly uploaded videos
+    "processing": {
+        "video": 20,
+        "check_video_availability": 80,
+    },
+    # users uploading videos
+    "upload": {
+        "upload": 40,
+        "upload_return": 40,
+        "direct_upload": 20,
+    },
+    # close to the production traffic
+    "mixed": {
+        "video": 45,
+        "video_list": 25,
+        "check_video_availability": 20,
+        "upload": 4,
+        "upload_return": 4,
+        "direct_upload": 2,
+    },
+}
+
+
+def parse(profile):
+    """
+    Returns the weights of a named profile or of a custom mix,
+    i.e. "video=70,video_list=30"
+    """
+    if profile in PROFILES:
+        return PROFILES[profile]
+
+    weights = {}
+    for part in profile.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = int(weight)
+    return weights
@@ -0,0 +1,343 @@
+"""
+Load test runner
+
+Boots the example project with the fake Youtube service, replays a traffic
+profile at the target rate and reports throughput, latency percentiles,
+error rate and remote calls per request (amplification) per endpoint.
+
+Usage (from example/youtube_project):
+    python -m loadtest.run --profile mixed --rps 20 --duration 60
+"""
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    from Queue import Queue, Empty
+    from cookielib import CookieJar
+    import urllib2
+except ImportError:
+    from queue import Queue, Empty
+    from http.cookiejar import CookieJar
+    import urllib.request as urllib2
+
+from loadtest.profiles import PROFILES, parse
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NoRedirect(urllib2.HTTPRedirectHandler):
+    """
+    Redirects are not followed, only the requested endpoint is measured
+    """
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Session(object):
+    """
+    A logged in client
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(CookieJar()), NoRedirect())
+        self.request("GET", "/loadtest/login/")
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Returns:
+            tuple of (status, body, remote calls)
+        """
+        request = urllib2.Request(self.base_url + path, body, headers or {})
+        request.get_method = lambda: method
+        try:
+            response = self.opener.open(request, timeout=60)
+        except urllib2.HTTPError as e:
+            response = e
+        content = response.read()
+        calls = int(response.info().get("X-Youtube-Api-Calls") or 0)
+        return response.getcode(), content, calls
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        ("--%s\r\n" % boundary).encode("ascii"),
+        ('Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (
+            field, filename)).encode("ascii"),
+        b"Content-Type: video/mp4\r\n\r\n",
+        data,
+        ("\r\n--%s--\r\n" % boundary).encode("ascii"),
+    ])
+    return body, {"Content-Type": "multipart/form-data; boundary=%s" % boundary}
+
+
+class Scenario(object):
+    """
+    Requests of the endpoints, each returns (status, body, calls, ok)
+    """
+
+    def __init__(self, video_ids, file_size):
+        self.video_ids = video_ids
+        self.file_size = file_size
+
+    def video(self, session):
+        status, body, calls = session.request(
+            "GET", "/youtube/video/%s/" % random.choice(self.video_ids))
+        return status, calls, status == 200
+
+    def video_list(self, session):
+        status, body, calls = session.request("GET", "/youtube/videos/")
+        return status, calls, status == 200
+
+    def check_video_availability(self, session):
+        status, body, calls = session.request(
+            "GET", "/youtube/check-video-availability/%s" %
+            random.choice(self.video_ids))
+        return status, calls, status == 200
+
+    def upload(self, session):
+        status, body, calls = session.request("GET", "/youtube/upload/")
+        return status, calls, status == 200
+
+    def upload_return(self, session):
+        status, body, calls = session.request(
+            "GET", "/youtube/upload/return/?status=200&id=ret%s" %
+            uuid.uuid4().hex[:12])
+        return status, calls, status == 302
+
+    def direct_upload(self, session):
+        # random content, duplicates would be short-circuited
+        body, headers = multipart("file_on_server", "video.mp4",
+                                  os.urandom(self.file_size))
+        status, content, calls = session.request(
+            "POST", "/youtube/direct-upload/?only_data=1", body, headers)
+        return status, calls, status == 200 and b"video_id" in content
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.late = 0
+        # from the first scheduled request to the last response
+        self.elapsed = 0
+
+    def add(self, endpoint, latency, ok, calls):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "latencies": [], "errors": 0, "calls": 0})
+            stats["latencies"].append(latency)
+            stats["calls"] += calls
+            if not ok:
+                stats["errors"] += 1
+
+    def report(self):
+        """
+        Throughput is computed over the actual elapsed time, it's longer than
+        the duration when the server falls behind
+
+        Returns:
+            dict of the endpoint reports
+        """
+        def percentile(values, p):
+            if not values:
+                return 0
+            return values[min(len(values) - 1, int(len(values) * p))]
+
+        report = {}
+        for endpoint, stats in sorted(self.endpoints.items()):
+            latencies = sorted(stats["latencies"])
+            count = len(latencies)
+            report[endpoint] = {
+                "requests": count,
+                "throughput": count / self.elapsed if self.elapsed else 0,
+                "error_rate": stats["errors"] / float(count),
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "remote_calls": stats["calls"],
+                "amplification": stats["calls"] / float(count),
+            }
+        return report
+
+
+def run_load(base_url, weights, video_ids, rps, duration, concurrency,
+             file_size):
+    """
+    Sends requests at `rps` for `duration` seconds with an open model:
+    requests are scheduled regardless of the response times and queued
+    without a limit. Latency is measured from the scheduled time, so the
+    time waiting for a free worker is included, a late start is counted when
+    a request starts more than a second after its scheduled time
+
+    Returns:
+        Stats
+    """
+    scenario = Scenario(video_ids, file_size)
+    stats = Stats()
+    queue = Queue()
+    endpoints = []
+    for name, weight in weights.items():
+        if not hasattr(scenario, name):
+            raise ValueError("Unknown endpoint %s" % name)
+        endpoints.extend([name] * weight)
+
+    stop = threading.Event()
+
+    def work():
+        session = Session(base_url)
+        while not stop.is_set() or not queue.empty():
+            try:
+                endpoint, scheduled = queue.get(timeout=0.1)
+            except Empty:
+                continue
+            if time.time() - scheduled > 1:
+                with stats.lock:
+                    stats.late += 1
+            try:
+                status, calls, ok = getattr(scenario, endpoint)(session)
+            except Exception:
+                calls, ok = 0, False
+            stats.add(endpoint, time.time() - scheduled, ok, calls)
+
+    workers = [threading.Thread(target=work) for i in range(concurrency)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    started = time.time()
+    sent = 0
+    while time.time() - started < duration:
+        due = int((time.time() - started) * rps)
+        while sent < due:
+            # the time the request should be sent, not when it's queued
+            queue.put((random.choice(endpoints), started + sent / rps))
+            sent += 1
+        time.sleep(0.005)
+
+    stop.set()
+    for worker in workers:
+        worker.join()
+    stats.elapsed = time.time() - started
+    return stats
+
+
+def manage(args, env):
+    return subprocess.check_output(
+        [sys.executable, "manage.py"] + args, cwd=PROJECT_DIR, env=env)
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib2.urlopen(url, timeout=1)
+            return
+        except urllib2.HTTPError:
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start at %s" % url)
+
+
+def print_report(report, profile, rps, duration, elapsed, late):
+    columns = ("requests", "throughput", "error_rate", "p50_ms", "p95_ms",
+               "p99_ms", "max_ms", "amplification")
+    sys.stdout.write("Profile %s, %d rps target, %d seconds, %.1f seconds "
+                     "elapsed, %d late starts\n"
+                     % (profile, rps, duration, elapsed, late))
+    sys.stdout.write("%-26s" % "endpoint" + "".join(
+        "%14s" % column for column in columns) + "\n")
+    for endpoint, row in sorted(report.items()):
+        sys.stdout.write("%-26s" % endpoint + "".join(
+            "%14.2f" % row[column] for column in columns) + "\n")
+
+
+def main():
+    parser = optparse.OptionParser(usage="python -m loadtest.run [options]")
+    parser.add_option("--profile", default="mixed",
+                      help="One of %s or a custom mix, i.e. "
+                           "video=70,video_list=30" % ", ".join(PROFILES))
+    parser.add_option("--rps", type="float", default=10,
+                      help="Target requests per second")
+    parser.add_option("--duration", type="int", default=30,
+                      help="Seconds to send requests")
+    parser.add_option("--concurrency", type="int", default=16,
+                      help="Number of concurrent clients")
+    parser.add_option("--videos", type="int", default=50,
+                      help="Number of videos to create before the test")
+    parser.add_option("--file-size", type="int", default=1024 * 1024,
+                      help="Size of the direct upload files in bytes")
+    parser.add_option("--latency-ms", type="int", default=50,
+                      help="Latency of the fake Youtube service")
+    parser.add_option("--processing-seconds", type="int", default=10,
+                      help="Seconds an uploaded video stays in processing")
+    parser.add_option("--port", type="int", default=8765)
+    parser.add_option("--report", help="Write the json report to this file")
+    options, args = parser.parse_args()
+
+    weights = parse(options.profile)
+    directory = tempfile.mkdtemp(prefix="youtube-loadtest-")
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE="loadtest.settings",
+               LOADTEST_DIR=directory,
+               LOADTEST_LATENCY_MS=str(options.latency_ms),
+               LOADTEST_PROCESSING_SECONDS=str(options.processing_seconds),
+               PYTHONPATH=os.pathsep.join(
+                   [PROJECT_DIR, os.environ.get("PYTHONPATH", "")]))
+
+    server = None
+    try:
+        try:
+            manage(["migrate", "--run-syncdb", "--noinput"], env)
+        except subprocess.CalledProcessError:
+            # django < 1.7
+            manage(["syncdb", "--noinput"], env)
+
+        video_ids = subprocess.check_output(
+            [sys.executable, "-m", "loadtest.seed", str(options.videos)],
+            cwd=PROJECT_DIR, env=env).decode("ascii").split()
+
+        base_url = "http://127.0.0.1:%d" % options.port
+        server = subprocess.Popen(
+            [sys.executable, "manage.py", "runserver", "--noreload",
+             "127.0.0.1:%d" % options.port], cwd=PROJECT_DIR, env=env)
+        wait_for(base_url + "/loadtest/login/")
+
+        stats = run_load(base_url, weights, video_ids, options.rps,
+                         options.duration, options.concurrency,
+                         options.file_size)
+        report = stats.report()
+        print_report(report, options.profile, options.rps, options.duration,
+                     stats.elapsed, stats.late)
+
+        if options.report:
+            with open(options.report, "w") as f:
+                json.dump({"profile": options.profile, "weights": weights,
+                           "rps": options.rps, "duration": options.duration,
+                           "elapsed": stats.elapsed,
+                           "late_starts": stats.late, "endpoints": report},
+                          f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
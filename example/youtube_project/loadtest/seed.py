@@ -0,0 +1,46 @@
+"""
+Creates the load test user and videos
+
+Usage: python -m loadtest.seed <number of videos>
+Prints the created video ids, one per line
+"""
+import os
+import sys
+
+
+def main(count):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "loadtest.settings")
+
+    import django
+    if hasattr(django, "setup"):
+        django.setup()
+
+    from loadtest.fake_service import install
+    from loadtest.views import get_or_create_user
+    from django_youtube.api import Api, video_id_from_entry
+    from django_youtube.models import Video
+
+    service = install()
+    user = get_or_create_user()
+
+    # seed without latency
+    latency, service.latency = service.latency, 0
+    api = Api()
+    api.authenticate()
+    entries = [api.fetch_video("seed%06d" % i, coalesce=False)
+               for i in range(count)]
+    service.latency = latency
+
+    existing = set(Video.objects.filter(user=user).values_list("video_id",
+                                                               flat=True))
+    entries = [entry for entry in entries
+               if video_id_from_entry(entry) not in existing]
+    Video.objects.create_from_entries(user, entries)
+
+    for video_id in Video.objects.filter(user=user).values_list("video_id",
+                                                                flat=True):
+        sys.stdout.write("%s\n" % video_id)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,40 @@
+"""
+Settings of the example project for load tests
+The database and media files are kept in LOADTEST_DIR
+"""
+import os
+import tempfile
+
+from youtube_project.settings import *
+
+LOADTEST_DIR = os.environ.get("LOADTEST_DIR", tempfile.gettempdir())
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+ALLOWED_HOSTS = ["*"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(LOADTEST_DIR, "loadtest.sqlite3"),
+    }
+}
+
+MEDIA_ROOT = os.path.join(LOADTEST_DIR, "media")
+
+ROOT_URLCONF = "loadtest.urls"
+
+MIDDLEWARE_CLASSES = MIDDLEWARE_CLASSES + (
+    "django_youtube.middleware.ApiCallBudgetMiddleware",
+)
+
+# remote call counts are reported by the runner
+YOUTUBE_API_CALL_HEADER = True
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"django_youtube": {"handlers": ["console"],
+                                   "level": "WARNING"}},
+}
@@ -0,0 +1,15 @@
+try:
+    from django.conf.urls import patterns, url
+except ImportError:
+    from django.conf.urls.defaults import patterns, url
+
+from loadtest.fake_service import install
+from youtube_project.urls import urlpatterns as project_urlpatterns
+
+# runs once per process, before the first request is handled
+install()
+
+urlpatterns = patterns('',
+    # logs in the load test user, the runner calls it once per session
+    url(r'^loadtest/login/$', 'loadtest.views.login', name='loadtest_login'),
+) + project_urlpatterns
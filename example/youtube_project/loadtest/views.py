@@ -0,0 +1,25 @@
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth import login as auth_login
+from django.http import HttpResponse
+
+USERNAME = "loadtest"
+PASSWORD = "loadtest"
+
+
+def get_or_create_user():
+    User = get_user_model()
+    try:
+        return User.objects.get(username=USERNAME)
+    except User.DoesNotExist:
+        return User.objects.create_user(USERNAME, "loadtest@example.com",
+                                        PASSWORD)
+
+
+def login(request):
+    """
+    Logs in the load test user
+    """
+    get_or_create_user()
+    user = authenticate(username=USERNAME, password=PASSWORD)
+    auth_login(request, user)
+    return HttpResponse(status=204)